@@ -0,0 +1,189 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+from time import perf_counter
+import compare_m2
+import scripts.rdlextra as DL
+import scripts.synthetic as synthetic
+import scripts.toolbox as toolbox
+
+# Benchmarks that need spaCy, NLTK and the resources.
+SPACY_BENCHES = ["align", "align_batch", "auto_type_edit", "format_proc_sent"]
+BENCHES = ["wagner_fischer"]+SPACY_BENCHES+["process_m2", "compare_m2"]
+MERGES = ["rules", "all-split", "all-merge", "all-equal"]
+# The (docs, context) aligned by the align_batch process pool; inherited by fork.
+BATCH = None
+
+# Input 1: A function of one item.
+# Input 2: A list of items.
+# Input 3: The number of repeats.
+# Output: The fastest total time, in seconds, to call the function on every item.
+def timeIt(func, items, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, perf_counter()-start)
+    return best
+
+# Input: The index of a pair in BATCH.
+# Output: Its edits, or the exception raised.
+def alignIndex(i):
+    import scripts.align_text as align_text
+    return align_text.alignOrError(BATCH[0][i], BATCH[1])
+
+# Output: The current git commit of the repository, or None.
+def gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.realpath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Benchmark(object):
+
+    """
+    Times each hot path separately and collects one result row per
+    (benchmark, corpus) pair.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+
+    def add(self, bench, corpus, items, seconds, **extra):
+        row = {"bench": bench, "corpus": corpus, "items": items, "seconds": seconds,
+               "ms_per_item": seconds*1000/items if items else None}
+        row.update(extra)
+        self.results.append(row)
+        print("{:<24} {:<12} {:>8} {:>10.4f} {:>12.4f}".format(bench, corpus, items, seconds, row["ms_per_item"] or 0))
+
+    # Input 1: A corpus name.
+    # Input 2: A list of (orig, cor) sentence strings.
+    def pairBenches(self, corpus, pairs):
+        args = self.args
+        if "wagner_fischer" in args.benches:
+            toks = [(orig.split(), cor.split()) for orig, cor in pairs]
+            self.add("wagner_fischer", corpus, len(toks),
+                     timeIt(lambda pair: DL.WagnerFischer(*pair), toks, args.repeat))
+        if not set(SPACY_BENCHES) & set(args.benches): return
+        docs = [(self.nlp(orig), self.nlp(cor)) for orig, cor in pairs]
+        if "format_proc_sent" in args.benches:
+            self.add("format_proc_sent", corpus, 2*len(docs),
+                     timeIt(lambda pair: [toolbox.formatProcSent(doc) for doc in pair], docs, args.repeat))
+        if "align" in args.benches:
+            for merge in MERGES:
+                align_args = argparse.Namespace(lev=False, merge=merge)
+                self.add("align:"+merge, corpus, len(docs),
+                         timeIt(lambda pair: self.align_text.getAutoAlignedEdits(pair[0], pair[1], self.nlp, align_args), docs, args.repeat))
+        if "align_batch" in args.benches:
+            # The same pairs aligned one by one, by a thread pool and by a process pool.
+            global BATCH
+            context = self.align_text.makeContext(self.nlp, merge="rules")
+            BATCH = (docs, context)
+            self.add("align_batch:serial", corpus, len(docs),
+                     timeIt(lambda _: [self.align_text.alignOrError(pair, context) for pair in docs], [None], args.repeat))
+            self.add("align_batch:threads", corpus, len(docs),
+                     timeIt(lambda _: self.align_text.alignBatch(docs, context, args.threads), [None], args.repeat), threads=args.threads)
+            with multiprocessing.Pool(args.threads) as pool:
+                self.add("align_batch:processes", corpus, len(docs),
+                         timeIt(lambda _: pool.map(alignIndex, range(len(docs))), [None], args.repeat), processes=args.threads)
+        if "auto_type_edit" in args.benches:
+            align_args = argparse.Namespace(lev=False, merge="rules")
+            edits = [(edit, orig, cor) for orig, cor in docs
+                     for edit in self.align_text.getAutoAlignedEdits(orig, cor, self.nlp, align_args)]
+            self.add("auto_type_edit", corpus, len(edits),
+                     timeIt(lambda item: self.cat_rules.autoTypeEdit(item[0], item[1], item[2], self.gb_spell,
+                                                                     self.tag_map, self.nlp, self.stemmer), edits, args.repeat))
+
+    # Input 1: A corpus name.
+    # Input 2-3: Lists of hypothesis and reference m2 blocks.
+    def corpusBenches(self, corpus, hyp_m2, ref_m2):
+        args = self.args
+        if "process_m2" in args.benches:
+            self.add("process_m2", corpus, len(ref_m2), timeIt(toolbox.processM2, ref_m2, args.repeat))
+        if "compare_m2" in args.benches:
+            score_args = argparse.Namespace(beta=0.5, verbose=False, multi=False, cat=None, det_tok=False,
+                                            det_span=False, cor_span_err=False)
+            self.add("compare_m2", corpus, len(ref_m2),
+                     timeIt(lambda _: compare_m2.evaluate(hyp_m2, ref_m2, score_args), [None], args.repeat))
+            try:
+                import numpy
+            except ImportError:
+                return
+            self.add("compare_m2:columnar", corpus, len(ref_m2),
+                     timeIt(lambda _: compare_m2.evaluateColumns(hyp_m2, ref_m2, score_args), [None], args.repeat))
+
+    def loadSpacy(self):
+        import spacy
+        from nltk.stem.lancaster import LancasterStemmer
+        import scripts.align_text as align_text
+        import scripts.cat_rules as cat_rules
+        basename = os.path.dirname(os.path.realpath(__file__))
+        print("Loading SpaCy...")
+        self.nlp = spacy.load("en_core_web_lg", disable=['ner', 'textcat'])
+        self.stemmer = LancasterStemmer()
+        self.gb_spell = toolbox.loadDictionary(basename+"/resources/en_GB-large.txt")
+        self.tag_map = toolbox.loadTagMap(basename+"/resources/en-ptb_map")
+        self.align_text = align_text
+        self.cat_rules = cat_rules
+
+    def run(self):
+        args = self.args
+        if set(SPACY_BENCHES) & set(args.benches): self.loadSpacy()
+        print("{:<24} {:<12} {:>8} {:>10} {:>12}".format("Benchmark", "Corpus", "Items", "Best(s)", "ms/item"))
+        # The sample files, as they are.
+        basename = os.path.dirname(os.path.realpath(__file__))
+        with open(basename+"/sample.src") as src, open(basename+"/sample.tgt") as tgt:
+            self.pairBenches("sample", [(orig.strip(), cor.strip()) for orig, cor in zip(src, tgt)])
+        # Synthetic pairs of increasing length.
+        for length in args.lengths:
+            rng = random.Random(args.seed)
+            pairs = synthetic.makePairs(rng, args.pairs, length, args.density, args.transposition, args.noise)
+            self.pairBenches("len="+str(length), pairs)
+        # Synthetic m2 files of increasing size.
+        for size in args.sizes:
+            rng = random.Random(args.seed)
+            hyp_m2, ref_m2 = synthetic.makeM2(rng, size, args.m2_length, args.density)
+            self.corpusBenches("sents="+str(size), hyp_m2, ref_m2)
+
+    def save(self, path):
+        settings = {name: value for name, value in vars(self.args).items() if name != "out"}
+        report = {"commit": gitCommit(), "python": platform.python_version(), "machine": platform.machine(),
+                  "settings": settings, "results": self.results}
+        with open(path, "w") as out:
+            json.dump(report, out, indent=2)
+
+def main(args):
+    bench = Benchmark(args)
+    bench.run()
+    bench.save(args.out)
+    print("Saved {} results to {}".format(len(bench.results), args.out))
+
+if __name__ == "__main__":
+    # Define and parse program input
+    parser = argparse.ArgumentParser(description="Time the edit extraction, classification and scoring hot paths on sample.src/tgt\n"
+                                                 "and on reproducible synthetic corpora, and save the results as JSON.",
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     usage="%(prog)s [-h] [options] -out OUT")
+    parser.add_argument("-out", help="The output JSON filepath.", required=True)
+    parser.add_argument("-benches", help="The benchmarks to run (default: all). align, auto_type_edit and\n"
+                                         "format_proc_sent need SpaCy.", nargs="+", choices=BENCHES, default=BENCHES)
+    parser.add_argument("-lengths", help="Synthetic sentence lengths, in tokens (default: 10 20 40 80).", type=int, nargs="+", default=[10, 20, 40, 80])
+    parser.add_argument("-pairs", help="Synthetic pairs per length (default: 20).", type=int, default=20)
+    parser.add_argument("-sizes", help="Synthetic m2 corpus sizes, in sentences (default: 1000 10000).", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("-m2_length", help="Sentence length in the synthetic m2 corpora (default: 20).", type=int, default=20)
+    parser.add_argument("-density", help="Probability that a token is edited (default: 0.15).", type=float, default=0.15)
+    parser.add_argument("-transposition", help="Probability that a transposition starts at a token (default: 0.02).", type=float, default=0.02)
+    parser.add_argument("-noise", help="Probability of case and punctuation noise per token (default: 0.02).", type=float, default=0.02)
+    parser.add_argument("-repeat", help="Time each benchmark this many times and keep the fastest (default: 3).", type=int, default=3)
+    parser.add_argument("-threads", help="Threads and processes for align_batch (default: the number of CPUs).", type=int, default=os.cpu_count())
+    parser.add_argument("-seed", help="Random seed for the synthetic corpora (default: 0).", type=int, default=0)
+    args = parser.parse_args()
+    # Run the program.
+    main(args)
@@ -0,0 +1,18 @@
+import argparse
+import scripts.m2bin as m2bin
+
+def main(args):
+    print("Converting "+args.bin+"...")
+    count = m2bin.writeM2Text(args.bin, args.out)
+    print("Wrote {} sentences to {}".format(count, args.out))
+
+if __name__ == "__main__":
+    # Define and parse program input
+    parser = argparse.ArgumentParser(description="Convert a columnar M2 binary file back into a text m2 file.",
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     usage="%(prog)s [-h] bin -out OUT")
+    parser.add_argument("bin", help="A path to an M2 binary file.")
+    parser.add_argument("-out", help="The output m2 filepath.", required=True)
+    args = parser.parse_args()
+    # Run the program.
+    main(args)
@@ -1,87 +1,113 @@
 import argparse
+import json
+from contextlib import contextmanager
 from os.path import isfile
+import scripts.m2bin as m2bin
+import scripts.offset_index as offset_index
+import scripts.stream_io as stream_io
 
-# Input: A path to an m2 file.
-# Output: A list of sentence+edits in that file.
-def loadM2(path):
+# Input 1: A path to an m2 file.
+# Input 2: An optional slice of sentence ids to load.
+# Output: A context that gives a list of sentence+edits in that file.
+# M2 binary files are memory-mapped and give pre-parsed edit lists instead;
+# the file is closed when the context exits, so only use them inside it.
+# .gz, .xz and .zst files are decompressed as they are read.
+@contextmanager
+def loadM2(path, ids=None):
 	if isfile(path):
-		return open(path).read().strip().split("\n\n")
+		if m2bin.isM2Bin(path):
+			with m2bin.M2Bin(path) as m2:
+				yield m2.editLists(ids)
+		# Seek straight to the requested sentences using the sidecar index.
+		elif ids:
+			index = offset_index.OffsetIndex.load(path, "m2")
+			yield [index.block(k) for k in range(len(index))[ids]]
+		else:
+			yield stream_io.readText(path).strip().split("\n\n")
 	else:
 		print("Error: "+path+" is not a file.")
 		exit()
 
-# Input 1: An m2 format sentence with edits.
+# Input: An m2 format sentence with edits.
+# Output: A list of edits; (start, end, cat, cor, extra, coder)
+def parseEdits(sent):
+	return [m2bin.parseEditLine(edit) for edit in sent.split("\n")[1:]]
+
+# Evaluation views; each is selected by the command line flag of the same name.
+VIEWS = ["det_tok", "det_span", "cor_span", "cor_span_err"]
+TITLES = {"det_tok": " Token-Based Detection ",
+		"det_span": " Span-Based Detection ",
+		"cor_span": " Span-Based Correction ",
+		"cor_span_err": " Span-Based Correction + Classification "}
+
+# Input: Command line options.
+# Output: The evaluation view selected by the options.
+def getView(args):
+	if args.det_tok: return "det_tok"
+	elif args.det_span: return "det_span"
+	elif args.cor_span_err: return "cor_span_err"
+	else: return "cor_span"
+
+# Input 1: An m2 format sentence with edits, or a list of its parsed edits.
 # Input 2: Command line options.
 # Output: A dictionary where key is coder and value is edit dict.
 # Each subdict might be for detection, correction, or token based detection.
 def extractEdits(sent, args):
-	coder_dict = {}
-	edits = sent.split("\n")[1:]
+	view = getView(args)
+	return extractViews(sent, [view], args.multi)[view]
+
+# Input 1: An m2 format sentence with edits, or a list of its parsed edits.
+# Input 2: A list of evaluation views.
+# Input 3: Boolean; only evaluate edits with >1 tokens on at least one side.
+# Output: A dictionary where key is view and value is the extractEdits coder dict.
+# Every edit is parsed once and its key is added to all the views together.
+def extractViews(sent, views, multi):
+	view_dicts = {view: {} for view in views}
+	edits = parseEdits(sent) if isinstance(sent, str) else sent
 	# If there are no edits, pretend there was an explicit noop
-	if not edits: edits = ["A -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||0"]
-	for edit in edits:
+	if not edits: edits = [(-1, -1, "noop", "-NONE-", "REQUIRED|||-NONE-", 0)]
+	for start, end, cat, cor, extra, coder in edits:
 		# Preprocessing
-		edit = edit[2:].split("|||") # Ignore "A " then split.
-		span = [int(i) for i in edit[0].split()]
-		start = span[0]
-		end = span[1]
-		cat = edit[1]
-		cor = edit[2]
 		cor_len = len(cor.split())
-		coder = int(edit[-1])
 		# Save coder in dict
-		if coder not in coder_dict.keys(): coder_dict[coder] = {}
-		
-		# Some filters based on args.
-		# Exclude uncorrected errors (UNK) in correction evaluation. Gold edits.
-		if not args.det_tok and not args.det_span and cat == "UNK": continue
+		for coder_dict in view_dicts.values():
+			if coder not in coder_dict.keys(): coder_dict[coder] = {}
 		# Only evaluate edits with more than one token on at least one side.
-		if args.multi and end-start < 2 and cor_len < 2: continue
-		
-		# Token Based Detection
-		if args.det_tok:
-			# Keep noop edits as they are.
-			if start == -1:
-				if (start, start) in coder_dict[coder].keys():
-					coder_dict[coder][(start, start)].append(cat)
-				else:
-					coder_dict[coder][(start, start)] = [cat]			
-			# Insertions defined as affecting the token on the right
-			elif start == end and start >= 0:
-				if (start, start+1) in coder_dict[coder].keys():
-					coder_dict[coder][(start, start+1)].append(cat)
+		if multi and end-start < 2 and cor_len < 2: continue
+		for view, coder_dict in view_dicts.items():
+			# Exclude uncorrected errors (UNK) in correction evaluation. Gold edits.
+			if cat == "UNK" and view in {"cor_span", "cor_span_err"}: continue
+			for key in editKeys(view, start, end, cat, cor):
+				if key in coder_dict[coder].keys():
+					coder_dict[coder][key].append(cat)
 				else:
-					coder_dict[coder][(start, start+1)] = [cat]
-			# Edit spans are split for each token in the range.
-			else:
-				for tok_id in range(start, end):
-					if (tok_id, tok_id+1) in coder_dict[coder].keys():
-						coder_dict[coder][(tok_id, tok_id+1)].append(cat)
-					else:
-						coder_dict[coder][(tok_id, tok_id+1)] = [cat]			
+					coder_dict[coder][key] = [cat]
+	return view_dicts
 
-		# Span Based Detection
-		elif args.det_span:
-			if (start, end) in coder_dict[coder].keys():
-				coder_dict[coder][(start, end)].append(cat)
-			else:
-				coder_dict[coder][(start, end)] = [cat]		
-		
-		# Span Based Correction
+# Input 1: An evaluation view.
+# Input 2-5: The start, end, error type and correction of an edit.
+# Output: A list of the edit dict keys of the edit in that view.
+def editKeys(view, start, end, cat, cor):
+	# Token Based Detection
+	if view == "det_tok":
+		# Keep noop edits as they are.
+		if start == -1:
+			return [(start, start)]
+		# Insertions defined as affecting the token on the right
+		elif start == end and start >= 0:
+			return [(start, start+1)]
+		# Edit spans are split for each token in the range.
 		else:
-			# With error type classification
-			if args.cor_span_err:
-				if (start, end, cat, cor) in coder_dict[coder].keys():
-					coder_dict[coder][(start, end, cat, cor)].append(cat)
-				else:
-					coder_dict[coder][(start, end, cat, cor)] = [cat]
-			# Without error type classification
-			else:
-				if (start, end, cor) in coder_dict[coder].keys():
-					coder_dict[coder][(start, end, cor)].append(cat)
-				else:
-					coder_dict[coder][(start, end, cor)] = [cat]
-	return coder_dict
+			return [(tok_id, tok_id+1) for tok_id in range(start, end)]
+	# Span Based Detection
+	elif view == "det_span":
+		return [(start, end)]
+	# Span Based Correction with error type classification
+	elif view == "cor_span_err":
+		return [(start, end, cat, cor)]
+	# Span Based Correction without error type classification
+	else:
+		return [(start, end, cor)]
 
 # Input 1: A dictionary of hypothesis edits.
 # Input 2: A dictionary of reference edits for a single annotator.
@@ -140,6 +166,18 @@ def computeFScore(tp, fp, fn, beta):
 	f = float((1+(beta**2))*p*r)/(((beta**2)*p)+r) if p+r else 0.0
 	return round(p, 4), round(r, 4), round(f, 4)
 
+# Input 1-4: The F-score, TP, FP and FN of an annotator.
+# Input 5-8: The F-score, TP, FP and FN of the best annotator so far.
+# Output: Boolean; the annotator is better than the best so far.
+def isBetter(f, tp, fp, fn, tmp_f, tmp_tp, tmp_fp, tmp_fn):
+	# 1. Save sentence with highest F-score.
+	# 2. If both have same F-score, save largest TP.
+	# 3. If both have same F-score and TP, save lowest FP.
+	# 4. If both have same F-score, TP and FP, save lowest FN.
+	return (f > tmp_f) or (f == tmp_f and tp > tmp_tp) or \
+		(f == tmp_f and tp == tmp_tp and fp < tmp_fp) or \
+		(f == tmp_f and tp == tmp_tp and fp == tmp_fp and fn < tmp_fn)
+
 # Input 1-2: Two error category dicts. Key is cat, value is list of TP, FP, FN.
 # Output: The dictionaries combined with cumulative TP, FP, FN.
 def mergeDict(dict1, dict2):
@@ -178,52 +216,23 @@ def processCategories(cat_dict, setting):
 			return cat_dict
 	return proc_cat_dict
 
-	
-if __name__ == "__main__":
-	# Define and parse program input
-	parser = argparse.ArgumentParser(description="Calculate F-scores for error detection and/or correction "
-						"between HYP and REF M2 files.\nDefault behaviour evaluates "
-						"just correction in terms of spans.\nFlags let you evaluate "
-						"both span and token based detection etc.",
-						formatter_class=argparse.RawTextHelpFormatter,
-						usage="%(prog)s [options] -hyp HYP -ref REF")
-	parser.add_argument("-hyp", help="The hypothesis M2 file", required=True)
-	parser.add_argument("-ref", help="The reference M2 file", required=True)
-	parser.add_argument("-v", "--verbose", help="Print verbose output.", action="store_true", required=False)
-	parser.add_argument("-b", "--beta", help="Value of beta in F-score. (default: 0.5)",
-						default=0.5, type=float, required=False)
-	parser.add_argument("-multi", help="Only evaluate edits with >1 tokens on at least one side.",
-						action="store_true", required=False)						
-	parser.add_argument("-cat",	help="Show error category scores.\n"
-						"1: Only show overall first level category scores; e.g. R.\n"
-						"2: Only show overall non-first level category scores; e.g. NOUN.\n"
-						"3: Show all combinations of category scores; e.g. R:NOUN.",
-						choices=[1, 2, 3], type=int, required=False)
-	type_group = parser.add_mutually_exclusive_group(required=False)
-	type_group.add_argument("-dt", "--det_tok",	help="Evaluate Token-level Detection only.", 
-						action="store_true")
-	type_group.add_argument("-ds", "--det_span", help="Evaluate Span-level Detection only.", 
-						action="store_true")
-	type_group.add_argument("-cse", "--cor_span_err",
-						help="Evaluate Span-level Correction including error types.", action="store_true")
-	args = parser.parse_args()
-
-	# Load input files.
-	hyp_m2 = loadM2(args.hyp)
-	ref_m2 = loadM2(args.ref)
-	# Make sure they have the same number of sentences
-	assert len(hyp_m2) == len(ref_m2)
-
+# Input 1: A list of hypothesis sentence+edits (see loadM2).
+# Input 2: A list of reference sentence+edits (see loadM2).
+# Input 3: Command line options.
+# Input 4: Optional reference edit dicts (see extractEdits), if already extracted.
+# Output 1-3: The global TP, FP and FN using the best annotator for each sentence.
+# Output 4: A dictionary of the error type scores of those annotators.
+def evaluate(hyp_m2, ref_m2, args, ref_dicts=None):
 	# Variables storing global TP, FP, FN and cat dicts
 	best_tp, best_fp, best_fn = 0, 0, 0
 	best_cat_dict = {}
-	
+
 	# Process each sentence
 	sents = zip(hyp_m2, ref_m2)
 	for sent_id, sent in enumerate(sents):
 		# Process the edits according to input args.
 		hyp_dict = extractEdits(sent[0], args)
-		ref_dict = extractEdits(sent[1], args)
+		ref_dict = ref_dicts[sent_id] if ref_dicts else extractEdits(sent[1], args)
 		# Compare the hyp against each ref and keep track of best so far.
 		best_coder = 0
 		tmp_f = -1
@@ -234,13 +243,8 @@ if __name__ == "__main__":
 			tp, fp, fn, cat_dict = compareEdits(hyp_dict[0], ref_edits)
 			# Score these cumulatively with previous global results.
 			p, r, f = computeFScore(tp+best_tp, fp+best_fp, fn+best_fn, args.beta)
-			# 1. Save sentence with highest F-score.
-			# 2. If both have same F-score, save largest TP.
-			# 3. If both have same F-score and TP, save lowest FP.
-			# 4. If both have same F-score, TP and FP, save lowest FN.
-			if (f > tmp_f) or (f == tmp_f and tp > tmp_tp) or \
-				(f == tmp_f and tp == tmp_tp and fp < tmp_fp) or \
-				(f == tmp_f and tp == tmp_tp and fp == tmp_fp and fn < tmp_fn):
+			# Save the best annotator for this sentence so far.
+			if isBetter(f, tp, fp, fn, tmp_f, tmp_tp, tmp_fp, tmp_fn):
 				best_coder = coder
 				tmp_f = f
 				tmp_tp, tmp_fp, tmp_fn = tp, fp, fn
@@ -269,12 +273,125 @@ if __name__ == "__main__":
 		if args.verbose:
 			print('{:-^40}'.format(""))
 			print("^^ Annotator "+str(best_coder)+" chosen for sentence "+str(sent_id))
+	return best_tp, best_fp, best_fn, best_cat_dict
+
+# Input 1: A score_table.ScoreTable.
+# Input 2: Command line options.
+# Output 1-3: The global TP, FP and FN using the best annotator for each sentence.
+# Output 4: The chosen (sentence, coder) pair index for each sentence.
+# The same best annotator selection as evaluate, over precomputed counts.
+# A pair with the most TP and the fewest FP and FN of its sentence has the best
+# F-score whatever the running totals are, so those sentences are decided at
+# once; only the others are compared one by one.
+def selectCoders(table, args):
+	import numpy as np
+	num_pairs = len(table.pair_sent)
+	if not num_pairs: return 0, 0, 0, []
+	counts = np.stack([table.tp, table.fp, table.fn], axis=1)
+	firsts = np.flatnonzero(np.diff(table.pair_sent, prepend=-1))
+	sizes = np.diff(np.append(firsts, num_pairs))
+	spread = lambda ufunc, col: np.repeat(ufunc.reduceat(col, firsts), sizes)
+	dominant = (table.tp == spread(np.maximum, table.tp)) & (table.fp == spread(np.minimum, table.fp)) & \
+		(table.fn == spread(np.minimum, table.fn))
+	# The first dominant pair of each sentence, or num_pairs if there is none.
+	chosen = np.minimum.reduceat(np.where(dominant, np.arange(num_pairs), num_pairs), firsts)
+	decided = chosen < num_pairs
+	fixed = np.zeros((len(firsts), 3), dtype=np.int64)
+	fixed[decided] = counts[chosen[decided]]
+	# The totals of the decided sentences before each sentence.
+	before = (np.cumsum(fixed, axis=0) - fixed).tolist()
+	tps, fps, fns = table.tp.tolist(), table.fp.tolist(), table.fn.tolist()
+	chosen = chosen.tolist()
+	extra_tp, extra_fp, extra_fn = 0, 0, 0
+	for sent in np.flatnonzero(~decided).tolist():
+		best_tp, best_fp, best_fn = before[sent][0]+extra_tp, before[sent][1]+extra_fp, before[sent][2]+extra_fn
+		first = firsts[sent]
+		best_pair = first
+		tmp_f = -1
+		tmp_tp, tmp_fp, tmp_fn = 0, 0, 0
+		for pair in range(first, first+sizes[sent]):
+			tp, fp, fn = tps[pair], fps[pair], fns[pair]
+			p, r, f = computeFScore(tp+best_tp, fp+best_fp, fn+best_fn, args.beta)
+			if isBetter(f, tp, fp, fn, tmp_f, tmp_tp, tmp_fp, tmp_fn):
+				best_pair = pair
+				tmp_f = f
+				tmp_tp, tmp_fp, tmp_fn = tp, fp, fn
+		extra_tp += tmp_tp
+		extra_fp += tmp_fp
+		extra_fn += tmp_fn
+		chosen[sent] = best_pair
+	total_tp, total_fp, total_fn = fixed.sum(axis=0).tolist()
+	return total_tp+extra_tp, total_fp+extra_fp, total_fn+extra_fn, chosen
+
+# Same as evaluate, but the edits of all sentences are compared at once in
+# NumPy arrays (see scripts/score_table.py), and the best annotators are
+# chosen over the resulting counts (see selectCoders).
+# Input 4: Optional reference columns (see score_table.loadColumns), if already loaded.
+def evaluateColumns(hyp_m2, ref_m2, args, ref_cols=None):
+	import scripts.score_table as score_table
+	table = score_table.ScoreTable(hyp_m2, ref_m2, args, ref_cols)
+	best_tp, best_fp, best_fn, chosen = selectCoders(table, args)
+	# Category dicts are only needed for category scores.
+	best_cat_dict = table.catDict(chosen) if args.cat else {}
+	return best_tp, best_fp, best_fn, best_cat_dict
+
+# Input 1: A list of hypothesis sentence+edits (see loadM2).
+# Input 2: A list of reference sentence+edits (see loadM2).
+# Input 3: Command line options.
+# Output: A dictionary where key is view and value is the output of evaluate for that view.
+# Each sentence is parsed once for all the views, but the best annotator is
+# still chosen independently for each view, exactly as in separate runs.
+def evaluateViews(hyp_m2, ref_m2, args):
+	results = {view: (0, 0, 0, {}) for view in VIEWS}
+	for hyp_sent, ref_sent in zip(hyp_m2, ref_m2):
+		hyp_views = extractViews(hyp_sent, VIEWS, args.multi)
+		ref_views = extractViews(ref_sent, VIEWS, args.multi)
+		for view in VIEWS:
+			best_tp, best_fp, best_fn, best_cat_dict = results[view]
+			tmp_f = -1
+			tmp_tp, tmp_fp, tmp_fn = 0, 0, 0
+			tmp_cat_dict = {}
+			for coder, ref_edits in ref_views[view].items():
+				tp, fp, fn, cat_dict = compareEdits(hyp_views[view][0], ref_edits)
+				p, r, f = computeFScore(tp+best_tp, fp+best_fp, fn+best_fn, args.beta)
+				if isBetter(f, tp, fp, fn, tmp_f, tmp_tp, tmp_fp, tmp_fn):
+					tmp_f = f
+					tmp_tp, tmp_fp, tmp_fn = tp, fp, fn
+					tmp_cat_dict = cat_dict
+			results[view] = (best_tp+tmp_tp, best_fp+tmp_fp, best_fn+tmp_fn, mergeDict(best_cat_dict, tmp_cat_dict))
+	return results
 
+# Input 1: A dictionary where key is view and value is (tp, fp, fn, cat_dict).
+# Input 2: Command line options.
+# Prints a JSON report of the overall and category scores at every level for every view.
+def printReport(results, args):
+	report = {"beta": args.beta, "multi": args.multi, "views": {}}
+	for view, (best_tp, best_fp, best_fn, best_cat_dict) in results.items():
+		p, r, f = computeFScore(best_tp, best_fp, best_fn, args.beta)
+		view_report = {"title": TITLES[view].strip(), "tp": best_tp, "fp": best_fp, "fn": best_fn,
+			"p": p, "r": r, "f": f, "cat": {}}
+		for setting in [1, 2, 3]:
+			cat_scores = {}
+			for cat, cnts in sorted(processCategories(best_cat_dict, setting).items()):
+				if cnts[0] + cnts[2] == 0: continue # Ignore hyp file placeholder error type.
+				cat_p, cat_r, cat_f = computeFScore(cnts[0], cnts[1], cnts[2], args.beta)
+				cat_scores[cat] = {"tp": cnts[0], "fp": cnts[1], "fn": cnts[2], "p": cat_p, "r": cat_r, "f": cat_f}
+			view_report["cat"][str(setting)] = cat_scores
+		report["views"][view] = view_report
+	print(json.dumps(report, indent=2))
+
+# Input: Command line options.
+# Output: The output title for the evaluation type.
+def getTitle(args):
+	return TITLES[getView(args)]
+
+# Input 1-3: The global TP, FP and FN.
+# Input 4: A dictionary of the error type scores.
+# Input 5: Command line options.
+# Prints the category scores (if required) and the overall scores.
+def printResults(best_tp, best_fp, best_fn, best_cat_dict, args):
 	# Prepare output title.
-	if args.det_tok: title = " Token-Based Detection "
-	elif args.det_span: title = " Span-Based Detection "
-	elif args.cor_span_err: title = " Span-Based Correction + Classification "
-	else: title = " Span-Based Correction "			
+	title = getTitle(args)
 
 	# Category Scores
 	if args.cat:
@@ -293,4 +410,205 @@ if __name__ == "__main__":
 	print("\t".join(["TP", "FP", "FN", "Prec", "Rec", "F"+str(args.beta)]))
 	print("\t".join(map(str, [best_tp, best_fp, best_fn]+list(computeFScore(best_tp, best_fp, best_fn, args.beta)))))
 	print('{:=^46}'.format(""))
-	print("")
\ No newline at end of file
+	print("")
+
+# Input 1: A path to a hypothesis m2 file.
+# Input 2: The reference, as loaded by loadM2.
+# Input 3: The reference edit dicts or columns, extracted only once for all hyps.
+# Input 4: Command line options.
+# Output: The same as evaluate, for this hypothesis.
+def evaluateHyp(hyp_path, ref_m2, ref_edits, args):
+	with loadM2(hyp_path, args.range) as hyp_m2:
+		# Make sure they have the same number of sentences
+		assert len(hyp_m2) == len(ref_m2), hyp_path+" and the reference have a different number of sentences."
+		if args.columnar:
+			return evaluateColumns(hyp_m2, ref_m2, args, ref_edits)
+		return evaluate(hyp_m2, ref_m2, args, ref_edits)
+
+# Input 1: A list of hypothesis m2 file paths.
+# Input 2: A path to the reference m2 file.
+# Input 3: Command line options.
+# Output: A list of (hyp_path, tp, fp, fn, cat_dict), in the same order as Input 1.
+# The reference is loaded and its edits extracted once; the hyps are scored in a process pool.
+def evaluateHyps(hyp_paths, ref_path, args):
+	from joblib import Parallel, delayed
+	with loadM2(ref_path, args.range) as ref_m2:
+		if args.columnar:
+			import scripts.score_table as score_table
+			str_ids = {}
+			ref_edits = (score_table.loadColumns(ref_m2, str_ids), str_ids)
+		else:
+			ref_edits = [extractEdits(sent, args) for sent in ref_m2]
+		# Binary files are memory-mapped, so only send the edit lists to the workers.
+		ref_m2 = list(ref_m2)
+	with Parallel(n_jobs=args.n_jobs) as parallel:
+		results = parallel(delayed(evaluateHyp)(hyp_path, ref_m2, ref_edits, args) for hyp_path in hyp_paths)
+	return [(hyp_path,)+tuple(result) for hyp_path, result in zip(hyp_paths, results)]
+
+# Input 1: A list of (hyp_path, tp, fp, fn, cat_dict), one per hypothesis.
+# Input 2: Command line options.
+# Prints one table of all the hypotheses, ranked by overall F-score, and
+# if required, one table of all their category scores.
+def printLeaderboard(results, args):
+	title = getTitle(args)
+	# Rank by F-score; ties keep the input order.
+	scored = [(result, computeFScore(result[1], result[2], result[3], args.beta)) for result in results]
+	scored.sort(key=lambda x: -x[1][2])
+	width = max([len(result[0]) for result in results]+[14])
+	# Category Scores
+	if args.cat:
+		print("")
+		print(('{:=^'+str(width+53)+'}').format(title))
+		print("Category".ljust(14), "System".ljust(width), "TP".ljust(8), "FP".ljust(8), "FN".ljust(8), "P".ljust(8), "R".ljust(8), "F"+str(args.beta))
+		cat_dicts = [(result[0], processCategories(result[4], args.cat)) for result, _ in scored]
+		for cat in sorted(set(cat for _, cat_dict in cat_dicts for cat in cat_dict)):
+			for hyp_path, cat_dict in cat_dicts:
+				cnts = cat_dict.get(cat, [0, 0, 0])
+				if cnts[0] + cnts[2] == 0: continue # Ignore hyp file placeholder error type.
+				cat_p, cat_r, cat_f = computeFScore(cnts[0], cnts[1], cnts[2], args.beta)
+				print(cat.ljust(14), hyp_path.ljust(width), str(cnts[0]).ljust(8), str(cnts[1]).ljust(8), str(cnts[2]).ljust(8), str(cat_p).ljust(8), str(cat_r).ljust(8), cat_f)
+	# Print the overall results.
+	print("")
+	print(('{:=^'+str(width+48)+'}').format(title))
+	print("\t".join(["Rank", "System".ljust(width), "TP", "FP", "FN", "Prec", "Rec", "F"+str(args.beta)]))
+	for rank, (result, prf) in enumerate(scored, 1):
+		print("\t".join(map(str, [rank, result[0].ljust(width)]+list(result[1:4])+list(prf))))
+	print(('{:=^'+str(width+48)+'}').format(""))
+	print("")
+
+# Input 1: A list of one or two hypothesis m2 file paths.
+# Input 2: A path to the reference m2 file.
+# Input 3: Command line options.
+# Prints bootstrap confidence intervals for each hypothesis and, for two
+# hypotheses, the paired bootstrap and permutation p-values of their difference.
+def printBootstrap(hyp_paths, ref_path, args):
+	import numpy as np
+	import scripts.bootstrap as bootstrap
+	import scripts.score_table as score_table
+	# Reduce each hyp to per-sentence TP, FP and FN of the chosen annotators.
+	counts = []
+	with loadM2(ref_path, args.range) as ref_m2:
+		str_ids = {}
+		ref_cols = (score_table.loadColumns(ref_m2, str_ids), str_ids)
+		for hyp_path in hyp_paths:
+			with loadM2(hyp_path, args.range) as hyp_m2:
+				# Make sure they have the same number of sentences
+				assert len(hyp_m2) == len(ref_m2), hyp_path+" and the reference have a different number of sentences."
+				table = score_table.ScoreTable(hyp_m2, ref_m2, args, ref_cols)
+			chosen = selectCoders(table, args)[3]
+			counts.append(np.stack([table.tp[chosen], table.fp[chosen], table.fn[chosen]], axis=1))
+	scores = bootstrap.bootstrapScores(counts, args.bootstrap, args.beta, args.seed)
+	# Print the intervals.
+	ci = str(round(args.ci*100, 2)).rstrip("0").rstrip(".")+"% CI"
+	title = getTitle(args)+"("+str(args.bootstrap)+" bootstrap samples) "
+	print("")
+	print('{:=^70}'.format(title))
+	print("\t".join(["TP", "FP", "FN", "Prec", ci, "Rec", ci, "F"+str(args.beta), ci, "System"]))
+	for hyp_path, sys_counts, sys_scores in zip(hyp_paths, counts, scores):
+		tp, fp, fn = sys_counts.sum(axis=0).tolist()
+		row = [tp, fp, fn]
+		for score, samples in zip(computeFScore(tp, fp, fn, args.beta), sys_scores.T):
+			lo, hi = bootstrap.percentileInterval(samples, args.ci)
+			row += [score, str(round(lo, 4))+"-"+str(round(hi, 4))]
+		print("\t".join(map(str, row+[hyp_path])))
+	# Paired significance.
+	if len(hyp_paths) == 2:
+		f1 = computeFScore(*counts[0].sum(axis=0).tolist(), args.beta)[2]
+		f2 = computeFScore(*counts[1].sum(axis=0).tolist(), args.beta)[2]
+		diffs = scores[1, :, 2] - scores[0, :, 2]
+		lo, hi = bootstrap.percentileInterval(diffs, args.ci)
+		# Paired bootstrap: how often the observed winner does not win, with the
+		# same add-one correction as the permutation test so it is never 0.
+		losses = np.sum(diffs <= 0) if f2 > f1 else np.sum(diffs >= 0)
+		boot_p = (losses+1) / (len(diffs)+1)
+		perm_p = bootstrap.permutationTest(counts[0], counts[1], args.bootstrap, args.beta, args.seed)
+		print('{:-^70}'.format(""))
+		print("F"+str(args.beta)+" difference (2nd - 1st):", round(f2-f1, 4), ci+":", str(round(lo, 4))+" to "+str(round(hi, 4)))
+		print("Paired bootstrap p-value   :", round(float(boot_p), 4))
+		print("Paired permutation p-value :", round(float(perm_p), 4))
+	print('{:=^70}'.format(""))
+	print("")
+
+if __name__ == "__main__":
+	# Define and parse program input
+	parser = argparse.ArgumentParser(description="Calculate F-scores for error detection and/or correction "
+						"between HYP and REF M2 files.\nDefault behaviour evaluates "
+						"just correction in terms of spans.\nFlags let you evaluate "
+						"both span and token based detection etc.",
+						formatter_class=argparse.RawTextHelpFormatter,
+						usage="%(prog)s [options] -hyp HYP [HYP ...] -ref REF")
+	parser.add_argument("-hyp", help="The hypothesis M2 file.\n"
+						"Give several files to score them all against the same reference in one table.",
+						nargs="+", required=True)
+	parser.add_argument("-ref", help="The reference M2 file", required=True)
+	parser.add_argument("-v", "--verbose", help="Print verbose output.", action="store_true", required=False)
+	parser.add_argument("-b", "--beta", help="Value of beta in F-score. (default: 0.5)",
+						default=0.5, type=float, required=False)
+	parser.add_argument("-multi", help="Only evaluate edits with >1 tokens on at least one side.",
+						action="store_true", required=False)						
+	parser.add_argument("-cat",	help="Show error category scores.\n"
+						"1: Only show overall first level category scores; e.g. R.\n"
+						"2: Only show overall non-first level category scores; e.g. NOUN.\n"
+						"3: Show all combinations of category scores; e.g. R:NOUN.",
+						choices=[1, 2, 3], type=int, required=False)
+	parser.add_argument("-all", help="Evaluate every view (-dt, -ds, -cse and the default) at every -cat level\n"
+						"in one pass over the files, and print them all as one JSON report.",
+						action="store_true", required=False)
+	parser.add_argument("-columnar", help="Compare the edits of all sentences at once in NumPy arrays.\n"
+						"Faster above about 5,000 sentences; gives identical scores. Requires numpy.",
+						action="store_true", required=False)
+	parser.add_argument("-n_jobs", help="The maximum number of hyp files scored concurrently (default: 8)",
+						default=8, type=int, required=False)
+	parser.add_argument("-bootstrap", help="Report bootstrap confidence intervals from this many resamples of the\n"
+						"sentences, and paired significance if there are two -hyp files. Requires numpy.",
+						type=int, required=False)
+	parser.add_argument("-ci", help="Confidence level of the bootstrap intervals. (default: 0.95)",
+						default=0.95, type=float, required=False)
+	parser.add_argument("-seed", help="Random seed for -bootstrap. (default: 0)",
+						default=0, type=int, required=False)
+	parser.add_argument("-range", help="Only evaluate sentences START:END (0-based, END exclusive).\n"
+						"Uses a byte-offset index saved next to each m2 file.",
+						type=offset_index.parseRange, required=False)
+	type_group = parser.add_mutually_exclusive_group(required=False)
+	type_group.add_argument("-dt", "--det_tok",	help="Evaluate Token-level Detection only.", 
+						action="store_true")
+	type_group.add_argument("-ds", "--det_span", help="Evaluate Span-level Detection only.", 
+						action="store_true")
+	type_group.add_argument("-cse", "--cor_span_err",
+						help="Evaluate Span-level Correction including error types.", action="store_true")
+	args = parser.parse_args()
+	if args.columnar and args.verbose:
+		parser.error("-v is not supported with -columnar")
+	if len(args.hyp) > 1 and args.verbose:
+		parser.error("-v is not supported with multiple -hyp files")
+	if args.bootstrap and len(args.hyp) > 2:
+		parser.error("-bootstrap supports one or two -hyp files")
+	if args.all and (args.det_tok or args.det_span or args.cor_span_err or args.cat or args.verbose or \
+			args.columnar or args.bootstrap or len(args.hyp) > 1):
+		parser.error("-all cannot be combined with -dt, -ds, -cse, -cat, -v, -columnar, -bootstrap or multiple -hyp files")
+
+	# Bootstrap confidence intervals and paired significance.
+	if args.bootstrap:
+		printBootstrap(args.hyp, args.ref, args)
+		exit()
+
+	# Multiple hypotheses: score them all against the same reference.
+	if len(args.hyp) > 1:
+		printLeaderboard(evaluateHyps(args.hyp, args.ref, args), args)
+		exit()
+
+	# Load input files.
+	with loadM2(args.hyp[0], args.range) as hyp_m2, loadM2(args.ref, args.range) as ref_m2:
+		# Make sure they have the same number of sentences
+		assert len(hyp_m2) == len(ref_m2)
+
+		# Score the hypothesis in every view at once.
+		if args.all:
+			printReport(evaluateViews(hyp_m2, ref_m2, args), args)
+			exit()
+		# Score the hypothesis and print the results.
+		if args.columnar:
+			best_tp, best_fp, best_fn, best_cat_dict = evaluateColumns(hyp_m2, ref_m2, args)
+		else:
+			best_tp, best_fp, best_fn, best_cat_dict = evaluate(hyp_m2, ref_m2, args)
+	printResults(best_tp, best_fp, best_fn, best_cat_dict, args)
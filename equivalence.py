@@ -0,0 +1,273 @@
+import argparse
+import importlib
+import random
+from time import perf_counter
+import compare_m2
+import scripts.rdlextra as DL
+import scripts.stream_io as stream_io
+import scripts.synthetic as synthetic
+
+# Runs a reference engine and a candidate engine side by side and checks
+# that they give exactly the same results. Each engine below knows how to
+# run one case, describe a difference and make a case smaller; failing
+# cases are shrunk greedily until no smaller case still differs.
+
+DEFAULT_CANDIDATES = {"wagner_fischer": "scripts.rdlnumpy:WagnerFischer",
+                      "get_edits": "scripts.align_text:get_edits",
+                      "compare_m2": "compare_m2:evaluateColumns"}
+
+# Input: An import path; e.g. "package.module:function"
+# Output: The object at that path.
+def loadObject(path):
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+# Input: A list.
+# Output: A generator of copies of the list with chunks removed; large chunks first.
+def removals(items):
+    size = len(items)//2
+    while size >= 1:
+        for start in range(0, len(items), size):
+            yield items[:start]+items[start+size:]
+        size //= 2
+    if len(items) == 1: yield []
+
+# Costs of standard Levenshtein, as in align_text.
+def levSubstitution(a, b, c=None, d=None):
+    return 1
+
+def levTransposition(a, b, c=None, d=None):
+    return float("inf")
+
+class WagnerFischerEngine(object):
+
+    """
+    Compares the cost and the first depth-first alignment of two
+    WagnerFischer classes. A case is a pair of token lists.
+    """
+
+    def __init__(self, candidate, args):
+        self.reference = DL.WagnerFischer
+        self.candidate = candidate
+        self.costs = {"substitution": levSubstitution, "transposition": levTransposition} if args.lev else {}
+
+    def run(self, impl, case):
+        alignments = impl(case[0], case[1], **self.costs)
+        return alignments.cost, next(alignments.alignments(True))
+
+    def smaller(self, case):
+        for orig in removals(case[0]): yield orig, case[1]
+        for cor in removals(case[1]): yield case[0], cor
+
+    def describe(self, case, ref_out, cand_out):
+        lines = ["Orig: "+" ".join(case[0]), "Cor:  "+" ".join(case[1])]
+        for name, out in [("Reference", ref_out), ("Candidate", cand_out)]:
+            if isinstance(out, Exception): lines.append(name+" raised: "+repr(out))
+            else: lines.append("{} cost {}: {}".format(name, out[0], " ".join(out[1])))
+        return lines
+
+class GetEditsEngine(object):
+
+    """
+    Compares two get_edits functions on the same reference alignment.
+    A case is a pair of sentence strings, which are parsed with spaCy.
+    """
+
+    def __init__(self, candidate, args):
+        import spacy
+        import scripts.align_text as align_text
+        print("Loading SpaCy...")
+        self.nlp = spacy.load("en_core_web_lg", disable=['ner', 'textcat'])
+        self.context = align_text.makeContext(self.nlp, lev=args.lev)
+        self.align_text = align_text
+        self.reference = align_text.get_edits
+        self.candidate = candidate
+        self.cache = {}
+
+    # Output: The parsed pair and its opcodes, computed once per case.
+    def prepare(self, case):
+        if case not in self.cache:
+            orig, cor = self.nlp(case[0]), self.nlp(case[1])
+            orig_toks, cor_toks = [tok.text for tok in orig], [tok.text for tok in cor]
+            alignment = next(DL.WagnerFischer(orig_toks, cor_toks, orig, cor, substitution=self.context.substitution,
+                                              transposition=self.context.transposition).alignments(True))
+            self.cache[case] = (orig, cor, alignment, self.align_text.get_opcodes(alignment))
+        return self.cache[case]
+
+    def run(self, impl, case):
+        orig, cor, alignment, opcodes = self.prepare(case)
+        return impl(orig, cor, opcodes)
+
+    def smaller(self, case):
+        orig, cor = case[0].split(), case[1].split()
+        for toks in removals(orig): yield " ".join(toks), case[1]
+        for toks in removals(cor): yield case[0], " ".join(toks)
+
+    def describe(self, case, ref_out, cand_out):
+        orig, cor, alignment, opcodes = self.prepare(case)
+        lines = ["Orig: "+case[0], "Cor:  "+case[1], "Alignment: "+" ".join(alignment), "Opcodes: "+str(opcodes)]
+        for name, out in [("Reference", ref_out), ("Candidate", cand_out)]:
+            if isinstance(out, Exception): lines.append(name+" raised: "+repr(out))
+            else: lines.append(name+" edits: "+", ".join("{} [{}] -> [{}]".format(
+                edit[0], orig[edit[1]:edit[2]].text, cor[edit[3]:edit[4]].text) for edit in out))
+        return lines
+
+class CompareM2Engine(object):
+
+    """
+    Compares the TP, FP, FN and category counts of two compare_m2
+    scoring functions. A case is a list of (sent_id, hyp, ref) m2 blocks.
+    """
+
+    def __init__(self, candidate, args):
+        self.reference = compare_m2.evaluate
+        self.candidate = candidate
+        self.args = argparse.Namespace(beta=0.5, verbose=False, multi=args.multi, cat=3, det_tok=args.view == "det_tok",
+                                       det_span=args.view == "det_span", cor_span_err=args.view == "cor_span_err")
+
+    def run(self, impl, case):
+        return impl([hyp for sent_id, hyp, ref in case], [ref for sent_id, hyp, ref in case], self.args)
+
+    def smaller(self, case):
+        for sents in removals(case):
+            if sents: yield sents
+        # Then drop edit lines from a single sentence.
+        if len(case) == 1:
+            sent_id, hyp, ref = case[0]
+            hyp_lines, ref_lines = hyp.split("\n"), ref.split("\n")
+            for lines in removals(hyp_lines[1:]): yield [(sent_id, "\n".join(hyp_lines[:1]+lines), ref)]
+            for lines in removals(ref_lines[1:]): yield [(sent_id, hyp, "\n".join(ref_lines[:1]+lines))]
+
+    def describe(self, case, ref_out, cand_out):
+        lines = []
+        for sent_id, hyp, ref in case:
+            lines.extend(["Sentence {}:".format(sent_id), "Hyp:", hyp, "Ref:", ref])
+        for name, out in [("Reference", ref_out), ("Candidate", cand_out)]:
+            if isinstance(out, Exception): lines.append(name+" raised: "+repr(out))
+            else: lines.append("{} TP {} FP {} FN {} categories {}".format(name, out[0], out[1], out[2], sorted(out[3].items())))
+        return lines
+
+ENGINES = {"wagner_fischer": WagnerFischerEngine, "get_edits": GetEditsEngine, "compare_m2": CompareM2Engine}
+
+# Input 1: An engine.
+# Input 2: A case.
+# Output 1-2: The reference and candidate outputs; exceptions are returned, not raised.
+# Output 3-4: The reference and candidate times.
+def runBoth(engine, case):
+    outs = []
+    times = []
+    for impl in [engine.reference, engine.candidate]:
+        start = perf_counter()
+        try:
+            outs.append(engine.run(impl, case))
+        except Exception as e:
+            outs.append(e)
+        times.append(perf_counter()-start)
+    return outs[0], outs[1], times[0], times[1]
+
+# Two engines that raise the same error on a case agree on it.
+def differs(ref_out, cand_out):
+    if isinstance(ref_out, Exception) or isinstance(cand_out, Exception):
+        return repr(ref_out) != repr(cand_out)
+    return ref_out != cand_out
+
+# Input 1: An engine.
+# Input 2: A case where the engines differ.
+# Output: The smallest case found that still differs.
+def shrink(engine, case):
+    shrunk = True
+    while shrunk:
+        shrunk = False
+        for smaller in engine.smaller(case):
+            if differs(*runBoth(engine, smaller)[:2]):
+                case = smaller
+                shrunk = True
+                break
+    return case
+
+# Input: Command line args.
+# Output: A list of (case name, case) to check.
+def loadCases(args):
+    rng = random.Random(args.seed)
+    if args.engine == "compare_m2":
+        if args.fuzz:
+            cases = []
+            for i in range(args.fuzz):
+                hyp_m2, ref_m2 = synthetic.makeM2(rng, args.fuzz_sents, rng.randint(3, args.fuzz_length), args.density)
+                cases.append(("fuzz "+str(i), list(zip(range(len(hyp_m2)), hyp_m2, ref_m2))))
+            return cases
+        with compare_m2.loadM2(args.hyp) as hyp_m2, compare_m2.loadM2(args.ref) as ref_m2:
+            return [("corpus", list(zip(range(len(hyp_m2)), hyp_m2, ref_m2)))]
+    if args.fuzz:
+        pairs = [synthetic.makePair(rng, rng.randint(1, args.fuzz_length), args.density, args.transposition, args.noise)
+                 for _ in range(args.fuzz)]
+        names = ["fuzz "+str(i) for i in range(args.fuzz)]
+    else:
+        with stream_io.openFile(args.orig) as orig, stream_io.openFile(args.cor) as cor:
+            pairs = [(o.split(), c.split()) for o, c in zip(orig, cor)]
+        names = ["line "+str(i) for i in range(len(pairs))]
+    # get_edits parses strings, so cases must be hashable.
+    if args.engine == "get_edits": pairs = [(" ".join(orig), " ".join(cor)) for orig, cor in pairs]
+    return list(zip(names, pairs))
+
+def main(args):
+    candidate = loadObject(args.candidate or DEFAULT_CANDIDATES[args.engine])
+    engine = ENGINES[args.engine](candidate, args)
+    cases = loadCases(args)
+    print("Checking {} {} case(s)...".format(len(cases), args.engine))
+    ref_time = cand_time = 0
+    num_diffs = 0
+    first = None
+    for name, case in cases:
+        ref_out, cand_out, ref_secs, cand_secs = runBoth(engine, case)
+        ref_time += ref_secs
+        cand_time += cand_secs
+        if differs(ref_out, cand_out):
+            num_diffs += 1
+            if not first: first = (name, case, ref_out, cand_out)
+    print("Reference: {:.4f}s, candidate: {:.4f}s, speedup: {:.2f}x".format(
+        ref_time, cand_time, ref_time/cand_time if cand_time else float("inf")))
+    if not first:
+        print("Identical on all {} case(s).".format(len(cases)))
+        return
+    print("Different on {} of {} case(s). First difference ({}):".format(num_diffs, len(cases), first[0]))
+    name, case, ref_out, cand_out = first
+    for line in engine.describe(case, ref_out, cand_out): print(line)
+    if not args.no_shrink:
+        case = shrink(engine, case)
+        print("\nShrunk to:")
+        for line in engine.describe(case, *runBoth(engine, case)[:2]): print(line)
+    exit(1)
+
+if __name__ == "__main__":
+    # Define and parse program input
+    parser = argparse.ArgumentParser(description="Check that a candidate engine gives byte-identical results to the reference\n"
+                                                 "WagnerFischer, get_edits or compare_m2 scoring, and how much faster it is.",
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     usage="%(prog)s [-h] engine [options] (-fuzz N | -orig ORIG -cor COR | -hyp HYP -ref REF)")
+    parser.add_argument("engine", choices=sorted(ENGINES))
+    parser.add_argument("-candidate", help="The candidate engine as module:name, with the same signature as the reference.\n"
+                                           "Defaults: "+", ".join(engine+"="+path for engine, path in sorted(DEFAULT_CANDIDATES.items())))
+    parser.add_argument("-orig", help="Original text file (wagner_fischer, get_edits).")
+    parser.add_argument("-cor", help="Corrected text file (wagner_fischer, get_edits).")
+    parser.add_argument("-hyp", help="Hypothesis m2 file (compare_m2).")
+    parser.add_argument("-ref", help="Reference m2 file (compare_m2).")
+    parser.add_argument("-fuzz", help="Check N random synthetic cases instead of files.", type=int, default=0, metavar="N")
+    parser.add_argument("-fuzz_length", help="Maximum synthetic sentence length (default: 30).", type=int, default=30)
+    parser.add_argument("-fuzz_sents", help="Sentences per synthetic compare_m2 case (default: 20).", type=int, default=20)
+    parser.add_argument("-density", help="Synthetic edit density (default: 0.2).", type=float, default=0.2)
+    parser.add_argument("-transposition", help="Synthetic transposition rate (default: 0.05).", type=float, default=0.05)
+    parser.add_argument("-noise", help="Synthetic case/punctuation noise (default: 0.05).", type=float, default=0.05)
+    parser.add_argument("-seed", help="Random seed (default: 0).", type=int, default=0)
+    parser.add_argument("-lev", help="Use standard Levenshtein costs (wagner_fischer, get_edits).", action="store_true")
+    parser.add_argument("-view", choices=["det_tok", "det_span", "cor_span", "cor_span_err"], default="cor_span",
+                        help="The compare_m2 evaluation view (default: cor_span).")
+    parser.add_argument("-multi", help="Only evaluate multi-token edits (compare_m2).", action="store_true")
+    parser.add_argument("-no_shrink", help="Do not shrink the first difference.", action="store_true")
+    args = parser.parse_args()
+    if not args.fuzz and args.engine == "compare_m2" and not (args.hyp and args.ref):
+        parser.error("compare_m2 needs -fuzz or -hyp and -ref")
+    if not args.fuzz and args.engine != "compare_m2" and not (args.orig and args.cor):
+        parser.error(args.engine+" needs -fuzz or -orig and -cor")
+    # Run the program.
+    main(args)
@@ -0,0 +1,121 @@
+import argparse
+from itertools import count
+from nltk.tokenize.moses import MosesDetokenizer
+import compare_m2
+import scripts.annotator as annotator
+import scripts.m2bin as m2bin
+import scripts.offset_index as offset_index
+import scripts.stream_io as stream_io
+from tqdm import tqdm
+
+# The extra fields of an automatic edit; see toolbox.formatEdit.
+EXTRA = "REQUIRED|||-NONE-"
+NOOP = (-1, -1, "noop", "-NONE-", EXTRA, 0)
+
+# Input: An annotator.Annotation.
+# Output: Its edits as parsed m2 edits; (start, end, cat, cor, extra, coder)
+def annotationEdits(annotation):
+    if annotation.noop: return [NOOP]
+    return [(edit.o_start, edit.o_end, edit.type, edit.c_str, EXTRA, 0) for edit in annotation.edits]
+
+# Input 1: An iterable of (source, hypothesis) sentence lines.
+# Input 2: An annotator.Annotator.
+# Input 3: Command line args.
+# Output 1: A list of parsed hypothesis edits for every sentence, as compare_m2.evaluate takes them.
+# Output 2: A list of the number of source tokens in every sentence.
+# Each source sentence is parsed once, and no m2 text is written or read.
+def extractHypEdits(pairs, annot, args):
+    detokenizer = MosesDetokenizer()
+    hyp_edits = []
+    src_lens = []
+    failed = 0
+    texts = []
+    for orig_sent, cor_sent in pairs:
+        # Detokenize sents if they're pre-tokenized, exactly as parallel_to_m2 does.
+        if args.is_tokenized_orig: orig_sent = detokenizer.detokenize(orig_sent.strip().split(), return_str=True)
+        if args.is_tokenized_cor: cor_sent = detokenizer.detokenize(cor_sent.strip().split(), return_str=True)
+        texts.append((orig_sent.strip(), cor_sent.strip()))
+    for sent_id, annotation in zip(count(), annot.annotate_batch(tqdm(texts), args.batch_size)):
+        # A pair that cannot be annotated is scored as if the system made no changes.
+        if isinstance(annotation, Exception):
+            failed += 1
+            print("\nFailed to annotate sentence {}; scoring it as a noop: {}".format(sent_id, annotation))
+            hyp_edits.append([NOOP])
+            src_lens.append(None)
+            continue
+        hyp_edits.append(annotationEdits(annotation))
+        src_lens.append(len(annotation.orig))
+    if failed: print("{} sentences could not be annotated.".format(failed))
+    return hyp_edits, src_lens
+
+# Input 1: The reference, as loaded by compare_m2.loadM2.
+# Input 2: A list of the number of source tokens in every sentence.
+# Prints a warning if the source is tokenized differently from the reference,
+# since the edit offsets would not be comparable.
+def checkTokenization(ref_m2, src_lens):
+    if isinstance(ref_m2, m2bin.EditLists): return
+    mismatched = [sent_id for sent_id, (sent, src_len) in enumerate(zip(ref_m2, src_lens))
+                  if src_len is not None and len(sent.split("\n", 1)[0].split()) - 1 != src_len]
+    if mismatched:
+        print("Warning: {} source sentences are tokenized differently from the reference S line, e.g. sentence {}.".format(
+            len(mismatched), mismatched[0]))
+
+def main(args):
+    # Load the reference once; with -range, only the requested sentences are read.
+    with compare_m2.loadM2(args.ref, args.range) as ref_m2:
+        print("Loading SpaCy...")
+        annot = annotator.Annotator(args=args)
+        print("Processing files...")
+        with stream_io.openFile(args.src) as src, stream_io.openFile(args.hyp) as hyp:
+            pairs = zip(src, hyp)
+            # Seek straight to the requested sentence pairs using the sidecar indexes.
+            if args.range:
+                pairs = zip(offset_index.iterLines(args.src, args.range), offset_index.iterLines(args.hyp, args.range))
+            hyp_edits, src_lens = extractHypEdits(pairs, annot, args)
+        # Make sure they have the same number of sentences
+        assert len(hyp_edits) == len(ref_m2), "The source/hypothesis and the reference have a different number of sentences."
+        checkTokenization(ref_m2, src_lens)
+        # Score the hypothesis edits straight against the reference.
+        if args.all:
+            compare_m2.printReport(compare_m2.evaluateViews(hyp_edits, ref_m2, args), args)
+            return
+        best_tp, best_fp, best_fn, best_cat_dict = compare_m2.evaluate(hyp_edits, ref_m2, args)
+        compare_m2.printResults(best_tp, best_fp, best_fn, best_cat_dict, args)
+
+if __name__ == "__main__":
+    # Define and parse program input
+    parser = argparse.ArgumentParser(description="Score a system in one step: extract and classify the edits between the source and\n"
+                                                 "hypothesis text files (1 sentence per line) in memory, and compare them with a reference\n"
+                                                 "M2 file. Gives the same scores as parallel_to_m2.py followed by compare_m2.py.",
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     usage="%(prog)s [-h] [options] -src SRC -hyp HYP -ref REF")
+    parser.add_argument("-src", help="The path to the source text file.", required=True)
+    parser.add_argument("-hyp", help="The path to the hypothesis text file.", required=True)
+    parser.add_argument("-ref", help="The reference M2 (or M2 binary) file.", required=True)
+    parser.add_argument("-range", help="Only evaluate sentences START:END (0-based, END exclusive).\n"
+                                       "Uses byte-offset indexes saved next to the files.", type=offset_index.parseRange)
+    parser.add_argument("-lev", help="Use standard Levenshtein to align sentences.", action="store_true")
+    parser.add_argument("-merge", choices=["rules", "all-split", "all-merge", "all-equal"], default="rules",
+                        help="Choose a merging strategy for automatic alignment (default: rules).\n"
+                             "See parallel_to_m2.py.")
+    parser.add_argument("-is_tokenized_orig", help="True if source sentences are tokenized by space. Otherwise we will detokenized them.", action="store_true")
+    parser.add_argument("-is_tokenized_cor", help="True if hypothesis sentences are tokenized by space. Otherwise we will detokenized them.", action="store_true")
+    parser.add_argument("-batch_size", help="Sentence pairs parsed by spaCy at a time (default: 256).", type=int, default=256)
+    parser.add_argument("-v", "--verbose", help="Print verbose output.", action="store_true")
+    parser.add_argument("-b", "--beta", help="Value of beta in F-score. (default: 0.5)", default=0.5, type=float)
+    parser.add_argument("-multi", help="Only evaluate edits with >1 tokens on at least one side.", action="store_true")
+    parser.add_argument("-cat", help="Show error category scores.\n"
+                                     "1: Only show overall first level category scores; e.g. R.\n"
+                                     "2: Only show overall non-first level category scores; e.g. NOUN.\n"
+                                     "3: Show all combinations of category scores; e.g. R:NOUN.",
+                        choices=[1, 2, 3], type=int)
+    parser.add_argument("-all", help="Evaluate every view at every -cat level and print one JSON report; see compare_m2.py.", action="store_true")
+    type_group = parser.add_mutually_exclusive_group(required=False)
+    type_group.add_argument("-dt", "--det_tok", help="Evaluate Token-level Detection only.", action="store_true")
+    type_group.add_argument("-ds", "--det_span", help="Evaluate Span-level Detection only.", action="store_true")
+    type_group.add_argument("-cse", "--cor_span_err", help="Evaluate Span-level Correction including error types.", action="store_true")
+    args = parser.parse_args()
+    if args.all and (args.det_tok or args.det_span or args.cor_span_err or args.cat or args.verbose):
+        parser.error("-all cannot be combined with -dt, -ds, -cse, -cat or -v")
+    # Run the program.
+    main(args)
@@ -0,0 +1,23 @@
+import argparse
+import sys
+import scripts.m2bin as m2bin
+
+def main(args):
+    print("Converting "+args.m2+"...")
+    try:
+        count = m2bin.writeM2Bin(args.m2, args.out)
+    except ValueError as e:
+        sys.exit("Error: {}\nOnly well-formed m2 blocks (an S line, an optional T line and A lines) can be converted.".format(e))
+    print("Wrote {} sentences to {}".format(count, args.out))
+
+if __name__ == "__main__":
+    # Define and parse program input
+    parser = argparse.ArgumentParser(description="Convert a text m2 file into a columnar M2 binary file.\n"
+                                                 "The binary file can be read directly by compare_m2.py and m2_to_m2.py.",
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     usage="%(prog)s [-h] m2 -out OUT")
+    parser.add_argument("m2", help="A path to an m2 file.")
+    parser.add_argument("-out", help="The output M2 binary filepath.", required=True)
+    args = parser.parse_args()
+    # Run the program.
+    main(args)
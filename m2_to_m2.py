@@ -4,6 +4,10 @@ import spacy
 from nltk.stem.lancaster import LancasterStemmer
 import scripts.align_text as align_text
 import scripts.cat_rules as cat_rules
+import scripts.m2bin as m2bin
+import scripts.offset_index as offset_index
+import scripts.profiler as profiler
+import scripts.stream_io as stream_io
 import scripts.toolbox as toolbox
 
 def main(args):
@@ -18,15 +22,27 @@ def main(args):
 	gb_spell = toolbox.loadDictionary(basename+"/resources/en_GB-large.txt")
 	# Part of speech map file
 	tag_map = toolbox.loadTagMap(basename+"/resources/en-ptb_map")	
-	# Setup output m2 file
-	out_m2 = open(args.out, "w")
+	# Setup output m2 file; it is compressed if its name ends in .gz, .xz or .zst.
+	out_m2 = stream_io.openFile(args.out, "w")
 
+	# Time each stage of the pipeline, if required.
+	if args.profile: profiler.start(0, args.rule_stats)
 	print("Processing files...")
-	# Open the m2 file and split into sentence+edit chunks.
-	m2_file = open(args.m2).read().strip().split("\n\n")
-	for info in m2_file:
-		# Get the original and corrected sentence + edits for each annotator.
-		orig_sent, coder_dict = toolbox.processM2(info)
+	# M2 binary files are memory-mapped and their edits are already parsed.
+	if m2bin.isM2Bin(args.m2):
+		m2_file = m2bin.M2Bin(args.m2)
+		m2_sents = (m2_file.processM2(i) for i in range(len(m2_file))[args.range or slice(None)])
+	# Seek straight to the requested sentences using the sidecar index.
+	elif args.range:
+		m2_file = offset_index.OffsetIndex.load(args.m2, "m2")
+		m2_sents = (toolbox.processM2(m2_file.block(i)) for i in range(len(m2_file))[args.range])
+	# Otherwise, open the m2 file and split into sentence+edit chunks.
+	else:
+		m2_file = stream_io.readText(args.m2).strip().split("\n\n")
+		m2_sents = (toolbox.processM2(info) for info in m2_file)
+	# Get the original and corrected sentence + edits for each annotator.
+	for orig_sent, coder_dict in m2_sents:
+		profiler.count("sentences")
 		# Write the orig_sent to the output m2 file.
 		out_m2.write("S "+" ".join(orig_sent)+"\n")
 		# Only process sentences with edits.
@@ -43,8 +59,11 @@ def main(args):
 					continue
 				# Markup the orig and cor sentence with spacy (assume tokenized)
 				# Orig is marked up only once for the first coder that needs it.
-				proc_orig = toolbox.applySpacy(orig_sent, nlp) if not proc_orig else proc_orig
-				proc_cor = toolbox.applySpacy(cor_sent, nlp)
+				if not proc_orig:
+					with profiler.stage("parse_orig"):
+						proc_orig = toolbox.applySpacy(orig_sent, nlp)
+				with profiler.stage("parse_cor"):
+					proc_cor = toolbox.applySpacy(cor_sent, nlp)
 				# Loop through gold edits.
 				for gold_edit in gold_edits:
 					# Um and UNK edits (uncorrected errors) are always preserved.
@@ -56,7 +75,8 @@ def main(args):
 					elif args.gold:
 						# Minimise the edit; e.g. [has eaten -> was eaten] = [has -> was]
 						if not args.max_edits:
-							gold_edit = toolbox.minimiseEdit(gold_edit, proc_orig, proc_cor)
+							with profiler.stage("minimise"):
+								gold_edit = toolbox.minimiseEdit(gold_edit, proc_orig, proc_cor)
 							# If minimised to nothing, the edit disappears.
 							if not gold_edit: continue
 						# Give the edit an automatic error type.
@@ -65,6 +85,7 @@ def main(args):
 							gold_edit[2] = cat
 						# Write the edit to the output m2 file.
 						out_m2.write(toolbox.formatEdit(gold_edit, coder)+"\n")
+						profiler.count("edits")
 				# Auto edits
 				if args.auto:
 					# Auto align the parallel sentences and extract the edits.
@@ -76,21 +97,28 @@ def main(args):
 						auto_edit[2] = cat
 						# Write the edit to the output m2 file.
 						out_m2.write(toolbox.formatEdit(auto_edit, coder)+"\n")
+					profiler.count("edits", len(auto_edits))
 		# Write a newline when there are no more coders.
 		out_m2.write("\n")
+	out_m2.close()
+	if isinstance(m2_file, m2bin.M2Bin): m2_file.close()
+	# Report the time spent in each stage.
+	if args.profile: profiler.finish(profiler.stop(), args)
 
 if __name__ == "__main__":
 	# Define and parse program input
 	parser = argparse.ArgumentParser(description="Automatically extract and/or type edits in an m2 file.",
 								formatter_class=argparse.RawTextHelpFormatter,
 								usage="%(prog)s [-h] (-auto | -gold) [options] m2 -out OUT")
-	parser.add_argument("m2", help="A path to an m2 file.")
+	parser.add_argument("m2", help="A path to an m2 file or M2 binary file.")
 	type_group = parser.add_mutually_exclusive_group(required=True)
 	type_group.add_argument("-auto", help="Extract edits automatically.", action="store_true")
 	type_group.add_argument("-gold", help="Use existing edit alignments.",	action="store_true")
 	parser.add_argument("-out",	help="The output filepath.", required=True)		
 	parser.add_argument("-max_edits", help="Do not minimise edit spans. (gold only)", action="store_true")
 	parser.add_argument("-old_cats", help="Do not reclassify the edits. (gold only)", action="store_true")
+	parser.add_argument("-range", help="Only process sentences START:END (0-based, END exclusive).\n"
+						"Uses a byte-offset index saved next to the m2 file.", type=offset_index.parseRange)
 	parser.add_argument("-lev",	help="Use standard Levenshtein to align sentences.", action="store_true")
 	parser.add_argument("-merge", choices=["rules", "all-split", "all-merge", "all-equal"], default="rules",
 						help="Choose a merging strategy for automatic alignment.\n"
@@ -98,5 +126,10 @@ if __name__ == "__main__":
 								"all-split: Merge nothing; e.g. MSSDI -> M, S, S, D, I\n"
 								"all-merge: Merge adjacent non-matches; e.g. MSSDI -> M, SSDI\n"
 								"all-equal: Merge adjacent same-type non-matches; e.g. MSSDI -> M, SS, D, I")
+	parser.add_argument("-profile", help="Print per-stage timings (count, total, mean, p50, p95, p99, max) when done.", action="store_true")
+	parser.add_argument("-profile_json", help="Also save the -profile timings to this JSON file.")
+	parser.add_argument("-rule_stats", help="Also count how often each merge rule fires and each error type is assigned, and time the\n"
+						"expensive checks (check_split, char_cost, SequenceMatcher, sameLemma). Implies -profile.", action="store_true")
 	args = parser.parse_args()
-	main(args)
\ No newline at end of file
+	if args.profile_json or args.rule_stats: args.profile = True
+	main(args)
\ No newline at end of file
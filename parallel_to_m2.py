@@ -1,38 +1,76 @@
 import argparse
 import os
-import spacy
-from nltk.stem.lancaster import LancasterStemmer
 from nltk.tokenize.moses import MosesDetokenizer
-import scripts.align_text as align_text
-import scripts.cat_rules as cat_rules
-import scripts.toolbox as toolbox
+import scripts.annotator as annotator
+import scripts.dedup as dedup
+import scripts.features as features
+import scripts.offset_index as offset_index
+import scripts.pipeline as pipeline
+import scripts.profiler as profiler
+import scripts.result_cache as result_cache
+import scripts.stream_io as stream_io
+from itertools import count
+from time import perf_counter
 from tqdm import tqdm
 import sys
 
 def main(args):
-    # Get base working directory.
-    basename = os.path.dirname(os.path.realpath(__file__))
     print("Loading SpaCy...")
     # Load Tokenizer and other resources
     print("Note: disable unecessary pipelines: ner, textcats")
-    nlp = spacy.load("en_core_web_lg", disable=['ner', 'textcat'])
-    # Lancaster Stemmer
-    stemmer = LancasterStemmer()
+    # SpaCy, the Lancaster Stemmer, the GB English word list (inc -ise and -ize) and the part of speech map.
+    annot = annotator.Annotator(args=args)
     # Moses Detokenizer
     detokenizer = MosesDetokenizer()
-    # GB English word list (inc -ise and -ize)
-    gb_spell = toolbox.loadDictionary(basename+"/resources/en_GB-large.txt")
-    # Part of speech map file
-    tag_map = toolbox.loadTagMap(basename+"/resources/en-ptb_map")
-    # Setup output m2 file
-    out_m2 = open(args.out, "w")
+    # Parse and align in separate, overlapping stages, if required.
+    if args.pipeline:
+        pipeline.run(args, annot, detokenizer)
+        return
+    # Setup output m2 file; it is compressed if its name ends in .gz, .xz or .zst.
+    out_m2 = stream_io.openFile(args.out, "w")
+    # Save the token features in a sidecar instead of the S and T lines, if required.
+    feature_writer = features.FeatureWriter() if args.features_out else None
     # Compute missing examples count
     missing_count = 0
+    # Duplicate pairs copy the block of their first copy, if required.
+    deduper = dedup.PairDeduplicator(out_m2, args.dedup_entries) if args.dedup else None
+    # Reuse the m2 blocks of pairs processed by earlier runs with the same settings, if required.
+    cache = None
+    if args.cache:
+        cache = result_cache.ResultCache(args.cache, int(args.cache_mb*1024*1024))
+        settings_key = result_cache.settingsKey(args, annot.nlp, annotator.RESOURCES)
+    # Time each stage of the pipeline and trace the slowest pairs, if required.
+    if args.profile: profiler.start(args.trace, args.rule_stats)
     print("Processing files...")
     # Open the original and corrected text files.
-    with open(args.orig) as orig, open(args.cor) as cor:
+    with stream_io.openFile(args.orig) as orig, stream_io.openFile(args.cor) as cor:
+        pairs = zip(orig, cor)
+        # Seek straight to the requested sentence pairs using the sidecar indexes.
+        if args.range:
+            pairs = zip(offset_index.iterLines(args.orig, args.range), offset_index.iterLines(args.cor, args.range))
+        # Line numbers of the pairs, for tracing.
+        line_ids = range(len(offset_index.OffsetIndex.load(args.orig, "lines")))[args.range] if args.range else count()
         # Process each pre-aligned sentence pair.
-        for orig_sent, cor_sent in tqdm(zip(orig, cor)):
+        for line_id, (orig_sent, cor_sent) in zip(line_ids, tqdm(pairs)):
+            pair_start = perf_counter()
+            profiler.count("pairs")
+            if deduper or cache:
+                key = dedup.pairKey(orig_sent, cor_sent, args.is_tokenized_orig, args.is_tokenized_cor)
+            if deduper:
+                out_m2_str = deduper.lookup(key)
+                if out_m2_str is not None:
+                    profiler.count("duplicates")
+                    if out_m2_str: deduper.writeCopy(out_m2_str)
+                    else: missing_count += 1
+                    continue
+            if cache:
+                cache_key = result_cache.cacheKey(settings_key, key)
+                out_m2_str = cache.get(cache_key)
+                if out_m2_str is not None:
+                    profiler.count("cache_hits")
+                    if deduper: deduper.write(key, out_m2_str)
+                    else: out_m2.write(out_m2_str)
+                    continue
             try:
                 # Check sentence length:
                 if len(orig_sent.strip().split()) < 3:
@@ -40,41 +78,47 @@ def main(args):
                 if len(cor_sent.strip().split()) < 3:
                     raise Exception('Target sentence is too short.')
                 # Detokenize sents if they're pre-tokenized. Otherwise the result will be wrong.
-                if args.is_tokenized_orig:
-                    orig_sent = detokenizer.detokenize(orig_sent.strip().split(), return_str=True)
-                if args.is_tokenized_cor:
-                    cor_sent = detokenizer.detokenize(cor_sent.strip().split(), return_str=True)
-                # Markup the parallel sentences with spacy (assume tokenized)
-                proc_orig = toolbox.applySpacy(orig_sent.strip(), nlp)
-                proc_cor = toolbox.applySpacy(cor_sent.strip(), nlp)
-                # Write the original sentence to the output m2 file.
-                out_m2.write("S " + toolbox.formatProcSent(proc_orig, feature_delimiter=args.feature_delimiter) + "\n")
-                out_m2.write("T " + toolbox.formatProcSent(proc_cor, feature_delimiter=args.feature_delimiter) + "\n")
-                # Identical sentences have no edits, so just write noop.
-                if orig_sent.strip() == cor_sent.strip():
-                    out_m2.write("A -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||0\n")
-                # Otherwise, do extra processing.
-                else:
-                    # Auto align the parallel sentences and extract the edits.
-                    auto_edits = align_text.getAutoAlignedEdits(proc_orig, proc_cor, nlp, args)
-                    # Loop through the edits.
-                    for auto_edit in auto_edits:
-                        # Give each edit an automatic error type.
-                        cat = cat_rules.autoTypeEdit(auto_edit, proc_orig, proc_cor, gb_spell, tag_map, nlp, stemmer)
-                        auto_edit[2] = cat
-                        # Write the edit to the output m2 file.
-                        out_m2.write(toolbox.formatEdit(auto_edit)+"\n")
-                # Write a newline when there are no more edits.
-                out_m2.write("\n")
+                with profiler.stage("detokenize"):
+                    if args.is_tokenized_orig:
+                        orig_sent = detokenizer.detokenize(orig_sent.strip().split(), return_str=True)
+                    if args.is_tokenized_cor:
+                        cor_sent = detokenizer.detokenize(cor_sent.strip().split(), return_str=True)
+                # Parse, align and classify the pair.
+                annotation = annot.annotate(orig_sent.strip(), cor_sent.strip())
+                # Format the whole m2 block.
+                with profiler.stage("format"):
+                    out_m2_str = annot.format_m2(annotation, args.feature_delimiter, plain=bool(feature_writer))
+                    if feature_writer: block_features = features.docFeatures(annotation.orig), features.docFeatures(annotation.cor)
+                # Write the whole block at once, so failed pairs write nothing.
+                if deduper: deduper.write(key, out_m2_str)
+                else: out_m2.write(out_m2_str)
+                if feature_writer: feature_writer.add(*block_features)
+                # Failed pairs are not cached, so they are retried next time.
+                if cache: cache.put(cache_key, out_m2_str)
             except KeyboardInterrupt:
                 sys.exit(1)
             except:
+                if deduper: deduper.write(key, "")
                 missing_count += 1
+                profiler.count("ignored")
                 print('\nMissing count:', missing_count)
                 print('- Source: ', orig_sent)
                 print('- Target: ', cor_sent)
                 print()
                 continue
+            finally:
+                profiler.endPair(line_id, orig_sent, cor_sent, pair_start)
+    if deduper:
+        deduper.close()
+        print("Deduplicated {} of {} pairs ({:.2%}); {} unique pairs were processed.".format(
+            deduper.duplicates, deduper.unique+deduper.duplicates, deduper.ratio(), deduper.unique))
+    if cache:
+        print("Reused {} cached m2 blocks; {} pairs were not in the cache.".format(cache.hits, cache.misses))
+        cache.close()
+    out_m2.close()
+    if feature_writer: feature_writer.write(args.features_out)
+    # Report the time spent in each stage.
+    if args.profile: profiler.finish(profiler.stop(), args)
 
 if __name__ == "__main__":
     # Define and parse program input
@@ -84,6 +128,8 @@ if __name__ == "__main__":
     parser.add_argument("-orig", help="The path to the original text file.", required=True)
     parser.add_argument("-cor", help="The path to the corrected text file.", required=True)
     parser.add_argument("-out",     help="The output filepath.", required=True)
+    parser.add_argument("-range", help="Only process sentence pairs START:END (0-based, END exclusive).\n"
+                                       "Uses byte-offset indexes saved next to the text files.", type=offset_index.parseRange)
     parser.add_argument("-lev",     help="Use standard Levenshtein to align sentences.", action="store_true")
     parser.add_argument("-merge", choices=["rules", "all-split", "all-merge", "all-equal"], default="rules",
                                             help="Choose a merging strategy for automatic alignment.\n"
@@ -91,10 +137,54 @@ if __name__ == "__main__":
                                                             "all-split: Merge nothing; e.g. MSSDI -> M, S, S, D, I\n"
                                                             "all-merge: Merge adjacent non-matches; e.g. MSSDI -> M, SSDI\n"
                                                             "all-equal: Merge adjacent same-type non-matches; e.g. MSSDI -> M, SS, D, I")
+    parser.add_argument("-max_cells", help="Per-pair budget: do not align pairs whose DP table has more than N cells\n"
+                                           "(the tokens between the common prefix and suffix); use -fallback instead. 0 means no limit.", type=int, default=0, metavar="N")
+    parser.add_argument("-max_seconds", help="Per-pair budget: give up aligning a pair after this many seconds and use\n"
+                                             "-fallback instead. 0 means no limit.", type=float, default=0)
+    parser.add_argument("-fallback", choices=["lev", "all-merge", "skip"], default="all-merge",
+                        help="What to do with pairs over the -max_cells or -max_seconds budget.\n"
+                             "lev: Retry with standard Levenshtein costs, then all-merge if still over budget\n"
+                             "all-merge: One edit spanning everything between the common prefix and suffix (default)\n"
+                             "skip: Ignore the pair")
+    parser.add_argument("-paragraph", help="Each line is a paragraph: split both sides into sentences, align the sentences,\n"
+                                           "and only align tokens within aligned sentences, so memory grows linearly with\n"
+                                           "paragraph length. Edits keep paragraph token offsets; see scripts/paragraph.py.", action="store_true")
     parser.add_argument("-feature_delimiter", type=str, default="￨",
                         help='The delimiter for word features concatenation.')
+    parser.add_argument("-features_out", help="Write plain tokens in the S and T lines and save their features (POS, dep, head)\n"
+                                              "to this memory-mappable columnar sidecar instead; see scripts/features.py.")
     parser.add_argument("-is_tokenized_orig", help="True if original sentences are tokenized by space. Otherwise we will detokenized them.", action="store_true")
     parser.add_argument("-is_tokenized_cor", help="True if corrected sentences are tokenized by space. Otherwise we will detokenized them.", action="store_true")
+    parser.add_argument("-dedup", help="Process each unique (orig, cor) pair only once and copy its m2 block to every\n"
+                                       "duplicate, keeping the output order.", action="store_true")
+    parser.add_argument("-dedup_entries", help="Pairs to keep in memory for -dedup before spilling to a temporary\n"
+                                               "SQLite file next to the output (default: 1000000).", type=int, default=1000000)
+    parser.add_argument("-cache", help="A persistent SQLite cache of m2 blocks. Pairs already processed with the same\n"
+                                       "model, options and resources are copied from the cache instead. Check it with verify_cache.py.")
+    parser.add_argument("-cache_mb", help="Evict the least recently used -cache blocks once their total compressed size\n"
+                                          "passes this many MB (default: 1024). The file is somewhat larger, and only\n"
+                                          "shrinks when verify_cache.py vacuums it.", type=float, default=1024)
+    parser.add_argument("-pipeline", help="Run reading, spaCy parsing (nlp.pipe) and alignment+classification as separate\n"
+                                          "stages joined by bounded queues, so they overlap; see scripts/pipeline.py.", action="store_true")
+    parser.add_argument("-parse_jobs", help="-pipeline parser threads (default: 1).", type=int, default=1)
+    parser.add_argument("-align_jobs", help="-pipeline alignment and classification processes (default: the number of CPUs).", type=int, default=os.cpu_count())
+    parser.add_argument("-parse_batch", help="Pairs per -pipeline batch (default: 256).", type=int, default=256)
+    parser.add_argument("-queue_size", help="Batches each -pipeline queue holds (default: 8).", type=int, default=8)
+    parser.add_argument("-profile", help="Print per-stage timings (count, total, mean, p50, p95, p99, max) when done.", action="store_true")
+    parser.add_argument("-profile_json", help="Also save the -profile timings to this JSON file.")
+    parser.add_argument("-rule_stats", help="Also count how often each merge rule fires and each error type is assigned, and time the\n"
+                                            "expensive checks (check_split, char_cost, SequenceMatcher, sameLemma). Implies -profile.", action="store_true")
+    parser.add_argument("-trace", help="Save the N slowest sentence pairs with their lengths, DP table size, transposition\n"
+                                       "windows, edit count and stage times, to replay with replay_slow.py. Implies -profile.", type=int, default=0, metavar="N")
+    parser.add_argument("-trace_out", help="The -trace output filepath (default: OUT.slow.json).")
     args = parser.parse_args()
+    if args.pipeline and (args.dedup or args.cache):
+        parser.error("-pipeline cannot be combined with -dedup or -cache.")
+    if args.features_out and (args.dedup or args.cache):
+        parser.error("-features_out cannot be combined with -dedup or -cache.")
+    if args.dedup and stream_io.compression(args.out):
+        parser.error("-dedup reads earlier blocks back from -out, so -out cannot be compressed.")
+    if args.profile_json or args.trace or args.rule_stats: args.profile = True
+    if not args.trace_out: args.trace_out = args.out+".slow.json"
     # Run the program.
     main(args)
@@ -1,33 +1,38 @@
 import argparse
 import os
-import spacy
-from nltk.stem.lancaster import LancasterStemmer
 from nltk.tokenize.moses import MosesDetokenizer
 import scripts.align_text as align_text
-import scripts.cat_rules as cat_rules
-import scripts.toolbox as toolbox
+import scripts.annotator as annotator
+import scripts.features as features
+import scripts.offset_index as offset_index
+import scripts.pipeline as pipeline
+import scripts.profiler as profiler
+import scripts.scheduler as scheduler
+import scripts.stream_io as stream_io
 from tqdm import tqdm
 import sys
+from itertools import count
 from joblib import Parallel, delayed
+from time import perf_counter
 
-# Get base working directory.
-basename = os.path.dirname(os.path.realpath(__file__))
 print("Loading SpaCy...")
 # Load Tokenizer and other resources
 print("Note: disable unecessary pipelines: ner, textcats")
-nlp = spacy.load("en_core_web_lg", disable=['ner', 'textcat'])
-# Lancaster Stemmer
-stemmer = LancasterStemmer()
+# SpaCy, the Lancaster Stemmer, the GB English word list (inc -ise and -ize) and the part of speech map.
+annot = annotator.Annotator()
 # Moses Detokenizer
 detokenizer = MosesDetokenizer()
-# GB English word list (inc -ise and -ize)
-gb_spell = toolbox.loadDictionary(basename+"/resources/en_GB-large.txt")
-# Part of speech map file
-tag_map = toolbox.loadTagMap(basename+"/resources/en-ptb_map")
+# The alignment settings; they depend on args, so main builds them once.
+context = None
 
-def _generate_m2(orig_sent, cor_sent):
+def _generate_m2(line_id, orig_sent, cor_sent):
     ignore_count= 0
     out_m2_str = ''
+    block_features = None
+    # Each worker profiles its own pairs; the profiles are merged in main.
+    if args.profile: profiler.start(args.trace, args.rule_stats)
+    pair_start = perf_counter()
+    profiler.count("pairs")
     # Process each pre-aligned sentence pair.
     try:
         # Check sentence length:
@@ -37,63 +42,84 @@ def _generate_m2(orig_sent, cor_sent):
             raise Exception('Target sentence is too short.')
         
         # Detokenize sents if they're pre-tokenized. Otherwise the result will be wrong.
-        if args.is_tokenized_orig:
-            orig_sent = detokenizer.detokenize(orig_sent.strip().split(), return_str=True)
-        if args.is_tokenized_cor:
-            cor_sent = detokenizer.detokenize(cor_sent.strip().split(), return_str=True)
-        # Markup the parallel sentences with spacy (assume tokenized)
-        proc_orig = toolbox.applySpacy(orig_sent.strip(), nlp)
-        proc_cor = toolbox.applySpacy(cor_sent.strip(), nlp)
-        # Write the original sentence to the output m2 file.
-        out_m2_str += "S " + toolbox.formatProcSent(proc_orig, feature_delimiter=args.feature_delimiter) + "\n"
-        out_m2_str += "T " + toolbox.formatProcSent(proc_cor, feature_delimiter=args.feature_delimiter) + "\n"
-        # out_m2.write("S " + toolbox.formatProcSent(proc_orig, feature_delimiter=args.feature_delimiter) + "\n")
-        # out_m2.write("T " + toolbox.formatProcSent(proc_cor, feature_delimiter=args.feature_delimiter) + "\n")
-        # Identical sentences have no edits, so just write noop.
-        if orig_sent.strip() == cor_sent.strip():
-            out_m2_str += "A -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||0\n"
-            # out_m2.write("A -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||0\n")
-        # Otherwise, do extra processing.
-        else:
-            # Auto align the parallel sentences and extract the edits.
-            auto_edits = align_text.getAutoAlignedEdits(proc_orig, proc_cor, nlp, args)
-            # Loop through the edits.
-            for auto_edit in auto_edits:
-                # Give each edit an automatic error type.
-                cat = cat_rules.autoTypeEdit(auto_edit, proc_orig, proc_cor, gb_spell, tag_map, nlp, stemmer)
-                auto_edit[2] = cat
-                # Write the edit to the output m2 file.
-                out_m2_str += toolbox.formatEdit(auto_edit)+"\n"
-                # out_m2.write(toolbox.formatEdit(auto_edit)+"\n")
-        # Write a newline when there are no more edits.
-        out_m2_str += "\n"
-        # out_m2.write("\n")
+        with profiler.stage("detokenize"):
+            if args.is_tokenized_orig:
+                orig_sent = detokenizer.detokenize(orig_sent.strip().split(), return_str=True)
+            if args.is_tokenized_cor:
+                cor_sent = detokenizer.detokenize(cor_sent.strip().split(), return_str=True)
+        # Parse, align and classify the pair.
+        annotation = annot.annotate(orig_sent.strip(), cor_sent.strip(), context)
+        # Format the whole m2 block.
+        with profiler.stage("format"):
+            out_m2_str = annot.format_m2(annotation, args.feature_delimiter, plain=bool(args.features_out))
+            if args.features_out: block_features = features.docFeatures(annotation.orig), features.docFeatures(annotation.cor)
     except KeyboardInterrupt:
         sys.exit(1)
     except:
         ignore_count += 1
+        profiler.count("ignored")
         print('\nIgnore example:')
         print('- Source: ', orig_sent)
         print('- Target: ', cor_sent)
         print()
 
-    return out_m2_str, ignore_count
+    if not args.profile: return out_m2_str, block_features, ignore_count, None
+    profiler.endPair(line_id, orig_sent, cor_sent, pair_start)
+    return out_m2_str, block_features, ignore_count, profiler.stop()
+
+# Input: A batch of (index, line_id, orig_sent, cor_sent) items.
+# Output: A list of (index, out_m2_str, block_features, ignore_count, profile) results; see _generate_m2.
+def _generate_batch(batch):
+    return [(index,)+_generate_m2(line_id, orig_sent, cor_sent) for index, line_id, orig_sent, cor_sent in batch]
 
 def main(args):  
+    # Parse and align in separate, overlapping stages, if required.
+    if args.pipeline:
+        pipeline.run(args, annot, detokenizer)
+        return
+    # Workers receive the context with _generate_m2, like args.
+    global context
+    context = align_text.makeContext(annot.nlp, args)
     print("Processing files...")
+    ignore_count = 0
+    if args.profile: profile = profiler.Profiler(args.trace)
+    # Save the token features in a sidecar instead of the S and T lines, if required.
+    feature_writer = features.FeatureWriter() if args.features_out else None
     # Open the original and corrected text files.
-    with open(args.orig) as orig, open(args.cor) as cor, open(args.out, "w") as out_m2, \
-         Parallel(n_jobs=args.n_jobs, verbose=5) as parallel:
-        # Process each pre-aligned sentence pair.
-        results = parallel(delayed(_generate_m2)(orig_sent, cor_sent)
-                           for orig_sent, cor_sent in tqdm(zip(orig, cor)))
-
-        out_m2_strs, ignore_counts = zip(*results)
-        out_m2_str = ''.join(out_m2_strs)
-        ignore_count = sum(ignore_counts)
-        out_m2.write(out_m2_str)
+    with stream_io.openFile(args.orig) as orig, stream_io.openFile(args.cor) as cor, stream_io.openFile(args.out, "w") as out_m2, \
+         Parallel(n_jobs=args.n_jobs, verbose=5, return_as="generator_unordered") as parallel:
+        pairs = zip(orig, cor)
+        # Seek straight to the requested sentence pairs using the sidecar indexes.
+        if args.range:
+            pairs = zip(offset_index.iterLines(args.orig, args.range), offset_index.iterLines(args.cor, args.range))
+        # Line numbers of the pairs, for tracing.
+        line_ids = range(len(offset_index.OffsetIndex.load(args.orig, "lines")))[args.range] if args.range else count()
+        items = ((index, line_id, orig_sent, cor_sent) for index, line_id, (orig_sent, cor_sent) in zip(count(), line_ids, tqdm(pairs)))
+        # Read ahead a window of pairs at a time and pack it into batches of
+        # similar cost, most expensive first, so no worker waits on one long pair.
+        # Batches are dispatched as workers free up, across window boundaries,
+        # so the pool never idles while the tail of a window finishes.
+        batches = (batch for window in scheduler.readWindows(items, args.window)
+                   for batch in scheduler.makeBatches(window, args.batch_cost, args.batch_size))
+        # Finished pairs wait here until every earlier pair has been written.
+        pending = {}
+        next_index = 0
+        for results in parallel(delayed(_generate_batch)(batch) for batch in batches):
+            for result in results:
+                pending[result[0]] = result[1:]
+            # Write every pair that is next in order.
+            while next_index in pending:
+                out_m2_str, block_features, pair_ignore_count, pair_profile = pending.pop(next_index)
+                out_m2.write(out_m2_str)
+                if block_features: feature_writer.add(*block_features)
+                ignore_count += pair_ignore_count
+                if args.profile: profile.merge(pair_profile)
+                next_index += 1
         
         print('Total number of ignored examples: {}\n'.format(ignore_count))
+        if feature_writer: feature_writer.write(args.features_out)
+        # Report the time spent in each stage across all workers.
+        if args.profile: profiler.finish(profile, args)
 
 if __name__ == "__main__":
     # Define and parse program input
@@ -103,6 +129,8 @@ if __name__ == "__main__":
     parser.add_argument("-orig", help="The path to the original text file.", required=True)
     parser.add_argument("-cor", help="The path to the corrected text file.", required=True)
     parser.add_argument("-out",     help="The output filepath.", required=True)
+    parser.add_argument("-range", help="Only process sentence pairs START:END (0-based, END exclusive).\n"
+                                       "Uses byte-offset indexes saved next to the text files.", type=offset_index.parseRange)
     parser.add_argument("-lev",     help="Use standard Levenshtein to align sentences.", action="store_true")
     parser.add_argument("-merge", choices=["rules", "all-split", "all-merge", "all-equal"], default="rules",
                                             help="Choose a merging strategy for automatic alignment.\n"
@@ -110,11 +138,44 @@ if __name__ == "__main__":
                                                             "all-split: Merge nothing; e.g. MSSDI -> M, S, S, D, I\n"
                                                             "all-merge: Merge adjacent non-matches; e.g. MSSDI -> M, SSDI\n"
                                                             "all-equal: Merge adjacent same-type non-matches; e.g. MSSDI -> M, SS, D, I")
+    parser.add_argument("-max_cells", help="Per-pair budget: do not align pairs whose DP table has more than N cells\n"
+                                           "(the tokens between the common prefix and suffix); use -fallback instead. 0 means no limit.", type=int, default=0, metavar="N")
+    parser.add_argument("-max_seconds", help="Per-pair budget: give up aligning a pair after this many seconds and use\n"
+                                             "-fallback instead. 0 means no limit.", type=float, default=0)
+    parser.add_argument("-fallback", choices=["lev", "all-merge", "skip"], default="all-merge",
+                        help="What to do with pairs over the -max_cells or -max_seconds budget.\n"
+                             "lev: Retry with standard Levenshtein costs, then all-merge if still over budget\n"
+                             "all-merge: One edit spanning everything between the common prefix and suffix (default)\n"
+                             "skip: Ignore the pair")
+    parser.add_argument("-paragraph", help="Each line is a paragraph: split both sides into sentences, align the sentences,\n"
+                                           "and only align tokens within aligned sentences, so memory grows linearly with\n"
+                                           "paragraph length. Edits keep paragraph token offsets; see scripts/paragraph.py.", action="store_true")
     parser.add_argument("-feature_delimiter", type=str, default="￨",
                         help='The delimiter for word features concatenation.')
+    parser.add_argument("-features_out", help="Write plain tokens in the S and T lines and save their features (POS, dep, head)\n"
+                                              "to this memory-mappable columnar sidecar instead; see scripts/features.py.")
     parser.add_argument("-is_tokenized_orig", help="True if original sentences are tokenized by space. Otherwise we will detokenized them.", action="store_true")
     parser.add_argument("-is_tokenized_cor", help="True if corrected sentences are tokenized by space. Otherwise we will detokenized them.", action="store_true")
     parser.add_argument('-n_jobs', help="The maximum number of concurrently running jobs", type=int, default=8)
+    parser.add_argument("-window", help="Read this many pairs ahead and schedule them by cost (default: 10000).", type=int, default=10000)
+    parser.add_argument("-batch_cost", help="The maximum total cost of a batch of pairs sent to one job, where the cost of a pair\n"
+                                            "is (orig_len+1) x (cor_len+1) in tokens (default: 20000).", type=int, default=20000)
+    parser.add_argument("-batch_size", help="The maximum number of pairs in a batch (default: 64).", type=int, default=64)
+    parser.add_argument("-pipeline", help="Run reading, spaCy parsing (nlp.pipe) and alignment+classification as separate\n"
+                                          "stages joined by bounded queues, so they overlap; see scripts/pipeline.py.", action="store_true")
+    parser.add_argument("-parse_jobs", help="-pipeline parser threads (default: 1).", type=int, default=1)
+    parser.add_argument("-align_jobs", help="-pipeline alignment and classification processes (default: the number of CPUs).", type=int, default=os.cpu_count())
+    parser.add_argument("-parse_batch", help="Pairs per -pipeline batch (default: 256).", type=int, default=256)
+    parser.add_argument("-queue_size", help="Batches each -pipeline queue holds (default: 8).", type=int, default=8)
+    parser.add_argument("-profile", help="Print per-stage timings (count, total, mean, p50, p95, p99, max) when done.", action="store_true")
+    parser.add_argument("-profile_json", help="Also save the -profile timings to this JSON file.")
+    parser.add_argument("-rule_stats", help="Also count how often each merge rule fires and each error type is assigned, and time the\n"
+                                            "expensive checks (check_split, char_cost, SequenceMatcher, sameLemma). Implies -profile.", action="store_true")
+    parser.add_argument("-trace", help="Save the N slowest sentence pairs with their lengths, DP table size, transposition\n"
+                                       "windows, edit count and stage times, to replay with replay_slow.py. Implies -profile.", type=int, default=0, metavar="N")
+    parser.add_argument("-trace_out", help="The -trace output filepath (default: OUT.slow.json).")
     args = parser.parse_args()
+    if args.profile_json or args.trace or args.rule_stats: args.profile = True
+    if not args.trace_out: args.trace_out = args.out+".slow.json"
     # Run the program.
     main(args)
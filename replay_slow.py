@@ -0,0 +1,76 @@
+import argparse
+import json
+import spacy
+from time import perf_counter
+import scripts.align_text as align_text
+import scripts.profiler as profiler
+import scripts.rdlextra as DL
+import scripts.toolbox as toolbox
+
+# Input 1-2: Spacy annotated original and corrected sentences.
+# Input 3: An AlignContext.
+# Input 4: Command line args.
+# Prints the number of optimal alignments of the pair's window, and the
+# -kbest cheapest alignments within -slack of the optimum.
+def printAlternatives(orig, cor, context, args):
+    orig_toks = [tok.text for tok in orig]
+    cor_toks = [tok.text for tok in cor]
+    start, orig_end, cor_end = align_text.get_align_window(orig_toks, cor_toks)
+    if context.lev: substitution, transposition = align_text.levSubstitution, align_text.levTransposition
+    else: substitution, transposition = context.substitution, context.transposition
+    table = DL.WagnerFischer(orig_toks[start:orig_end], cor_toks[start:cor_end], orig[start:orig_end], cor[start:cor_end],
+                             substitution=substitution, transposition=transposition)
+    print("- Optimal alignments: {} (cost {:.4f})".format(table.count_paths(), table.cost))
+    for cost, alignment in table.kbest(args.kbest, args.slack, args.max_states):
+        print("  {:.4f} {}".format(cost, " ".join(["M"]*start+alignment+["M"]*(len(orig_toks)-orig_end))))
+    if table.truncated: print("  (stopped after -max_states {} partial alignments)".format(args.max_states))
+
+def main(args):
+    trace = json.load(open(args.trace))
+    # Replay with the settings the pairs were traced with, unless overridden.
+    settings = trace["settings"]
+    if args.lev: settings["lev"] = True
+    if args.merge: settings["merge"] = args.merge
+    align_args = argparse.Namespace(**settings)
+    pairs = trace["pairs"]
+    if args.lines: pairs = [pair for pair in pairs if pair["line"] in args.lines]
+    print("Loading SpaCy...")
+    nlp = spacy.load("en_core_web_lg", disable=['ner', 'textcat'])
+    for pair in pairs:
+        proc_orig = toolbox.applySpacy(pair["orig"], nlp)
+        proc_cor = toolbox.applySpacy(pair["cor"], nlp)
+        # Only alignment is replayed, so parsing is not timed.
+        profiler.start(1)
+        start = perf_counter()
+        auto_edits = align_text.getAutoAlignedEdits(proc_orig, proc_cor, nlp, align_args)
+        profiler.endPair(pair["line"], pair["orig"], pair["cor"], start)
+        record = profiler.stop().slowestPairs()[0]
+        print("\nLine {}: {:.3f}ms (traced: {:.3f}ms)".format(pair["line"], record["seconds"]*1000, pair["seconds"]*1000))
+        print("- Source: ", pair["orig"])
+        print("- Target: ", pair["cor"])
+        print("- Lengths: {} x {}, DP cells: {}, transposition windows: {}".format(
+            record["orig_len"], record["cor_len"], record["dp_cells"], record["windows"]))
+        print("- Stages: "+", ".join("{} {:.3f}ms".format(name, seconds*1000) for name, seconds in sorted(record["stages"].items())))
+        for auto_edit in auto_edits:
+            print(toolbox.formatEdit(auto_edit))
+        if args.kbest: printAlternatives(proc_orig, proc_cor, align_text.makeContext(nlp, align_args), args)
+
+if __name__ == "__main__":
+    # Define and parse program input
+    parser = argparse.ArgumentParser(description="Replay the slowest sentence pairs saved by parallel_to_m2.py -trace through\n"
+                                                 "getAutoAlignedEdits on their own, timing each stage and printing the edits.",
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     usage="%(prog)s [-h] [options] trace")
+    parser.add_argument("trace", help="A path to a -trace output file.")
+    parser.add_argument("-lines", help="Only replay the pairs with these line numbers.", type=int, nargs="+")
+    parser.add_argument("-lev", help="Use standard Levenshtein to align sentences.", action="store_true")
+    parser.add_argument("-merge", choices=["rules", "all-split", "all-merge", "all-equal"],
+                        help="Override the traced merging strategy.")
+    parser.add_argument("-kbest", help="Also print the number of optimal alignments, and the K cheapest alignments.", type=int, metavar="K")
+    parser.add_argument("-slack", help="With -kbest, also list alignments costing up to SLACK more than the optimum (default: 0).",
+                        type=float, default=0)
+    parser.add_argument("-max_states", help="With -kbest, the most partial alignments kept in memory (default: {}).".format(DL.MAX_STATES),
+                        type=int, default=DL.MAX_STATES)
+    args = parser.parse_args()
+    # Run the program.
+    main(args)
@@ -1,11 +1,23 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from itertools import groupby
+from time import perf_counter
 import spacy.parts_of_speech as POS
+import scripts.profiler as profiler
 import scripts.rdlextra as DL
 import string
+# The vectorized DP needs numpy, which is optional.
+try:
+    import scripts.rdlnumpy as rdlnumpy
+except ImportError:
+    rdlnumpy = None
 
 # Some global variables
-NLP = None
 CONTENT_POS = [POS.ADJ, POS.ADV, POS.NOUN, POS.VERB]
+# Windows with at least this many DP cells are aligned by anti-diagonals in
+# NumPy (see scripts/rdlnumpy.py); smaller ones are faster in pure Python.
+VECTOR_CELLS = 2500
 
 ### FUNCTIONS ###
 
@@ -42,6 +54,10 @@ def merge_edits(edits):
         return edits
 
 def check_split(source, target, edits):
+    with profiler.check("check:check_split"):
+        return _check_split(source, target, edits)
+
+def _check_split(source, target, edits):
     s = []
     t = []
     # Collect the tokens
@@ -89,10 +105,10 @@ def get_edits(source, target, edits):
     if len(edits) < 1:
         return edits
     elif edits[0][0] == "M":
-#               print("RULE 1")
+        profiler.rule("merge:1:match")
         return get_edits(source, target, edits[1:])
     elif edits[-1][0] == "M":
-#               print("RULE 1")
+        profiler.rule("merge:1:match")
         return get_edits(source, target, edits[:-1])
     else:
         VP = [POS.VERB, POS.PART]
@@ -106,7 +122,7 @@ def get_edits(source, target, edits):
             i += 1
             op = e[0]
             if op == "M": # M in the middle => split
-#                               print("RULE 1")
+                profiler.rule("merge:1:match")
                 return get_edits(source, target, edits[:i]) + get_edits(source, target, edits[i+1:])
             # Get the affected tokens
             s = source[e[1]:e[2]][0] if len(source[e[1]:e[2]]) >= 1 else None
@@ -125,41 +141,38 @@ def get_edits(source, target, edits):
             # Next token: same word, different capitalisation
             if ((s and (ispunct(s) or s.orth_[0].isupper())) or (t and (ispunct(t) or t.orth_[0].isupper()))) and \
                s_ and t_ and s_.lower_ == t_.lower_ and s_.orth_[0] != t_.orth_[0]:
-#                               print("RULE 2")
+                profiler.rule("merge:2:punct_case")
                 return get_edits(source, target, edits[:i]) + merge_edits(edits[i:j+1]) + get_edits(source, target, edits[j+1:])
             # Keep all T separate.
             elif op.startswith("T"):
-#                               print("RULE 3")
+                profiler.rule("merge:3:transposition")
                 return get_edits(source, target, edits[:i]) + [e] + get_edits(source, target, edits[i+1:])
             # Merge some possessives.
             elif ((s and s.tag_ == "POS") or (t and t.tag_ == "POS")):
-#                               print("RULE 4")
+                profiler.rule("merge:4:possessive")
                 return merge_edits(edits[:i+1]) + get_edits(source, target, edits[i+1:])
             # Merge things like sub way -> subway. Some more possessives.
             elif (s_ or t_) and check_split(source, target, edits[i:j+1]):
-#                               print("RULE 5")
+                profiler.rule("merge:5:split")
                 return get_edits(source, target, edits[:i]) + merge_edits(edits[i:j+1]) + get_edits(source, target, edits[j+1:])
             # Adjacent subsittution rules.
             elif op == "S":
                 # If tokens are very similar => split (spelling errors)
                 if char_cost(s.orth_, t.orth_) < 0.3 and not (equal_pos and i > 0):
-#                                       print("RULE 6")
+                    profiler.rule("merge:6:spelling")
                     return get_edits(source, target, edits[:i]) + [e] + get_edits(source, target, edits[i+1:])
                 # Consecutive substitutions are split.
                 elif old_op == "S":
-#                                       print("RULE 7")
+                    profiler.rule("merge:7:consecutive_S")
                     return get_edits(source, target, edits[:i]) + [e] + get_edits(source, target, edits[i+1:])
                 # Merge if at least one content word
                 else:
-#                                       print("RULE 8")
                     merge = merge or is_content(s) or is_content(t)
             # Merge if at least one content word
             elif op == "D":
-#                               print("RULE 8")
                 merge = merge or is_content(s)
             # Merge if at least one content word
             elif op == "I":
-#                               print("RULE 8")
                 merge = merge or is_content(t)
             # Save operation
             old_op = e[0]
@@ -168,16 +181,18 @@ def get_edits(source, target, edits):
             if t: old_pos_t.add(t.pos)
 
         # End of changes/group
-        #if equal_pos: print "RULE 9"
+        content = merge
         merge = merge or equal_pos
         # DET at the end => split
         if (op == "D" and s.pos == POS.DET) or (op == "I" and t.pos == POS.DET) or \
            (op == "S" and (s.pos == POS.DET or t.pos == POS.DET)):
-#                       print("RULE 10")
+            profiler.rule("merge:10:final_DET")
             return merge_edits(edits[:i]) + [e]
         elif merge:
+            profiler.rule("merge:8:content" if content else "merge:9:equal_pos")
             return merge_edits(edits)
         else:
+            profiler.rule("merge:none")
             return edits
 
 # all-split: No edits are ever merged. Everything is 1:1, 1:0 or 0:1 only.
@@ -207,18 +222,18 @@ def get_edits_group_all(edits):
 
 # Get all possible lemmas for current token. By checking all POS, we increase
 # the chance that there will be a match.
-def get_lemmas(token):
+def get_lemmas(token, vocab):
     return set([
-    NLP.vocab.morphology.lemmatize(POS.ADJ, token.orth, NLP.vocab.morphology.tag_map),
-    NLP.vocab.morphology.lemmatize(POS.ADV, token.orth, NLP.vocab.morphology.tag_map),
-    NLP.vocab.morphology.lemmatize(POS.NOUN, token.orth, NLP.vocab.morphology.tag_map),
-    NLP.vocab.morphology.lemmatize(POS.VERB, token.orth, NLP.vocab.morphology.tag_map)])
+    vocab.morphology.lemmatize(POS.ADJ, token.orth, vocab.morphology.tag_map),
+    vocab.morphology.lemmatize(POS.ADV, token.orth, vocab.morphology.tag_map),
+    vocab.morphology.lemmatize(POS.NOUN, token.orth, vocab.morphology.tag_map),
+    vocab.morphology.lemmatize(POS.VERB, token.orth, vocab.morphology.tag_map)])
 
-def lemma_cost(A, B):
+def lemma_cost(A, B, vocab):
     # Use 0.499 instead of 0.5 to prefer alignments having substitutions
     # instead of unintuitive transpositions. This also avoids having an
     # upperbound of 2 for substitutions, which is good. Now S is in [0, 5)
-    return 0.499 * get_lemmas(A).isdisjoint(get_lemmas(B))
+    return 0.499 * get_lemmas(A, vocab).isdisjoint(get_lemmas(B, vocab))
 
 # Is the token a content word?
 def is_content(A):
@@ -240,17 +255,19 @@ def pos_cost(A, B):
 
 # Calculate the cost of character alignment; i.e. char similarity
 def char_cost(A, B):
-    alignments = DL.WagnerFischer(A, B)
-    alignment = next(alignments.alignments(True))   # True uses Depth-first search.
-    return alignments.cost / float(len(alignment))
+    with profiler.check("check:char_cost"):
+        alignments = DL.WagnerFischer(A, B)
+        alignment = next(alignments.alignments(True))   # True uses Depth-first search.
+        return alignments.cost / float(len(alignment))
 
 # If there is a substitution, calculate the more informative cost.
-def token_substitution(A, B, A_extra, B_extra):
+# The Spacy vocab is used to look up lemmas; bind it with functools.partial.
+def token_substitution(A, B, A_extra, B_extra, vocab):
     # If lower case strings are the same, don't bother checking pos etc.
     # This helps catch case marking substitution errors.
     if A.lower() == B.lower():
         return 0
-    cost = lemma_cost(A_extra, B_extra) + pos_cost(A_extra, B_extra) + char_cost(A, B)
+    cost = lemma_cost(A_extra, B_extra, vocab) + pos_cost(A_extra, B_extra) + char_cost(A, B)
     return cost
 
 # Change cost of Transpositions to be the same as Levenshtein.
@@ -261,30 +278,202 @@ def levTransposition(a,b,c,d):
 def levSubstitution(a,b,c,d):
     return 1
 
+# A pair is over budget and -fallback is skip.
+class BudgetExceeded(Exception):
+    pass
+
+# Everything an alignment needs besides the two sentences: the Spacy vocab
+# (for lemmas), the cost functions and the options. It is immutable and there
+# is no module state, so one context can be shared by any number of threads.
+# The active profiler is per thread too (see scripts/profiler.py).
+AlignContext = namedtuple("AlignContext", ["vocab", "substitution", "transposition", "lev", "merge",
+                                           "max_cells", "max_seconds", "fallback", "paragraph"])
+
+# Input 1: A preloaded Spacy processing object.
+# Input 2: Command line args, or None; lev, merge, max_cells, max_seconds, fallback and paragraph are read from it.
+# Input 3: Any of those options, which override args.
+# Output: An AlignContext.
+def makeContext(nlp, args=None, **options):
+    settings = {"lev": False, "merge": "rules", "max_cells": 0, "max_seconds": 0, "fallback": "all-merge", "paragraph": False}
+    for name in settings:
+        settings[name] = options.get(name, getattr(args, name, settings[name]))
+    if settings["lev"]: substitution, transposition = levSubstitution, levTransposition
+    else: substitution, transposition = partial(token_substitution, vocab=nlp.vocab), DL.TRANSPOSITION
+    return AlignContext(nlp.vocab, substitution, transposition, **settings)
+
+# The strategies tried, in order, after an alignment goes over budget.
+FALLBACKS = {"lev": ["lev", "all-merge"], "all-merge": ["all-merge"], "skip": ["skip"]}
+
+# Input 1-2: Lists of original and corrected token strings.
+# Output 1: The length of the common prefix of the two sentences.
+# Output 2-3: The original and corrected end of the window between the common prefix and suffix.
+def get_window(orig_toks, cor_toks):
+    start = 0
+    while start < len(orig_toks) and start < len(cor_toks) and orig_toks[start] == cor_toks[start]:
+        start += 1
+    orig_end = len(orig_toks)
+    cor_end = len(cor_toks)
+    while orig_end > start and cor_end > start and orig_toks[orig_end-1] == cor_toks[cor_end-1]:
+        orig_end -= 1
+        cor_end -= 1
+    return start, orig_end, cor_end
+
+# Input 1-2: Lists of original and corrected token strings.
+# Output: A list with at most 1 edit spanning everything between the common
+# prefix and suffix of the two sentences. This needs no alignment, so it is
+# the all-merge result for pairs that are too expensive to align.
+def get_edits_span(orig_toks, cor_toks):
+    start, orig_end, cor_end = get_window(orig_toks, cor_toks)
+    if start == orig_end and start == cor_end:
+        return []
+    return [("X", start, orig_end, start, cor_end)]
+
+# Input 1-2: Lists of original and corrected token strings.
+# Output 1: The start of the window that has to be aligned; everything before it is matched.
+# Output 2-3: The original and corrected end of the window; everything after it is matched.
+# The DP always matches equal tokens, so the common suffix is matched in the
+# full alignment too. Ties are broken towards the start of the sentence
+# though, so an edit next to a repeated token can slide into the common
+# prefix; e.g. [man man an -> man an] deletes the first "man". The window
+# therefore keeps the prefix tokens that also occur in it (ignoring case, as
+# the costs do), which gives the same alignment as the full table.
+def get_align_window(orig_toks, cor_toks):
+    start, orig_end, cor_end = get_window(orig_toks, cor_toks)
+    window = set(tok.lower() for tok in orig_toks[start:orig_end]+cor_toks[start:cor_end])
+    while start > 0 and orig_toks[start-1].lower() in window:
+        start -= 1
+    return start, orig_end, cor_end
+
+# Input 1: Why the pair is over budget.
+# Input 2: The next strategy.
+def logFallback(reason, strategy):
+    if strategy == "skip": print("\nOver budget ({}); skipping the pair.".format(reason))
+    else: print("\nOver budget ({}); falling back to {}.".format(reason, strategy))
+
+# Input 1-2: Lists of original and corrected token strings.
+# Input 3-4: The Spacy annotated original and corrected sentences.
+# Input 5: The window to align; see get_align_window. Everything outside it is matched.
+# Input 6-7: The substitution and transposition cost functions.
+# Input 8: A perf_counter() deadline for the alignment, or None.
+# Output: The best alignment; e.g. [M, M, S, S, M]
+def align(orig_toks, cor_toks, orig, cor, window, substitution, transposition, deadline):
+    start, orig_end, cor_end = window
+    orig_win, cor_win = orig_toks[start:orig_end], cor_toks[start:cor_end]
+    engine = DL.WagnerFischer
+    if rdlnumpy and (len(orig_win)+1)*(len(cor_win)+1) >= VECTOR_CELLS:
+        engine = rdlnumpy.WagnerFischer
+        profiler.count("vector_alignments")
+    with profiler.stage("align"):
+        alignments = engine(orig_win, cor_win, orig[start:orig_end], cor[start:cor_end],
+                            substitution=substitution, transposition=transposition, deadline=deadline)
+    profiler.note("windows", alignments.windows)
+    with profiler.stage("traceback"):
+        # Get the alignment with the highest score. There is usually only 1 best in DL due to custom costs.
+        alignment = next(alignments.alignments(True)) # True uses Depth-first search.
+    return ["M"]*start+alignment+["M"]*(len(orig_toks)-orig_end)
+
 # Input 1: A Spacy annotated original sentence.
 # Input 2: A Spacy annotated corrected sentence.
 # Input 3: A preloaded Spacy processing object.
 # Input 4: Command line args.
 # Output: A list of lists. Each sublist is an edit of the form:
 # edit = [orig_start, orig_end, cat, cor, cor_start, cor_end]
+# If args.max_cells or args.max_seconds is set and the pair goes over it, the
+# args.fallback strategies are used instead (or BudgetExceeded is raised).
 def getAutoAlignedEdits(orig, cor, spacy, args):
-    # Save the spacy object globally.
-    global NLP
-    NLP = spacy
+    return alignEdits(orig, cor, makeContext(spacy, args))
+
+# Input 1: A list of (orig, cor) Spacy annotated sentence pairs.
+# Input 2: An AlignContext.
+# Input 3: The number of threads (default: the number of CPUs + 4, as in ThreadPoolExecutor).
+# Output: A list with the edits of every pair (see alignEdits), in order, or
+# the exception raised for that pair; e.g. BudgetExceeded.
+# If the calling thread is profiling, each pair is profiled on its own and the
+# profiles are merged into the caller's. Pairs are not traced (-trace).
+def alignBatch(pairs, context, threads=None):
+    prof = profiler.active()
+    if prof is None:
+        with ThreadPoolExecutor(threads) as pool:
+            return list(pool.map(partial(alignOrError, context=context), pairs))
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(partial(alignProfiled, context=context, rules=prof.rules), pairs))
+    for _, pair_prof in results:
+        prof.merge(pair_prof)
+    return [edits for edits, _ in results]
+
+# Input 1: An (orig, cor) pair of Spacy annotated sentences.
+# Input 2: An AlignContext.
+# Input 3: Whether to count rule firings.
+# Output: The same as alignOrError, and the profile of the pair.
+def alignProfiled(pair, context, rules):
+    profiler.start(0, rules)
+    edits = alignOrError(pair, context)
+    return edits, profiler.stop()
+
+# Input 1: An (orig, cor) pair of Spacy annotated sentences.
+# Input 2: An AlignContext.
+# Output: The edits of the pair, or the exception raised.
+def alignOrError(pair, context):
+    try:
+        return alignEdits(pair[0], pair[1], context)
+    except Exception as e:
+        return e
+
+# Input 1: A Spacy annotated original sentence.
+# Input 2: A Spacy annotated corrected sentence.
+# Input 3: An AlignContext.
+# Output: See getAutoAlignedEdits. Safe to call from several threads at once.
+def alignEdits(orig, cor, context):
     # Get a list of strings from the spacy objects.
     orig_toks = [tok.text for tok in orig]
     cor_toks = [tok.text for tok in cor]
-    # Align using Levenshtein.
-    if args.lev: alignments = DL.WagnerFischer(orig_toks, cor_toks, orig, cor, substitution=levSubstitution, transposition=levTransposition)
-    # Otherwise, use linguistically enhanced Damerau-Levenshtein
-    else: alignments = DL.WagnerFischer(orig_toks, cor_toks, orig, cor, substitution=token_substitution)
-    # Get the alignment with the highest score. There is usually only 1 best in DL due to custom costs.
-    alignment = next(alignments.alignments(True)) # True uses Depth-first search.
-    # Convert the alignment into edits; choose merge strategy
-    if args.merge == "rules": edits = get_edits(orig, cor, get_opcodes(alignment))
-    elif args.merge == "all-split": edits = get_edits_split(get_opcodes(alignment))
-    elif args.merge == "all-merge": edits = get_edits_group_all(get_opcodes(alignment))
-    elif args.merge == "all-equal": edits = get_edits_group_type(get_opcodes(alignment))
+    # Token-identical sentences have no edits.
+    if orig_toks == cor_toks:
+        profiler.count("token_identical")
+        return []
+    # Only the window between the common prefix and suffix needs a DP table.
+    window = get_align_window(orig_toks, cor_toks)
+    cells = (window[1]-window[0]+1)*(window[2]-window[0]+1)
+    profiler.note("orig_len", len(orig_toks))
+    profiler.note("cor_len", len(cor_toks))
+    profiler.note("dp_cells", cells)
+    # Per-pair budget; 0 means unlimited.
+    max_cells = context.max_cells
+    max_seconds = context.max_seconds
+    # With -lev, the first alignment already uses -lev costs, so it is not retried.
+    fallbacks = FALLBACKS[context.fallback]
+    strategies = ["lev" if context.lev else "full"]+[strategy for strategy in fallbacks if not (context.lev and strategy == "lev")]
+    # -lev needs the same DP table, so it cannot help pairs with too many cells.
+    if max_cells and cells > max_cells:
+        reason = "{} DP cells > -max_cells {}".format(cells, max_cells)
+        strategies = [strategy for strategy in strategies if strategy not in {"full", "lev"}]
+        logFallback(reason, strategies[0])
+    edits = None
+    for i, strategy in enumerate(strategies):
+        if strategy == "skip":
+            profiler.count("skipped")
+            raise BudgetExceeded(reason)
+        if strategy == "all-merge":
+            profiler.count("fallback_all-merge")
+            edits = get_edits_span(orig_toks, cor_toks)
+            break
+        try:
+            deadline = perf_counter()+max_seconds if max_seconds else None
+            if strategy == "lev": costs = (levSubstitution, levTransposition)
+            else: costs = (context.substitution, context.transposition)
+            alignment = align(orig_toks, cor_toks, orig, cor, window, costs[0], costs[1], deadline)
+        except DL.AlignmentTimeout:
+            reason = "{} alignment took > -max_seconds {}".format("-lev" if strategy == "lev" else "full", max_seconds)
+            logFallback(reason, strategies[i+1])
+            continue
+        if i > 0: profiler.count("fallback_lev")
+        with profiler.stage("merge"):
+            # Convert the alignment into edits; choose merge strategy
+            if context.merge == "rules": edits = get_edits(orig, cor, get_opcodes(alignment))
+            elif context.merge == "all-split": edits = get_edits_split(get_opcodes(alignment))
+            elif context.merge == "all-merge": edits = get_edits_group_all(get_opcodes(alignment))
+            elif context.merge == "all-equal": edits = get_edits_group_type(get_opcodes(alignment))
+        break
     proc_edits = []
     for edit in edits:
         orig_start = edit[1]
@@ -0,0 +1,158 @@
+import os
+from collections import namedtuple
+from itertools import islice
+import spacy
+from nltk.stem.lancaster import LancasterStemmer
+import scripts.align_text as align_text
+import scripts.cat_rules as cat_rules
+import scripts.paragraph as paragraph
+import scripts.profiler as profiler
+import scripts.toolbox as toolbox
+
+# An in-process API for edit extraction and classification. An Annotator
+# loads spaCy, the stemmer, the GB word list and the tag map once, and then
+# annotates any number of sentence pairs without writing m2 text.
+
+BASENAME = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# The resource files an Annotator loads.
+RESOURCES = [BASENAME+"/resources/en_GB-large.txt", BASENAME+"/resources/en-ptb_map"]
+NOOP = "A -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||0"
+
+# An edit. The fields are in the same order as the edit lists of align_text,
+# so an Edit can be passed to toolbox.formatEdit. type is "NA" until classified.
+Edit = namedtuple("Edit", ["o_start", "o_end", "type", "c_str", "c_start", "c_end", "o_str"])
+# An annotated sentence pair. noop is True when the sentences have the same
+# tokens; edits is then empty.
+Annotation = namedtuple("Annotation", ["orig", "cor", "edits", "noop"])
+
+class Annotator(object):
+
+    """
+    Loads the models and resources once, and aligns and classifies sentence
+    pairs with them. Alignment options (lev, merge, max_cells, max_seconds,
+    fallback, paragraph) are read from args and/or keyword options; see
+    align_text.makeContext.
+    """
+
+    def __init__(self, model="en_core_web_lg", nlp=None, args=None, **options):
+        self.nlp = nlp or spacy.load(model, disable=['ner', 'textcat'])
+        self.stemmer = LancasterStemmer()
+        self.gb_spell = toolbox.loadDictionary(RESOURCES[0])
+        self.tag_map = toolbox.loadTagMap(RESOURCES[1])
+        self.context = align_text.makeContext(self.nlp, args, **options)
+
+    # Input: A sentence string.
+    # Output: The Spacy doc.
+    def parse(self, text):
+        return toolbox.applySpacy(text, self.nlp)
+
+    # Input 1: An iterable of sentence strings.
+    # Input 2: The number of sentences Spacy parses at a time.
+    # Output: A generator of Spacy docs, in order.
+    def parse_batch(self, texts, batch_size=256):
+        return self.nlp.pipe(texts, batch_size=batch_size)
+
+    # Input: A list of sentence strings.
+    # Output: A list with the Spacy doc of every sentence, or the exception
+    # raised parsing it. If the batch parse fails, each sentence is parsed on
+    # its own, so one bad sentence does not fail the others.
+    def parse_each(self, texts):
+        try:
+            return list(self.parse_batch(texts, batch_size=len(texts) or 1))
+        except Exception:
+            docs = []
+            for text in texts:
+                try: docs.append(self.parse(text))
+                except Exception as e: docs.append(e)
+            return docs
+
+    # Input 1-2: Spacy annotated original and corrected sentences.
+    # Input 3: An align_text.AlignContext, or None for the Annotator's own.
+    # Output: A list of unclassified Edits.
+    # With the paragraph option, the sentences are aligned first; see scripts/paragraph.py.
+    def align(self, orig, cor, context=None):
+        context = context or self.context
+        if context.paragraph: return [Edit(*edit) for edit in paragraph.alignParagraph(orig, cor, context)]
+        return [Edit(*edit) for edit in align_text.alignEdits(orig, cor, context)]
+
+    # Input 1: An Edit.
+    # Input 2-3: The Spacy annotated original and corrected sentences.
+    # Output: The Edit with its error type.
+    def classify(self, edit, orig, cor):
+        cat = cat_rules.autoTypeEdit(list(edit), orig, cor, self.gb_spell, self.tag_map, self.nlp, self.stemmer)
+        return edit._replace(type=cat)
+
+    # Input: An iterable of (Edit, orig, cor) tuples, with Spacy annotated sentences.
+    # Output: A generator of classified Edits, in order.
+    def classify_batch(self, edits):
+        for edit, orig, cor in edits:
+            yield self.classify(edit, orig, cor)
+
+    # Input 1-2: Spacy annotated original and corrected sentences.
+    # Input 3: An align_text.AlignContext, or None for the Annotator's own.
+    # Output: An Annotation with classified Edits.
+    def annotate_docs(self, orig, cor, context=None):
+        # Sentences with identical tokens (e.g. that only differ in whitespace) have no edits.
+        if orig is cor or [tok.text for tok in orig] == [tok.text for tok in cor]:
+            return Annotation(orig, cor, [], True)
+        edits = [self.classify(edit, orig, cor) for edit in self.align(orig, cor, context)]
+        profiler.count("edits", len(edits))
+        profiler.note("edits", len(edits))
+        return Annotation(orig, cor, edits, False)
+
+    # Input 1-2: Original and corrected sentence strings.
+    # Input 3: An align_text.AlignContext, or None for the Annotator's own.
+    # Output: An Annotation with classified Edits.
+    def annotate(self, orig, cor, context=None):
+        with profiler.stage("parse_orig"):
+            proc_orig = self.parse(orig)
+        # Identical sentences need no parse of their own.
+        if orig == cor:
+            profiler.count("identical")
+            proc_cor = proc_orig
+        else:
+            with profiler.stage("parse_cor"):
+                proc_cor = self.parse(cor)
+        return self.annotate_docs(proc_orig, proc_cor, context)
+
+    # Input 1: An iterable of (orig, cor) sentence strings.
+    # Input 2: The number of pairs parsed at a time.
+    # Output: A generator with an Annotation for every pair, in order, or the
+    # exception raised for that pair; e.g. align_text.BudgetExceeded.
+    def annotate_batch(self, pairs, batch_size=256):
+        pairs = iter(pairs)
+        while True:
+            batch = list(islice(pairs, batch_size))
+            if not batch: return
+            # Identical sentences are only parsed once.
+            texts = []
+            for orig, cor in batch:
+                texts.append(orig)
+                if orig != cor: texts.append(cor)
+            docs = iter(self.parse_each(texts))
+            for orig, cor in batch:
+                proc_orig = next(docs)
+                proc_cor = proc_orig if orig == cor else next(docs)
+                # A pair that failed to parse gets its parse exception.
+                if isinstance(proc_orig, Exception) or isinstance(proc_cor, Exception):
+                    yield proc_orig if isinstance(proc_orig, Exception) else proc_cor
+                    continue
+                try:
+                    yield self.annotate_docs(proc_orig, proc_cor)
+                except Exception as e:
+                    yield e
+
+    # Input 1: An Annotation.
+    # Input 2: The delimiter for word features concatenation.
+    # Input 3: Boolean; write plain tokens without features (see scripts/features.py).
+    # Output: The m2 block of the pair, with the corrected sentence as a T line.
+    def format_m2(self, annotation, feature_delimiter="￨", plain=False):
+        if plain:
+            lines = ["S " + " ".join(tok.text for tok in annotation.orig),
+                     "T " + " ".join(tok.text for tok in annotation.cor)]
+        else:
+            lines = ["S " + toolbox.formatProcSent(annotation.orig, feature_delimiter=feature_delimiter),
+                     "T " + toolbox.formatProcSent(annotation.cor, feature_delimiter=feature_delimiter)]
+        if annotation.noop: lines.append(NOOP)
+        lines.extend(toolbox.formatEdit(edit) for edit in annotation.edits)
+        return "\n".join(lines)+"\n\n"
@@ -0,0 +1,79 @@
+import numpy as np
+
+# Bootstrap confidence intervals and paired significance tests for compare_m2.
+# Each system is reduced to one (TP, FP, FN) row per sentence, using the
+# annotator compare_m2 chose for that sentence. A replicate is then just a
+# weighted sum of those rows, so thousands of replicates are computed at
+# once as a matrix product instead of re-scoring resampled files.
+
+# Input 1-3: Arrays of TP, FP and FN.
+# Input 4: Value of beta in F-score.
+# Output 1-3: Arrays of Precision, Recall and F-score (not rounded).
+# Same definitions as compare_m2.computeFScore, element-wise.
+def computeFScores(tp, fp, fn, beta):
+    tp, fp, fn = [np.asarray(x, dtype=np.float64) for x in [tp, fp, fn]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = np.where(fp > 0, tp/(tp+fp), 1.0)
+        r = np.where(fn > 0, tp/(tp+fn), 1.0)
+        f = np.where(p+r > 0, (1+beta**2)*p*r/((beta**2)*p+r), 0.0)
+    return p, r, f
+
+# Input 1: The number of sentences.
+# Input 2: The number of replicates.
+# Input 3: A numpy random Generator.
+# Output: A (replicates, sentences) array of how often each sentence was drawn.
+def resampleWeights(num_sents, num_samples, rng):
+    draws = rng.integers(0, num_sents, size=(num_samples, num_sents))
+    draws += np.arange(num_samples)[:, None]*num_sents
+    return np.bincount(draws.ravel(), minlength=num_samples*num_sents).reshape(num_samples, num_sents)
+
+# Input 1: A list of (sentences, 3) arrays of per-sentence TP, FP, FN; one per system.
+# Input 2: The number of replicates.
+# Input 3: Value of beta in F-score.
+# Input 4: Random seed.
+# Input 5: Replicates per batch; bounds memory to batch*sentences counts.
+# Output: A (systems, replicates, 3) array of P, R, F for every replicate.
+# All systems are scored on the same resampled sentences, so they can be compared.
+def bootstrapScores(counts, num_samples, beta, seed=0, batch=1000):
+    rng = np.random.default_rng(seed)
+    num_sents = len(counts[0])
+    scores = np.empty((len(counts), num_samples, 3))
+    for start in range(0, num_samples, batch):
+        end = min(start+batch, num_samples)
+        weights = resampleWeights(num_sents, end-start, rng).astype(np.float64)
+        for i, sys_counts in enumerate(counts):
+            totals = weights @ sys_counts.astype(np.float64)
+            scores[i, start:end] = np.stack(computeFScores(totals[:, 0], totals[:, 1], totals[:, 2], beta), axis=1)
+    return scores
+
+# Input 1-2: Two (sentences, 3) arrays of per-sentence TP, FP, FN.
+# Input 3: The number of permutations.
+# Input 4: Value of beta in F-score.
+# Input 5: Random seed.
+# Input 6: Permutations per batch.
+# Output: The two-sided p-value of the observed F-score difference under a
+# paired permutation test (approximate randomisation), where the two systems'
+# sentences are swapped at random.
+def permutationTest(counts1, counts2, num_samples, beta, seed=0, batch=1000):
+    rng = np.random.default_rng(seed)
+    counts1, counts2 = counts1.astype(np.float64), counts2.astype(np.float64)
+    total1, total2 = counts1.sum(axis=0), counts2.sum(axis=0)
+    observed = abs(computeFScores(*total1, beta)[2] - computeFScores(*total2, beta)[2])
+    diff = counts2 - counts1
+    extreme = 0
+    for start in range(0, num_samples, batch):
+        end = min(start+batch, num_samples)
+        swaps = rng.integers(0, 2, size=(end-start, len(counts1))).astype(np.float64)
+        # Swapping sentence i moves its counts from one system to the other.
+        moved = swaps @ diff
+        f1 = computeFScores(*(total1 + moved).T, beta)[2]
+        f2 = computeFScores(*(total2 - moved).T, beta)[2]
+        extreme += np.count_nonzero(np.abs(f1-f2) >= observed - 1e-12)
+    return (extreme+1) / (num_samples+1)
+
+# Input 1: A (replicates,) array of scores.
+# Input 2: Confidence level; e.g. 0.95.
+# Output: The lower and upper percentile bounds.
+def percentileInterval(scores, level):
+    alpha = (1-level)/2
+    return np.quantile(scores, alpha), np.quantile(scores, 1-alpha)
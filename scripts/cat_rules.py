@@ -1,6 +1,8 @@
 from difflib import SequenceMatcher
 from string import punctuation
+from time import perf_counter
 import spacy.parts_of_speech as spos
+import scripts.profiler as profiler
 
 # Contractions
 conts = {"'d", "'ll", "'m", "n't", "'re", "'s", "'ve"}
@@ -30,12 +32,27 @@ dep_map = { "acomp": "ADJ",
 # Input 6: A preloaded spacy processing object.
 # Input 7: The Lancaster stemmer in NLTK.
 # Output: The input edit with new error tag, in M2 edit format.
+# With rule counting on, the type each edit gets is counted and timed (e.g.
+# "type:R:SPELL"). Types that several rules can return (UNK, MORPH, OTHER and
+# POS after a failed spell check) also count the rule that fired (e.g.
+# "classify:1-1:morph_derivational").
 def autoTypeEdit(edit, orig_sent, cor_sent, gb_spell, tag_map, nlp, stemmer):
+    with profiler.stage("classify"):
+        if not profiler.rulesOn():
+            return typeEdit(edit, orig_sent, cor_sent, gb_spell, tag_map, nlp, stemmer)
+        start = perf_counter()
+        cat = typeEdit(edit, orig_sent, cor_sent, gb_spell, tag_map, nlp, stemmer)
+        profiler.rule("type:"+cat, perf_counter()-start)
+        return cat
+
+# Same as autoTypeEdit, but not profiled, so recursive calls are not counted twice.
+def typeEdit(edit, orig_sent, cor_sent, gb_spell, tag_map, nlp, stemmer):
     # Get the tokens in the edit.
     orig_toks = orig_sent[edit[0]:edit[1]]
     cor_toks = cor_sent[edit[4]:edit[5]]
     # Nothing to nothing is a detected, but not corrected edit.
     if not orig_toks and not cor_toks:
+        profiler.rule("classify:unk_empty")
         return "UNK"
     # Missing
     elif not orig_toks and cor_toks:
@@ -49,6 +66,7 @@ def autoTypeEdit(edit, orig_sent, cor_sent, gb_spell, tag_map, nlp, stemmer):
     else:
         # Same to same is a detected, but not corrected edit.
         if orig_toks.text == cor_toks.text:
+            profiler.rule("classify:unk_same")
             return "UNK"
         # Special: Orthographic errors at the end of multi-token edits are ignored.
         # E.g. [Doctor -> The doctor], [The doctor -> Dcotor], [, since -> . Since]
@@ -58,7 +76,7 @@ def autoTypeEdit(edit, orig_sent, cor_sent, gb_spell, tag_map, nlp, stemmer):
             min_edit = edit[:]
             min_edit[1] -= 1
             min_edit[5] -= 1
-            return autoTypeEdit(min_edit, orig_sent, cor_sent, gb_spell, tag_map, nlp, stemmer)
+            return typeEdit(min_edit, orig_sent, cor_sent, gb_spell, tag_map, nlp, stemmer)
         # Replacement
         else:
             op = "R:"
@@ -165,10 +183,12 @@ def getTwoSidedType(orig_toks, cor_toks, gb_spell, tag_map, nlp, stemmer):
                         return orig_pos[0]+":INFL"
                     # Unknown morphology; i.e. we cannot be more specific.
                     else:
+                        profiler.rule("classify:1-1:spell_morph")
                         return "MORPH"
                 # Use string similarity to detect true spelling errors.
                 else:
-                    char_ratio = SequenceMatcher(None, orig_str[0], cor_str[0]).ratio()
+                    with profiler.check("check:SequenceMatcher"):
+                        char_ratio = SequenceMatcher(None, orig_str[0], cor_str[0]).ratio()
                     # Ratio > 0.5 means both side share at least half the same chars.
                     # WARNING: THIS IS AN APPROXIMATION.
                     if char_ratio > 0.5:
@@ -177,9 +197,11 @@ def getTwoSidedType(orig_toks, cor_toks, gb_spell, tag_map, nlp, stemmer):
                     else:
                         # If POS is the same, this takes precedence over spelling.
                         if orig_pos == cor_pos and orig_pos[0] not in rare_tags:
+                            profiler.rule("classify:1-1:spell_same_pos")
                             return orig_pos[0]
                         # Tricky cases.
                         else:
+                            profiler.rule("classify:1-1:spell_other")
                             return "OTHER"
 
         # 3. MORPHOLOGY
@@ -231,10 +253,12 @@ def getTwoSidedType(orig_toks, cor_toks, gb_spell, tag_map, nlp, stemmer):
                 return "VERB:SVA"
             # Tricky cases that all have the same lemma.
             else:
+                profiler.rule("classify:1-1:morph_same_lemma")
                 return "MORPH"
         # Derivational morphology.
         if stemmer.stem(orig_str[0]) == stemmer.stem(cor_str[0]) and \
                 orig_pos[0] in open_tags and cor_pos[0] in open_tags:
+            profiler.rule("classify:1-1:morph_derivational")
             return "MORPH"
 
         # 4. GENERAL
@@ -260,6 +284,7 @@ def getTwoSidedType(orig_toks, cor_toks, gb_spell, tag_map, nlp, stemmer):
                 return "DET"
         # Tricky cases.
         else:
+            profiler.rule("classify:1-1:other")
             return "OTHER"
 
     # Multi-token replacements (uncommon)
@@ -296,6 +321,7 @@ def getTwoSidedType(orig_toks, cor_toks, gb_spell, tag_map, nlp, stemmer):
 
     # Tricky cases.
     else:
+        profiler.rule("classify:n-n:other")
         return "OTHER"
 
 # Input 1: A list of original token strings
@@ -326,15 +352,16 @@ def exactReordering(orig_str, cor_str):
 # Spacy only finds lemma for its predicted POS tag. Sometimes these are wrong,
 # so we also consider alternative POS tags to improve chance of a match.
 def sameLemma(orig_tok, cor_tok, nlp):
-    orig_lemmas = []
-    cor_lemmas = []
-    for pos in open_pos:
-        # Pass the lower cased form of the word for lemmatization; improves accuracy.
-        orig_lemmas.append(nlp.vocab.morphology.lemmatize(pos, orig_tok.lower, nlp.vocab.morphology.tag_map))
-        cor_lemmas.append(nlp.vocab.morphology.lemmatize(pos, cor_tok.lower, nlp.vocab.morphology.tag_map))
-    if set(orig_lemmas).intersection(set(cor_lemmas)):
-        return True
-    return False
+    with profiler.check("check:sameLemma"):
+        orig_lemmas = []
+        cor_lemmas = []
+        for pos in open_pos:
+            # Pass the lower cased form of the word for lemmatization; improves accuracy.
+            orig_lemmas.append(nlp.vocab.morphology.lemmatize(pos, orig_tok.lower, nlp.vocab.morphology.tag_map))
+            cor_lemmas.append(nlp.vocab.morphology.lemmatize(pos, cor_tok.lower, nlp.vocab.morphology.tag_map))
+        if set(orig_lemmas).intersection(set(cor_lemmas)):
+            return True
+        return False
 
 # Input 1: An original text spacy token.
 # Input 2: A corrected text spacy token.
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+import hashlib
+import os
+import sqlite3
+import tempfile
+
+# Corpus-level deduplication of sentence pairs.
+# Each pair is reduced to a 16 byte digest of its normalised text (stripped,
+# and with whitespace collapsed on -is_tokenized_* sides). The first copy of
+# a pair is processed as usual and its m2 block is written to the output
+# file; the dedup table only remembers where that block starts and
+# how long it is. Later copies read the block back from the output file, so
+# memory does not depend on the size of the blocks. Once the table has
+# max_entries entries, they are spilled to a temporary SQLite file. The most
+# recently written or copied blocks are also kept in memory, so the output
+# is only flushed to read a block back when that block was written after the
+# last flush and is no longer in memory.
+
+# The number of recent blocks kept in memory.
+RECENT_BLOCKS = 10000
+
+# Input 1-2: The original and corrected sentence lines.
+# Input 3-4: Booleans; the sentences are tokenized (and will be detokenized).
+# Output: A digest of the pair, equal for pairs that give the same m2 block.
+def pairKey(orig, cor, is_tokenized_orig=False, is_tokenized_cor=False):
+    # Tokenized sentences are split on whitespace before detokenization, so
+    # whitespace differences do not matter. Otherwise only strip() is applied.
+    orig = " ".join(orig.split()) if is_tokenized_orig else orig.strip()
+    cor = " ".join(cor.split()) if is_tokenized_cor else cor.strip()
+    return hashlib.blake2b((orig+"\n"+cor).encode("utf-8"), digest_size=16).digest()
+
+class PairDeduplicator(object):
+
+    """
+    Writes m2 blocks to an output file and remembers where the block of
+    every unique pair is, so duplicate pairs can copy it instead of being
+    processed again. A pair that failed is remembered with length 0.
+    """
+
+    def __init__(self, out_file, max_entries=1000000, recent_blocks=RECENT_BLOCKS):
+        self.out_file = out_file
+        self.encoding = out_file.encoding
+        self.max_entries = max_entries
+        self.pos = out_file.tell()
+        # Everything before this offset has been flushed, so the reader can see it.
+        self.flushed = self.pos
+        # An LRU of recent blocks by pair digest.
+        self.recent = OrderedDict()
+        self.recent_blocks = recent_blocks
+        self.table = {}
+        self.spill = None
+        self.spill_path = None
+        self.reader = None
+        self.unique = 0
+        self.duplicates = 0
+
+    # Input: A pair digest.
+    # Output: None if the pair is new, "" if its first copy failed, or its m2 block.
+    def lookup(self, key):
+        loc = self.table.get(key)
+        if loc is None and self.spill:
+            loc = self.spill.execute("SELECT offset, length FROM pairs WHERE key = ?", (key,)).fetchone()
+        if loc is None: return None
+        self.duplicates += 1
+        if not loc[1]: return ""
+        block = self.recent.get(key)
+        if block is not None:
+            self.recent.move_to_end(key)
+            return block
+        # The block may still be in the write buffer.
+        if loc[0]+loc[1] > self.flushed:
+            self.out_file.flush()
+            self.flushed = self.pos
+        if not self.reader: self.reader = open(self.out_file.name, "rb")
+        self.reader.seek(loc[0])
+        block = self.reader.read(loc[1]).decode(self.encoding)
+        self.remember(key, block)
+        return block
+
+    # Input 1: A pair digest.
+    # Input 2: Its m2 block.
+    # Adds the block to the recent blocks, evicting the least recently used one if full.
+    def remember(self, key, block):
+        self.recent[key] = block
+        if len(self.recent) > self.recent_blocks: self.recent.popitem(last=False)
+
+    # Input 1: The digest of a new pair.
+    # Input 2: Its m2 block, or "" if it failed.
+    def write(self, key, block):
+        length = self.writeCopy(block)
+        self.table[key] = (self.pos-length, length)
+        if length: self.remember(key, block)
+        self.unique += 1
+        if len(self.table) >= self.max_entries: self.spillTable()
+
+    # Input: An m2 block of a duplicate pair.
+    # Output: The length of the block in bytes.
+    def writeCopy(self, block):
+        length = len(block.encode(self.encoding))
+        self.out_file.write(block)
+        self.pos += length
+        return length
+
+    # Moves the in-memory table to the SQLite spill file.
+    def spillTable(self):
+        if not self.spill:
+            fd, self.spill_path = tempfile.mkstemp(suffix=".sqlite", dir=os.path.dirname(os.path.abspath(self.out_file.name)))
+            os.close(fd)
+            self.spill = sqlite3.connect(self.spill_path)
+            self.spill.execute("PRAGMA journal_mode = OFF")
+            self.spill.execute("PRAGMA synchronous = OFF")
+            self.spill.execute("CREATE TABLE pairs (key BLOB PRIMARY KEY, offset INTEGER, length INTEGER)")
+        self.spill.executemany("INSERT INTO pairs VALUES (?, ?, ?)", ((key, loc[0], loc[1]) for key, loc in self.table.items()))
+        self.spill.commit()
+        self.table = {}
+
+    # Output: The fraction of pairs that were duplicates.
+    def ratio(self):
+        total = self.unique+self.duplicates
+        return self.duplicates/total if total else 0.0
+
+    def close(self):
+        if self.reader: self.reader.close()
+        if self.spill:
+            self.spill.close()
+            os.remove(self.spill_path)
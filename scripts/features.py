@@ -0,0 +1,110 @@
+from array import array
+import scripts.m2bin as m2bin
+
+# A columnar sidecar for the token features of an m2 file.
+# With a sidecar, the S and T lines of the m2 file hold plain tokens, and the
+# features that toolbox.formatProcSent would otherwise join onto every token
+# are stored here: a POS and a dependency label id per token (ids into a
+# string table shared with the token texts) and the index of its head in the
+# sentence. The previous, next and head token texts follow from these.
+# Sentence k of the m2 file is stored as doc 2k (S line) and doc 2k+1 (T
+# line). The file is memory-mapped, and any sentence can be sliced out
+# without reading the others; see Features. Features.column gives a
+# zero-copy slice of one column.
+
+MAGIC = b"M2FEAT01"
+# Column name and array typecode, in file order.
+COLUMNS = [("str_offsets", "q"), # Byte offset of each string in str_data (+1 end offset)
+           ("str_data", "B"),    # utf-8 bytes of all strings
+           ("doc_offsets", "q"), # Offset of each doc in the token columns (+1 end offset)
+           ("tok_text", "i"),    # String id of the token text
+           ("tok_pos", "i"),     # String id of the universal POS tag
+           ("tok_dep", "i"),     # String id of the dependency label
+           ("tok_head", "i")]    # Index of the head token in the doc
+SOURCE = 0
+TARGET = 1
+
+# Input: A Spacy doc.
+# Output: A picklable (texts, pos tags, dep labels, head indexes) tuple of lists.
+def docFeatures(doc):
+    return ([tok.text for tok in doc], [tok.pos_ for tok in doc],
+            [tok.dep_ for tok in doc], [tok.head.i for tok in doc])
+
+# Input 1: A tuple from docFeatures.
+# Input 2: The delimiter for word features concatenation.
+# Output: The same string as toolbox.formatProcSent on the doc.
+def formatFeatures(features, feature_delimiter="￨"):
+    texts, pos, dep, heads = features
+    last = len(texts)-1
+    return " ".join([feature_delimiter.join([texts[i], texts[max(i-1, 0)], texts[min(i+1, last)],
+                     texts[heads[i]], pos[i], dep[i]]) for i in range(len(texts))])
+
+class FeatureWriter(object):
+
+    """
+    Accumulates the token features of the S and T lines of every m2 block,
+    in output order, and writes them as a sidecar file.
+    """
+
+    def __init__(self):
+        self.str_ids = {}
+        self.cols = {name: array(code) for name, code in COLUMNS}
+        self.cols["doc_offsets"].append(0)
+
+    def intern(self, string):
+        str_id = self.str_ids.get(string)
+        if str_id is None:
+            str_id = self.str_ids[string] = len(self.str_ids)
+        return str_id
+
+    # Input 1-2: docFeatures tuples of the original and corrected sentences of a block.
+    def add(self, orig, cor):
+        cols = self.cols
+        for texts, pos, dep, heads in [orig, cor]:
+            cols["tok_text"].extend(self.intern(text) for text in texts)
+            cols["tok_pos"].extend(self.intern(tag) for tag in pos)
+            cols["tok_dep"].extend(self.intern(label) for label in dep)
+            cols["tok_head"].extend(heads)
+            cols["doc_offsets"].append(len(cols["tok_text"]))
+
+    def write(self, path):
+        self.cols["str_offsets"], self.cols["str_data"] = m2bin.stringTable(self.str_ids)
+        m2bin.writeColumns(path, MAGIC, COLUMNS, self.cols)
+
+class Features(m2bin.MappedColumns):
+
+    """
+    A memory-mapped, read-only view of a feature sidecar. Sentences are
+    indexed from 0 like the m2 blocks, and side is SOURCE (the S line) or
+    TARGET (the T line).
+    """
+
+    def __init__(self, path):
+        super(Features, self).__init__(path, MAGIC, COLUMNS)
+
+    def __len__(self):
+        return (len(self.cols["doc_offsets"])-1)//2
+
+    # Output: The (start, end) token offsets of sentence i in the token columns.
+    def span(self, i, side=SOURCE):
+        if not 0 <= i < len(self): raise IndexError(i)
+        doc = 2*i+side
+        return self.cols["doc_offsets"][doc], self.cols["doc_offsets"][doc+1]
+
+    # Output: A zero-copy memoryview of column name for sentence i; e.g. "tok_head".
+    def column(self, name, i, side=SOURCE):
+        start, end = self.span(i, side)
+        return self.cols[name][start:end]
+
+    # Output: The same tuple as docFeatures on the parsed sentence i.
+    def doc(self, i, side=SOURCE):
+        start, end = self.span(i, side)
+        cols = self.cols
+        return ([self.string(str_id) for str_id in cols["tok_text"][start:end]],
+                [self.string(str_id) for str_id in cols["tok_pos"][start:end]],
+                [self.string(str_id) for str_id in cols["tok_dep"][start:end]],
+                cols["tok_head"][start:end].tolist())
+
+    # Output: The feature string of sentence i, as it would be in an m2 file without a sidecar.
+    def formatProcSent(self, i, side=SOURCE, feature_delimiter="￨"):
+        return formatFeatures(self.doc(i, side), feature_delimiter)
@@ -0,0 +1,290 @@
+import mmap
+import struct
+import sys
+from array import array
+import scripts.stream_io as stream_io
+import scripts.toolbox as toolbox
+
+# A columnar binary container for M2 files.
+# All strings (tokens, error types, corrections and the historical REQUIRED
+# and -NONE- fields) are interned in one string table. Everything else is
+# stored as flat little-endian integer columns that are memory-mapped and
+# sliced on demand, so opening a corpus does not parse anything.
+
+MAGIC = b"M2BIN001"
+# Column name and array typecode, in file order.
+COLUMNS = [("str_offsets", "q"), # Byte offset of each string in str_data (+1 end offset)
+           ("str_data", "B"),    # utf-8 bytes of all strings
+           ("src_offsets", "q"), # Offset of each sentence in src_toks (+1 end offset)
+           ("src_toks", "i"),    # String ids of the S line tokens
+           ("has_tgt", "B"),     # 1 if the sentence has a T line
+           ("tgt_offsets", "q"), # Offset of each sentence in tgt_toks (+1 end offset)
+           ("tgt_toks", "i"),    # String ids of the T line tokens
+           ("edit_offsets", "q"), # Offset of each sentence in the edit columns (+1 end offset)
+           ("edit_start", "i"),
+           ("edit_end", "i"),
+           ("edit_coder", "i"),
+           ("edit_cat", "i"),    # String id of the error type
+           ("edit_cor", "i"),    # String id of the correction string
+           ("edit_extra", "i")]  # String id of the fields between cor and coder
+# The header is the magic string followed by (offset, length) for every column.
+HEADER = struct.Struct("<8s" + "qq"*len(COLUMNS))
+
+# Input: A path to a file.
+# Output: Boolean; the file is an M2 binary file.
+def isM2Bin(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+# Input: An m2 file object.
+# Output: A generator of sentence+edit blocks in that file (a list of lines).
+# Streams the file so that multi-GB corpora are never loaded at once.
+def iterM2Blocks(m2_file):
+    block = []
+    for line in m2_file:
+        # CRLF line endings are read as LF, as compare_m2.loadM2 does.
+        line = line.rstrip("\r\n")
+        if line:
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+    if block: yield block
+
+# Input: An edit line in an m2 file.
+# Output: A tuple; (start, end, cat, cor, extra, coder)
+def parseEditLine(line):
+    edit = line[2:].split("|||") # Ignore "A " then split.
+    span = edit[0].split()
+    return int(span[0]), int(span[1]), edit[1], edit[2], "|||".join(edit[3:-1]), int(edit[-1])
+
+# Input: A tuple; (start, end, cat, cor, extra, coder)
+# Output: An edit line in m2 file format.
+def formatEditLine(start, end, cat, cor, extra, coder):
+    return "|||".join(["A "+str(start)+" "+str(end), cat, cor, extra, str(coder)])
+
+class M2BinWriter(object):
+
+    """
+    Accumulates M2 sentence blocks in columnar form and writes them out as
+    an M2 binary file. Only blocks that can be reproduced byte for byte are
+    accepted, so converting back to text is always lossless.
+    """
+
+    def __init__(self):
+        self.str_ids = {}
+        self.cols = {name: array(code) for name, code in COLUMNS}
+        for name in ["src_offsets", "tgt_offsets", "edit_offsets"]:
+            self.cols[name].append(0)
+
+    def intern(self, string):
+        str_id = self.str_ids.get(string)
+        if str_id is None:
+            str_id = self.str_ids[string] = len(self.str_ids)
+        return str_id
+
+    def add(self, block):
+        cols = self.cols
+        # S line, optional T line, then A lines.
+        lines = block[1:]
+        tgt_line = lines.pop(0) if lines and lines[0].startswith("T ") else None
+        # Check all the lines can be stored before touching the columns.
+        edits = []
+        for line in lines:
+            try:
+                edit = parseEditLine(line) if line.startswith("A ") else None
+            except (ValueError, IndexError):
+                edit = None
+            if not edit or formatEditLine(*edit) != line:
+                raise ValueError("Edit line cannot be stored losslessly: "+line)
+            edits.append(edit)
+        if block[0][:2] != "S ":
+            raise ValueError("Sentence line cannot be stored losslessly: "+block[0])
+        # Sentence tokens
+        cols["src_toks"].extend(self.intern(tok) for tok in block[0][2:].split(" "))
+        cols["src_offsets"].append(len(cols["src_toks"]))
+        cols["has_tgt"].append(tgt_line is not None)
+        if tgt_line is not None:
+            cols["tgt_toks"].extend(self.intern(tok) for tok in tgt_line[2:].split(" "))
+        cols["tgt_offsets"].append(len(cols["tgt_toks"]))
+        # Edit columns
+        for start, end, cat, cor, extra, coder in edits:
+            cols["edit_start"].append(start)
+            cols["edit_end"].append(end)
+            cols["edit_coder"].append(coder)
+            cols["edit_cat"].append(self.intern(cat))
+            cols["edit_cor"].append(self.intern(cor))
+            cols["edit_extra"].append(self.intern(extra))
+        cols["edit_offsets"].append(len(cols["edit_start"]))
+
+    def write(self, path):
+        self.cols["str_offsets"], self.cols["str_data"] = stringTable(self.str_ids)
+        writeColumns(path, MAGIC, COLUMNS, self.cols)
+
+# Input: A dictionary of strings to ids, with ids assigned in insertion order.
+# Output: The str_offsets and str_data columns of the string table.
+def stringTable(str_ids):
+    str_offsets = array("q", [0])
+    str_data = bytearray()
+    for string in str_ids:
+        str_data += string.encode("utf-8")
+        str_offsets.append(len(str_data))
+    return str_offsets, array("B", str_data)
+
+# Input 1: The output filepath.
+# Input 2: The magic string of the file format.
+# Input 3: A list of (name, typecode) columns, in file order.
+# Input 4: A dictionary of column name to array.
+# Writes the header (the magic string followed by (offset, length) for every
+# column) and then the columns, each 8-byte aligned.
+def writeColumns(path, magic, columns, cols):
+    header = struct.Struct("<8s" + "qq"*len(columns))
+    layout = []
+    pos = header.size
+    for name, code in columns:
+        col = cols[name]
+        pos += -pos % 8
+        layout.extend([pos, len(col)])
+        pos += len(col)*col.itemsize
+    with open(path, "wb") as out:
+        out.write(header.pack(magic, *layout))
+        for i, (name, code) in enumerate(columns):
+            col = cols[name]
+            if sys.byteorder != "little": col.byteswap()
+            out.write(b"\0"*(layout[2*i]-out.tell()))
+            out.write(col.tobytes())
+
+class MappedColumns(object):
+
+    """
+    A memory-mapped, read-only view of a file written by writeColumns. Each
+    column is a memoryview of the mapped file, so nothing is read until it
+    is used. Files with a str_offsets/str_data string table can decode
+    strings by id.
+    """
+
+    def __init__(self, path, magic, columns):
+        if sys.byteorder != "little":
+            raise ValueError(path+" can only be memory-mapped on little-endian machines.")
+        header = struct.Struct("<8s" + "qq"*len(columns))
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = header.unpack_from(self._mmap)
+        if fields[0] != magic:
+            self.close()
+            raise ValueError(path+" is not a "+magic.decode("ascii")+" file.")
+        view = self._view = memoryview(self._mmap)
+        self.cols = {}
+        for i, (name, code) in enumerate(columns):
+            offset, length = fields[1+2*i], fields[2+2*i]
+            size = array(code).itemsize
+            self.cols[name] = view[offset:offset+length*size].cast(code)
+        self._strings = [None]*(len(self.cols["str_offsets"])-1) if "str_offsets" in self.cols else []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # The memoryviews must be released before the mmap can be closed.
+        for col in self.cols.values(): col.release()
+        self.cols = {}
+        if hasattr(self, "_view"): self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def string(self, str_id):
+        string = self._strings[str_id]
+        if string is None:
+            offsets = self.cols["str_offsets"]
+            string = bytes(self.cols["str_data"][offsets[str_id]:offsets[str_id+1]]).decode("utf-8")
+            self._strings[str_id] = string
+        return string
+
+class M2Bin(MappedColumns):
+
+    """
+    A memory-mapped, read-only view of an M2 binary file. Sentences are
+    indexed from 0 and decoded lazily, so random access is O(1).
+    """
+
+    def __init__(self, path):
+        super(M2Bin, self).__init__(path, MAGIC, COLUMNS)
+
+    def __len__(self):
+        return len(self.cols["src_offsets"])-1
+
+    # Output: The S line tokens of sentence i (a list of strings).
+    def source(self, i):
+        offsets = self.cols["src_offsets"]
+        return [self.string(tok) for tok in self.cols["src_toks"][offsets[i]:offsets[i+1]]]
+
+    # Output: The T line tokens of sentence i, or None if there is no T line.
+    def target(self, i):
+        if not self.cols["has_tgt"][i]: return None
+        offsets = self.cols["tgt_offsets"]
+        return [self.string(tok) for tok in self.cols["tgt_toks"][offsets[i]:offsets[i+1]]]
+
+    # Output: A list of edits for sentence i; (start, end, cat, cor, extra, coder)
+    def edits(self, i):
+        cols = self.cols
+        start, end = cols["edit_offsets"][i], cols["edit_offsets"][i+1]
+        return [(cols["edit_start"][e], cols["edit_end"][e], self.string(cols["edit_cat"][e]),
+                 self.string(cols["edit_cor"][e]), self.string(cols["edit_extra"][e]),
+                 cols["edit_coder"][e]) for e in range(start, end)]
+
+    # Output: Sentence i as an m2 sentence+edit block string.
+    def block(self, i):
+        lines = ["S "+" ".join(self.source(i))]
+        target = self.target(i)
+        if target is not None: lines.append("T "+" ".join(target))
+        lines.extend(formatEditLine(*edit) for edit in self.edits(i))
+        return "\n".join(lines)
+
+    # Output: The same as toolbox.processM2 on the text block of sentence i.
+    def processM2(self, i):
+        orig_sent = [tok for tok in self.source(i) if tok]
+        edit_dict = {}
+        for start, end, cat, cor, extra, coder in self.edits(i):
+            edit_dict.setdefault(str(coder), []).append([start, end, cat, cor])
+        return orig_sent, toolbox.applyEdits(orig_sent, edit_dict)
+
+    # Input: An optional slice of sentence ids.
+    # Output: A sequence of edit lists, one per sentence, for compare_m2.
+    def editLists(self, ids=None):
+        return EditLists(self, range(len(self))[ids or slice(None)])
+
+class EditLists(object):
+    def __init__(self, m2bin, ids):
+        self.m2bin = m2bin
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return self.m2bin.edits(self.ids[i])
+
+# Input 1: A path to a text m2 file.
+# Input 2: The output M2 binary filepath.
+# Output: The number of sentences converted.
+def writeM2Bin(m2_path, out_path):
+    writer = M2BinWriter()
+    count = 0
+    with stream_io.openFile(m2_path) as m2_file:
+        for block in iterM2Blocks(m2_file):
+            writer.add(block)
+            count += 1
+    writer.write(out_path)
+    return count
+
+# Input 1: A path to an M2 binary file.
+# Input 2: The output text m2 filepath.
+# Output: The number of sentences converted.
+def writeM2Text(bin_path, out_path):
+    with M2Bin(bin_path) as m2bin, stream_io.openFile(out_path, "w") as out_m2:
+        for i in range(len(m2bin)):
+            out_m2.write(m2bin.block(i)+"\n\n")
+        return len(m2bin)
@@ -0,0 +1,122 @@
+import argparse
+import os
+import struct
+from array import array
+import scripts.stream_io as stream_io
+
+# Sidecar byte-offset indexes for random access into m2 and parallel text files.
+# An index stores the byte offset at which every m2 sentence block (or every
+# line) starts, plus the file size as a final sentinel. It is saved next to
+# the indexed file and rebuilt whenever the file size or mtime changes.
+# Offsets in .gz, .xz and .zst files are of the decompressed text; seeking to
+# them decompresses the file up to that point, so access is sequential, not O(1).
+
+SUFFIX = ".idx"
+MAGIC = {"m2": b"M2IDX001", "lines": b"LNIDX001"}
+# Magic string, indexed file size, indexed file mtime (ns), number of entries.
+HEADER = struct.Struct("<8sqqq")
+
+# Input 1: A path to an m2 or text file.
+# Input 2: The kind of index; "m2" for sentence blocks or "lines" for lines.
+# Output: An array of byte offsets; one per block/line plus the file size.
+# Builds the index in one streaming pass over the file.
+def buildOffsets(path, kind):
+    offsets = array("q")
+    pos = 0
+    prev_blank = True
+    with stream_io.openRaw(path, "rb") as in_file:
+        for line in in_file:
+            if kind == "lines":
+                offsets.append(pos)
+            # A new m2 block starts at the first non-blank line after a blank.
+            else:
+                blank = not line.strip()
+                if prev_blank and not blank: offsets.append(pos)
+                prev_blank = blank
+            pos += len(line)
+    offsets.append(pos)
+    return offsets
+
+class OffsetIndex(object):
+
+    """
+    Byte offsets of every m2 sentence block or text line in a file, giving
+    O(1) access to sentence k. Use OffsetIndex.load() to reuse a valid
+    sidecar index or to build (and save) a new one.
+    """
+
+    def __init__(self, path, kind, offsets):
+        self.path = path
+        self.kind = kind
+        self.offsets = offsets
+        self._file = None
+
+    @classmethod
+    def load(cls, path, kind="m2"):
+        stat = os.stat(path)
+        idx_path = path+SUFFIX
+        # Reuse the sidecar if it matches the current file.
+        if os.path.isfile(idx_path):
+            with open(idx_path, "rb") as idx_file:
+                header = idx_file.read(HEADER.size)
+                if len(header) == HEADER.size:
+                    magic, size, mtime, count = HEADER.unpack(header)
+                    if magic == MAGIC[kind] and size == stat.st_size and mtime == stat.st_mtime_ns:
+                        offsets = array("q")
+                        offsets.fromfile(idx_file, count+1)
+                        return cls(path, kind, offsets)
+        offsets = buildOffsets(path, kind)
+        # Save the sidecar, unless the directory is read-only.
+        try:
+            with open(idx_path, "wb") as idx_file:
+                idx_file.write(HEADER.pack(MAGIC[kind], stat.st_size, stat.st_mtime_ns, len(offsets)-1))
+                offsets.tofile(idx_file)
+        except OSError:
+            pass
+        return cls(path, kind, offsets)
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def close(self):
+        if self._file: self._file.close()
+        self._file = None
+
+    # Output: The raw bytes of block/line k.
+    def read(self, k):
+        if not 0 <= k < len(self): raise IndexError(k)
+        if not self._file: self._file = stream_io.openRaw(self.path, "rb")
+        self._file.seek(self.offsets[k])
+        return self._file.read(self.offsets[k+1]-self.offsets[k])
+
+    # Output: Sentence block k of an m2 file, as loadM2 would return it.
+    def block(self, k):
+        return self.read(k).decode("utf-8").strip()
+
+    # Output: Line k of a text file, including the newline.
+    def line(self, k):
+        return self.read(k).decode("utf-8")
+
+# Input 1: A path to a text file.
+# Input 2: A slice of line ids.
+# Output: A generator of the selected lines, read by seeking directly to each.
+def iterLines(path, ids):
+    index = OffsetIndex.load(path, "lines")
+    for k in range(len(index))[ids]:
+        yield index.line(k)
+    index.close()
+
+# Input: A sentence id range string; e.g. "10:20", "10:" or ":20". Ids start at 0.
+# Output: A slice object that can be applied to range(num_sents).
+# Negative ids are not allowed, and neither is a range that can only be empty
+# (END <= START), so a typo cannot silently select no sentences.
+def parseRange(range_str):
+    try:
+        start, end = [int(x) if x.strip() else None for x in range_str.split(":")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid sentence range {!r}; expected START:END".format(range_str))
+    if (start is not None and start < 0) or (end is not None and end < 0):
+        raise argparse.ArgumentTypeError("Invalid sentence range {!r}; sentence ids cannot be negative".format(range_str))
+    if end is not None and end <= (start or 0):
+        raise argparse.ArgumentTypeError("Invalid sentence range {!r}; END must be greater than START".format(range_str))
+    return slice(start, end)
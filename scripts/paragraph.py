@@ -0,0 +1,75 @@
+from collections import Counter
+import scripts.align_text as align_text
+import scripts.profiler as profiler
+
+# Paragraph mode: align whole paragraphs sentence by sentence.
+# Both sides are split into sentences with the Spacy parse, and the two
+# sentence sequences are aligned with a small DP over sentences, whose cost
+# is the number of tokens the sentences do not share. Each group of aligned
+# sentences (1-1, 1-2, 2-1, 2-2, or an inserted or deleted sentence) is then
+# aligned token by token on its own, and the edit offsets are moved back to
+# paragraph token positions. The token DP tables are only as big as the
+# groups, so memory grows linearly with the length of a paragraph, not
+# quadratically. Edits can not cross a group boundary.
+
+# Allowed (orig sentences, cor sentences) groups and the extra cost of each,
+# so that a 1-1 match is preferred when the tokens do not decide.
+BEADS = {(1, 1): 0, (1, 0): 1, (0, 1): 1, (2, 1): 1, (1, 2): 1, (2, 2): 2}
+
+# Input: A Spacy doc.
+# Output: A list of (start, end) token offsets of its sentences.
+def sentenceSpans(doc):
+    spans = [(sent.start, sent.end) for sent in doc.sents] if len(doc) else []
+    return spans or [(0, len(doc))]
+
+# Input 1-2: Lists of Counters of the (lowercased) tokens of the original and corrected sentences.
+# Output: A list of (orig_start, orig_end, cor_start, cor_end) groups of sentence ids covering both sides.
+def alignSentences(orig_bags, cor_bags):
+    n, m = len(orig_bags), len(cor_bags)
+    inf = float("inf")
+    cost = [[inf]*(m+1) for _ in range(n+1)]
+    back = [[None]*(m+1) for _ in range(n+1)]
+    cost[0][0] = 0
+    for i in range(n+1):
+        for j in range(m+1):
+            if cost[i][j] == inf: continue
+            for (di, dj), penalty in BEADS.items():
+                if i+di > n or j+dj > m: continue
+                orig_bag = sum(orig_bags[i:i+di], Counter())
+                cor_bag = sum(cor_bags[j:j+dj], Counter())
+                # The tokens the group does not share.
+                unmatched = sum(orig_bag.values())+sum(cor_bag.values())-2*sum((orig_bag & cor_bag).values())
+                total = cost[i][j]+unmatched+penalty
+                if total < cost[i+di][j+dj]:
+                    cost[i+di][j+dj] = total
+                    back[i+di][j+dj] = (di, dj)
+    groups = []
+    i, j = n, m
+    while i or j:
+        di, dj = back[i][j]
+        groups.append((i-di, i, j-dj, j))
+        i, j = i-di, j-dj
+    return groups[::-1]
+
+# Input 1: A Spacy annotated original paragraph.
+# Input 2: A Spacy annotated corrected paragraph.
+# Input 3: An AlignContext.
+# Output: The same edits as align_text.alignEdits, with paragraph token offsets.
+def alignParagraph(orig, cor, context):
+    orig_spans = sentenceSpans(orig)
+    cor_spans = sentenceSpans(cor)
+    profiler.note("orig_sents", len(orig_spans))
+    profiler.note("cor_sents", len(cor_spans))
+    with profiler.stage("align_sents"):
+        groups = alignSentences([Counter(tok.lower_ for tok in orig[start:end]) for start, end in orig_spans],
+                                [Counter(tok.lower_ for tok in cor[start:end]) for start, end in cor_spans])
+    edits = []
+    for orig_first, orig_last, cor_first, cor_last in groups:
+        # Token offsets of the group; an empty side starts where the other side's group does.
+        orig_start = orig_spans[orig_first][0] if orig_first < orig_last else (orig_spans[orig_first-1][1] if orig_first else 0)
+        orig_end = orig_spans[orig_last-1][1] if orig_first < orig_last else orig_start
+        cor_start = cor_spans[cor_first][0] if cor_first < cor_last else (cor_spans[cor_first-1][1] if cor_first else 0)
+        cor_end = cor_spans[cor_last-1][1] if cor_first < cor_last else cor_start
+        for edit in align_text.alignEdits(orig[orig_start:orig_end], cor[cor_start:cor_end], context):
+            edits.append([edit[0]+orig_start, edit[1]+orig_start, edit[2], edit[3], edit[4]+cor_start, edit[5]+cor_start, edit[6]])
+    return edits
@@ -0,0 +1,250 @@
+import queue
+import threading
+from itertools import count
+from multiprocessing import Pool
+from time import perf_counter
+from spacy.attrs import TAG, POS, HEAD, DEP
+from spacy.tokens import Doc
+import scripts.align_text as align_text
+import scripts.features as features
+import scripts.offset_index as offset_index
+import scripts.profiler as profiler
+import scripts.stream_io as stream_io
+from tqdm import tqdm
+
+# A staged pipeline for parallel_to_m2 and parallel_to_m2_multiprocess:
+#   read:  1 thread reads, checks and detokenizes pairs and groups them into batches.
+#   parse: -parse_jobs threads run nlp.pipe on each batch and serialize the
+#          docs as plain token arrays (words, spaces, tag/pos/head/dep ids).
+#   align: a pool of -align_jobs processes rebuilds the docs from the arrays,
+#          aligns, classifies and formats each pair into an m2 block.
+#   write: the main process writes the blocks in the original order.
+# The stages are joined by queues of -queue_size batches, so parsing and the
+# pure-Python alignment overlap. At most -queue_size batches are between the
+# read and the write stage at once, so memory stays bounded.
+
+# The token attributes the alignment, classification and output use.
+ATTRS = [TAG, POS, HEAD, DEP]
+# Tells a stage there are no more batches.
+DONE = None
+# The (annotator, alignment context, args) of each align process.
+RESOURCES = None
+
+# Input: A Spacy doc.
+# Output: A picklable (words, spaces, attribute array) tuple.
+def serializeDoc(doc):
+    return [tok.text for tok in doc], [bool(tok.whitespace_) for tok in doc], doc.to_array(ATTRS)
+
+# Input 1: A Spacy vocab, from the same model that parsed the doc.
+# Input 2: A tuple from serializeDoc.
+# Output: The Spacy doc.
+def deserializeDoc(vocab, data):
+    words, spaces, attrs = data
+    doc = Doc(vocab, words=words, spaces=spaces)
+    doc.from_array(ATTRS, attrs)
+    return doc
+
+# Input: An (annotator, alignment context, args) tuple.
+# Sets the resources of an align process. With fork, they are inherited, not copied.
+def initAlign(resources):
+    global RESOURCES
+    RESOURCES = resources
+
+# Input: A (seq, items) batch from the parse stage.
+# Output 1: The batch sequence number.
+# Output 2: A list of (line_id, orig_sent, cor_sent, m2 block or None, block features or None)
+# results, one per item. Block features are only kept with -features_out.
+# Output 3: The profile of the batch, or None.
+def alignBatch(batch):
+    seq, items = batch
+    annot, context, args = RESOURCES
+    if args.profile: profiler.start(args.trace, args.rule_stats)
+    results = []
+    for line_id, orig_sent, cor_sent, identical, orig_data, cor_data in items:
+        # The pair was too short, or failed to parse.
+        if orig_data is None:
+            results.append((line_id, orig_sent, cor_sent, None, None))
+            continue
+        pair_start = perf_counter()
+        profiler.count("pairs")
+        try:
+            proc_orig = deserializeDoc(annot.nlp.vocab, orig_data)
+            proc_cor = proc_orig if identical else deserializeDoc(annot.nlp.vocab, cor_data)
+            annotation = annot.annotate_docs(proc_orig, proc_cor, context)
+            with profiler.stage("format"):
+                block = annot.format_m2(annotation, args.feature_delimiter, plain=bool(args.features_out))
+                block_features = (features.docFeatures(proc_orig), features.docFeatures(proc_cor)) if args.features_out else None
+        except KeyboardInterrupt:
+            raise
+        except:
+            block = block_features = None
+            profiler.count("ignored")
+        profiler.endPair(line_id, orig_sent, cor_sent, pair_start)
+        results.append((line_id, orig_sent, cor_sent, block, block_features))
+    return seq, results, profiler.stop() if args.profile else None
+
+class Pipeline(object):
+
+    """
+    Runs the read, parse, align and write stages over the sentence pairs of
+    one file. The read and parse stages are threads of the main process; the
+    align stage is a process pool fed by the parsed queue.
+    """
+
+    def __init__(self, annot, detokenizer, args):
+        self.annot = annot
+        self.detokenizer = detokenizer
+        self.resources = (annot, align_text.makeContext(annot.nlp, args), args)
+        self.args = args
+        self.read_q = queue.Queue(args.queue_size)
+        self.parsed_q = queue.Queue(args.queue_size)
+        # Batches that are read but not yet written. The read stage takes a slot
+        # in order, so the batch the writer waits for always holds one.
+        self.in_flight = threading.Semaphore(args.queue_size)
+        self.errors = []
+        self.ignored = 0
+        # The token features of the written blocks, with -features_out.
+        self.feature_writer = features.FeatureWriter() if args.features_out else None
+        # The parse threads and the writer share the profile.
+        self.prof = profiler.Profiler(args.trace) if args.profile else None
+        self.lock = threading.Lock()
+
+    # Runs a stage, and passes any exception on to the main thread.
+    def guard(self, stage, *stage_args):
+        try:
+            stage(*stage_args)
+        except BaseException as e:
+            self.errors.append(e)
+            self.parsed_q.put(DONE)
+
+    # Read stage.
+    # Input 1: An iterable of (line_id, orig_sent, cor_sent).
+    def read(self, pairs):
+        args = self.args
+        batch = []
+        seq = 0
+        for line_id, orig_sent, cor_sent in pairs:
+            ok = len(orig_sent.strip().split()) >= 3 and len(cor_sent.strip().split()) >= 3
+            orig_text, cor_text = orig_sent, cor_sent
+            # Detokenize sents if they're pre-tokenized. Otherwise the result will be wrong.
+            try:
+                if ok and args.is_tokenized_orig:
+                    orig_text = self.detokenizer.detokenize(orig_sent.strip().split(), return_str=True)
+                if ok and args.is_tokenized_cor:
+                    cor_text = self.detokenizer.detokenize(cor_sent.strip().split(), return_str=True)
+            except Exception:
+                ok = False
+            batch.append((line_id, orig_sent, cor_sent, ok, orig_text.strip(), cor_text.strip()))
+            if len(batch) >= args.parse_batch:
+                self.in_flight.acquire()
+                self.read_q.put((seq, batch))
+                seq += 1
+                batch = []
+        if batch:
+            self.in_flight.acquire()
+            self.read_q.put((seq, batch))
+        for _ in range(args.parse_jobs):
+            self.read_q.put(DONE)
+
+    # Parse stage.
+    def parse(self):
+        while True:
+            batch = self.read_q.get()
+            if batch is DONE:
+                self.parsed_q.put(DONE)
+                return
+            seq, items = batch
+            start = perf_counter()
+            # Each identical pair only needs its original sentence parsed.
+            texts = []
+            for _, _, _, ok, orig_text, cor_text in items:
+                if not ok: continue
+                texts.append(orig_text)
+                if orig_text != cor_text: texts.append(cor_text)
+            docs = iter(self.parseTexts(texts))
+            parsed = []
+            for line_id, orig_sent, cor_sent, ok, orig_text, cor_text in items:
+                identical = orig_text == cor_text
+                orig_doc = next(docs) if ok else None
+                cor_doc = next(docs) if ok and not identical else None
+                if orig_doc is None or (cor_doc is None and ok and not identical):
+                    parsed.append((line_id, orig_sent, cor_sent, identical, None, None))
+                else:
+                    parsed.append((line_id, orig_sent, cor_sent, identical, serializeDoc(orig_doc),
+                                   serializeDoc(cor_doc) if cor_doc is not None else None))
+            if self.prof:
+                with self.lock: self.prof.add("parse", perf_counter()-start)
+            self.parsed_q.put((seq, parsed))
+
+    # Input: A list of sentences.
+    # Output: A list of Spacy docs, with None for any sentence that failed to parse.
+    def parseTexts(self, texts):
+        return [None if isinstance(doc, Exception) else doc for doc in self.annot.parse_each(texts)]
+
+    # Feeds parsed batches to the align pool until every parse thread is done.
+    def feed(self):
+        done = 0
+        while done < self.args.parse_jobs:
+            batch = self.parsed_q.get()
+            if batch is DONE:
+                done += 1
+                if self.errors: return
+                continue
+            yield batch
+
+    # Write stage.
+    # Input 1: An iterable of (line_id, orig_sent, cor_sent).
+    # Input 2: The output m2 file.
+    # Output: The merged profile of all the stages, or None.
+    def process(self, pairs, out_m2):
+        args = self.args
+        threads = [threading.Thread(target=self.guard, args=(self.read, pairs), daemon=True)]
+        threads += [threading.Thread(target=self.guard, args=(self.parse,), daemon=True) for _ in range(args.parse_jobs)]
+        for thread in threads: thread.start()
+        pending = {}
+        next_seq = 0
+        with Pool(args.align_jobs, initializer=initAlign, initargs=(self.resources,)) as pool:
+            for seq, results, batch_prof in pool.imap_unordered(alignBatch, self.feed()):
+                pending[seq] = results
+                if batch_prof:
+                    with self.lock: self.prof.merge(batch_prof)
+                # Write every batch that is next in order.
+                while next_seq in pending:
+                    for line_id, orig_sent, cor_sent, block, block_features in pending.pop(next_seq):
+                        if block is None:
+                            self.ignore(orig_sent, cor_sent)
+                            continue
+                        out_m2.write(block)
+                        if self.feature_writer: self.feature_writer.add(*block_features)
+                    next_seq += 1
+                    self.in_flight.release()
+        if self.errors: raise self.errors[0]
+        return self.prof
+
+    # Input 1-2: The original and corrected sentences of a pair that is ignored.
+    def ignore(self, orig_sent, cor_sent):
+        self.ignored += 1
+        print('\nMissing count:', self.ignored)
+        print('- Source: ', orig_sent)
+        print('- Target: ', cor_sent)
+        print()
+
+# Input 1: Command line args.
+# Input 2: An annotator.Annotator.
+# Input 3: A Moses detokenizer.
+# Runs the pipeline over args.orig and args.cor and writes args.out.
+def run(args, annot, detokenizer):
+    print("Processing files...")
+    with stream_io.openFile(args.orig) as orig, stream_io.openFile(args.cor) as cor, stream_io.openFile(args.out, "w") as out_m2:
+        pairs = zip(orig, cor)
+        # Seek straight to the requested sentence pairs using the sidecar indexes.
+        if args.range:
+            pairs = zip(offset_index.iterLines(args.orig, args.range), offset_index.iterLines(args.cor, args.range))
+        # Line numbers of the pairs, for tracing.
+        line_ids = range(len(offset_index.OffsetIndex.load(args.orig, "lines")))[args.range] if args.range else count()
+        stages = Pipeline(annot, detokenizer, args)
+        prof = stages.process(((line_id, orig_sent, cor_sent) for line_id, (orig_sent, cor_sent) in zip(line_ids, tqdm(pairs))), out_m2)
+    if stages.feature_writer: stages.feature_writer.write(args.features_out)
+    print('Total number of ignored examples: {}\n'.format(stages.ignored))
+    # Report the time spent in each stage.
+    if args.profile: profiler.finish(prof, args)
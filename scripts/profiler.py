@@ -0,0 +1,316 @@
+import heapq
+import json
+import math
+import threading
+from time import perf_counter
+
+# Low-overhead per-stage timers and counters for the extraction pipeline.
+# Instrumented code wraps each stage in `with profiler.stage(name):`. While no
+# profiler is active, stage() returns a shared no-op context, so the cost is
+# one thread-local lookup and a function call per stage. The active profiler
+# is per thread, so threads never write into each other's profiles; threads
+# that profile start their own and the caller merges them. Durations are kept in
+# log-scale histograms rather than as raw samples, so memory does not grow
+# with the corpus and histograms from different workers can simply be summed.
+# A profiler can also trace the N slowest sentence pairs: stage times and
+# notes (e.g. DP table size) are then also collected per pair, and each pair
+# is kept in a bounded min-heap if it is among the slowest seen so far.
+# With rules on, a profiler also counts how often each merge rule and error
+# type fires (`profiler.rule(name)`), and times the expensive checks they make
+# (`with profiler.check(name):`). Both are no-ops unless a profiler with rules
+# on is active. Rules are grouped by the prefix of their name (`merge`, `type`,
+# `classify`, `check`), shown as a share of their group, and summed across
+# workers like the stage histograms.
+
+# Histogram buckets per doubling of time; percentiles are accurate to ~4.4%.
+BUCKETS_PER_OCTAVE = 16
+# Durations are floored at 1 nanosecond so they have a bucket.
+MIN_SECONDS = 1e-9
+PERCENTILES = [50, 95, 99]
+
+class _Local(threading.local):
+    # The active Profiler of the thread, or None if profiling is off.
+    active = None
+
+_LOCAL = _Local()
+
+class Histogram(object):
+
+    """
+    A log-scale histogram of durations in seconds, with exact count, total
+    and max.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = math.floor(math.log2(max(seconds, MIN_SECONDS))*BUCKETS_PER_OCTAVE)
+        self.buckets[bucket] = self.buckets.get(bucket, 0)+1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max: self.max = seconds
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0)+count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    # Input: A percentile; e.g. 95.
+    # Output: The upper bound of the bucket containing that percentile, in seconds.
+    def percentile(self, pct):
+        rank = math.ceil(self.count*pct/100.0)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(2**((bucket+1)/BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+class Profiler(object):
+
+    """
+    Duration histograms for named stages and plain event counters, plus the
+    `slowest` slowest sentence pairs if slowest > 0. Profilers from
+    different processes are combined with merge().
+    """
+
+    def __init__(self, slowest=0, rules=False):
+        self.stages = {}
+        self.counters = {}
+        self.slowest = slowest
+        # Rule firing counts, and the total seconds of the timed ones.
+        self.rules = rules
+        self.rule_counts = {}
+        self.rule_times = {}
+        # Min-heap of (seconds, line, record), so the fastest is popped first.
+        self.pairs = []
+        self.pair_stages = {}
+        self.pair_notes = {}
+
+    def add(self, name, seconds):
+        hist = self.stages.get(name)
+        if hist is None: hist = self.stages[name] = Histogram()
+        hist.add(seconds)
+        if self.slowest: self.pair_stages[name] = self.pair_stages.get(name, 0)+seconds
+
+    # Saves a fact about the current pair, if tracing.
+    def note(self, name, value):
+        if self.slowest: self.pair_notes[name] = value
+
+    # Input 1: The 0-based line number of the pair.
+    # Input 2-3: The original and corrected sentence, as passed to spacy.
+    # Input 4: The time taken by the pair.
+    def endPair(self, line, orig, cor, seconds):
+        self.add("pair", seconds)
+        if not self.slowest: return
+        record = {"line": line, "seconds": seconds, "orig": orig.strip(), "cor": cor.strip()}
+        record.update(self.pair_notes)
+        record["stages"] = self.pair_stages
+        self.pushPair((seconds, line, record))
+        self.pair_stages = {}
+        self.pair_notes = {}
+
+    def pushPair(self, item):
+        if len(self.pairs) < self.slowest: heapq.heappush(self.pairs, item)
+        elif item[0] > self.pairs[0][0]: heapq.heapreplace(self.pairs, item)
+
+    # Output: The traced pair records, slowest first.
+    def slowestPairs(self):
+        return [record for seconds, line, record in sorted(self.pairs, reverse=True)]
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0)+n
+
+    # Input 1: A rule name; e.g. "merge:5:split".
+    # Input 2: The time the rule took, or None if it is not timed.
+    # Input 3: The number of firings.
+    def fire(self, name, seconds=None, n=1):
+        self.rule_counts[name] = self.rule_counts.get(name, 0)+n
+        if seconds is not None: self.rule_times[name] = self.rule_times.get(name, 0.0)+seconds
+
+    def merge(self, other):
+        for name, hist in other.stages.items():
+            self.stages.setdefault(name, Histogram()).merge(hist)
+        for name, n in other.counters.items():
+            self.count(name, n)
+        for name, n in other.rule_counts.items():
+            self.fire(name, other.rule_times.get(name), n)
+        for item in other.pairs:
+            self.pushPair(item)
+
+    # Output: A dictionary of stage statistics (in seconds) and counters.
+    def summary(self):
+        stages = {}
+        for name, hist in self.stages.items():
+            stats = {"count": hist.count, "total": hist.total, "mean": hist.total/hist.count}
+            for pct in PERCENTILES:
+                stats["p"+str(pct)] = hist.percentile(pct)
+            stats["max"] = hist.max
+            stages[name] = stats
+        rules = {}
+        for name, n in self.rule_counts.items():
+            rules[name] = {"count": n}
+            if name in self.rule_times:
+                rules[name]["total"] = self.rule_times[name]
+                rules[name]["mean"] = self.rule_times[name]/n
+        return {"stages": stages, "counters": dict(self.counters), "rules": rules}
+
+    # Prints how often each rule fired, as a share of its group (the part of
+    # its name before the first ":"), and the time taken by the timed ones.
+    def reportRules(self, rules):
+        print("\n{:<32} {:>10} {:>7} {:>10} {:>9}".format("Rule", "Fired", "Share", "Total(s)", "Mean(us)"))
+        groups = {}
+        for name, stats in rules.items():
+            groups.setdefault(name.split(":", 1)[0], []).append((name, stats))
+        for group, items in sorted(groups.items()):
+            fired = sum(stats["count"] for name, stats in items)
+            for name, stats in sorted(items, key=lambda x: (-x[1].get("total", 0), -x[1]["count"], x[0])):
+                timing = "{:>10.3f} {:>9.2f}".format(stats["total"], stats["mean"]*1e6) if "total" in stats else "{:>10} {:>9}".format("-", "-")
+                print("{:<32} {:>10} {:>6.1f}% {}".format(name, stats["count"], 100.0*stats["count"]/fired, timing))
+
+    # Prints a table of stage statistics (in ms) and counters, slowest stage first.
+    def report(self):
+        summary = self.summary()
+        print("{:<12} {:>9} {:>10} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+            "Stage", "Count", "Total(s)", "Mean(ms)", "p50(ms)", "p95(ms)", "p99(ms)", "Max(ms)"))
+        for name, stats in sorted(summary["stages"].items(), key=lambda x: -x[1]["total"]):
+            print("{:<12} {:>9} {:>10.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}".format(
+                name, stats["count"], stats["total"], stats["mean"]*1000, stats["p50"]*1000,
+                stats["p95"]*1000, stats["p99"]*1000, stats["max"]*1000))
+        for name, n in sorted(summary["counters"].items()):
+            print("{:<12} {:>9}".format(name, n))
+        if summary["rules"]: self.reportRules(summary["rules"])
+        if not self.pairs: return
+        print("\nSlowest pairs:")
+        print("{:>9} {:>10} {:>8} {:>8} {:>10} {:>8} {:>6}".format(
+            "Line", "Time(ms)", "OrigLen", "CorLen", "DPCells", "Windows", "Edits"))
+        for record in self.slowestPairs():
+            print("{:>9} {:>10.3f} {:>8} {:>8} {:>10} {:>8} {:>6}".format(record["line"], record["seconds"]*1000,
+                *[record.get(name, "-") for name in ["orig_len", "cor_len", "dp_cells", "windows", "edits"]]))
+
+    # Input: The output JSON filepath.
+    def dump(self, path):
+        with open(path, "w") as out:
+            json.dump(self.summary(), out, indent=2)
+
+    # Input 1: The output JSON filepath.
+    # Input 2: A dictionary of the alignment settings; e.g. lev and merge.
+    # Saves the slowest pairs so they can be replayed with replay_slow.py.
+    def dumpSlowest(self, path, settings):
+        with open(path, "w") as out:
+            json.dump({"settings": settings, "pairs": self.slowestPairs()}, out, indent=2, ensure_ascii=False)
+
+class _Stage(object):
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        # The profiler may have been stopped inside the stage.
+        prof = _LOCAL.active
+        if prof is not None: prof.add(self.name, perf_counter()-self.start)
+
+class _NoStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+_NO_STAGE = _NoStage()
+
+class _Check(object):
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        prof = _LOCAL.active
+        if prof is not None: prof.fire(self.name, perf_counter()-self.start)
+
+# Input: A stage name.
+# Output: A context manager that times the stage if profiling is on.
+def stage(name):
+    if _LOCAL.active is None: return _NO_STAGE
+    return _Stage(name)
+
+# Input 1: A counter name.
+# Input 2: The amount to add.
+def count(name, n=1):
+    prof = _LOCAL.active
+    if prof is not None: prof.count(name, n)
+
+# Output: The active Profiler of this thread, or None.
+def active():
+    return _LOCAL.active
+
+# Output: True if rule firings are being counted.
+def rulesOn():
+    prof = _LOCAL.active
+    return prof is not None and prof.rules
+
+# Input 1: A rule name; e.g. "merge:5:split".
+# Input 2: The time the rule took, if it is timed.
+# Counts a firing of the rule if rules are on.
+def rule(name, seconds=None):
+    prof = _LOCAL.active
+    if prof is not None and prof.rules: prof.fire(name, seconds)
+
+# Input: A check name; e.g. "check:sameLemma".
+# Output: A context manager that counts and times the check if rules are on.
+def check(name):
+    prof = _LOCAL.active
+    if prof is None or not prof.rules: return _NO_STAGE
+    return _Check(name)
+
+# Input 1: A name.
+# Input 2: A JSON serialisable value.
+# Saves a fact about the current pair if tracing.
+def note(name, value):
+    prof = _LOCAL.active
+    if prof is not None: prof.note(name, value)
+
+# Input 1: The 0-based line number of the pair.
+# Input 2-3: The original and corrected sentence, as passed to spacy.
+# Input 4: The perf_counter() time at which the pair started.
+def endPair(line, orig, cor, start):
+    prof = _LOCAL.active
+    if prof is not None: prof.endPair(line, orig, cor, perf_counter()-start)
+
+# Input 1: The number of slowest pairs to trace; 0 for none.
+# Input 2: Whether to count rule firings and time checks.
+# Makes a new Profiler the active one of this thread.
+def start(slowest=0, rules=False):
+    _LOCAL.active = Profiler(slowest, rules)
+
+# Output: The active Profiler, which is no longer active.
+def stop():
+    prof, _LOCAL.active = _LOCAL.active, None
+    return prof
+
+# Input 1: A Profiler.
+# Input 2: Command line args.
+# Prints the profile, and saves it and the slowest pairs if required.
+def finish(prof, args):
+    print("\nProfile:")
+    prof.report()
+    if args.profile_json: prof.dump(args.profile_json)
+    if getattr(args, "trace", 0):
+        prof.dumpSlowest(args.trace_out, {"lev": args.lev, "merge": args.merge})
+        print("\nSaved the {} slowest pairs to {}".format(len(prof.pairs), args.trace_out))
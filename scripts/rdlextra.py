@@ -86,7 +86,9 @@
 
 import collections
 import doctest
+import heapq
 import pprint
+from time import perf_counter
 
 
 # Default cost functions.
@@ -108,6 +110,15 @@ def TRANSPOSITION(A, B, A_extra=None, B_extra=None):
 
 Trace = collections.namedtuple("Trace", ["cost", "ops"])
 
+# The default maximum number of partial paths kbest() keeps in its queue.
+MAX_STATES = 100000
+
+class AlignmentTimeout(Exception):
+    """
+    Raised when filling the table takes longer than the deadline.
+    """
+    pass
+
 class WagnerFischer(object):
 
     """
@@ -145,7 +156,7 @@ class WagnerFischer(object):
     >>> thesmalldog = "the small dog".split()
     >>> thebigdog = "the big dog".split()
     >>> bigdog = "big dog".split()
-    >>> sub_inf = lambda A, B: float("inf")
+    >>> sub_inf = lambda A, B, A_extra=None, B_extra=None: float("inf")
 
     # Deletion.
     >>> wf = WagnerFischer(thebigdog, bigdog, substitution=sub_inf)
@@ -161,18 +172,40 @@ class WagnerFischer(object):
     >>> wf = WagnerFischer(thebigdog, thesmalldog, substitution=sub_inf)
     >>> wf.IDS() == {"I": 1.0, "D": 1.0}
     True
+
+    k-best tests:
+
+    >>> wf = WagnerFischer("god", "gawd")
+    >>> wf.count_paths()
+    2
+    >>> list(wf.kbest(5))
+    [(2, ['M', 'S', 'I', 'M']), (2, ['M', 'I', 'S', 'M'])]
+    >>> wf = WagnerFischer("kitten", "sitting")
+    >>> [(cost, "".join(alignment)) for cost, alignment in wf.kbest(3, slack=1)]
+    [(3, 'SMMMSMI'), (4, 'IDMMMSMI'), (4, 'DIMMMSMI')]
+    >>> wf.IDS(k=1) == wf.IDS()
+    True
+
+    Like alignments(), two empty sequences have no alignments:
+
+    >>> wf = WagnerFischer("", "")
+    >>> list(wf.alignments()), list(wf.kbest(3)), wf.count_paths()
+    ([], [], 0)
     """
 
     # Initializes pretty printer (shared across all class instances).
     pprinter = pprint.PrettyPrinter(width=75)
 
     def __init__(self, A, B, A_extra=None, B_extra=None, insertion=INSERTION, deletion=DELETION,
-                 substitution=SUBSTITUTION, transposition=TRANSPOSITION):
+                 substitution=SUBSTITUTION, transposition=TRANSPOSITION, deadline=None):
         # Stores cost functions in a dictionary for programmatic access.
         self.costs = {"I": insertion, "D": deletion, "S": substitution, "T":transposition}
-        # Keep lowercased versions for transpositions
-        Al = [x.lower() for x in A]
-        Bl = [x.lower() for x in B]
+        # Keep the sentences for kbest(), and lowercased versions for transpositions
+        self.A, self.B, self.A_extra, self.B_extra = A, B, A_extra, B_extra
+        self.Al = [x.lower() for x in A]
+        self.Bl = [x.lower() for x in B]
+        # Set by kbest() when it had to drop partial paths.
+        self.truncated = False
         # Initializes table.
         self.asz = len(A)
         self.bsz = len(B)
@@ -189,7 +222,12 @@ class WagnerFischer(object):
                                {"I"})
 
         ## Fills in rest.
+        # Counts the transposition windows compared; the main cost on long, reordered pairs.
+        windows = 0
         for i in range(len(A)):
+            # Checks the optional perf_counter() deadline once per row.
+            if deadline is not None and perf_counter() > deadline:
+                raise AlignmentTimeout("Alignment of {}x{} tokens did not finish in time".format(self.asz, self.bsz))
             for j in range(len(B)):
                 # Cleans it up in case there are more than one check for match
                 # first, as it is always the cheapest option.
@@ -200,20 +238,11 @@ class WagnerFischer(object):
                     costD = self[i][j + 1].cost + self.costs["D"](A[i], A_extra[i] if A_extra else None)
                     costI = self[i + 1][j].cost + self.costs["I"](B[j], B_extra[j] if B_extra else None)
                     costS = self[i][j].cost + self.costs["S"](A[i], B[j], A_extra[i] if A_extra else None, B_extra[j] if B_extra else None)
-                    costT = float("inf") # We don't know it yet
                     min_val = min(costI, costD, costS)
-
-                    # Multiword transpositions:
-                    # Find a sequence of equal elements in different order
-                    # We only need to check diagonally because we require the same number of elements
-                    k = 1
-                    #while i > 0 and j > 0 and (i - k) >= 0 and (j - k) >= 0 and any(x in ["D", "I", "S"] for x in self[i-k+1][j-k+1].ops):
-                    while i > 0 and j > 0 and (i - k) >= 0 and (j - k) >= 0 and self[i-k+1][j-k+1].cost - self[i-k][j-k].cost > 0: # An operation that has a cost (i.e. I, D or S > 0)
-                        if collections.Counter(Al[i-k:i+1]) == collections.Counter(Bl[j-k:j+1]):
-                            costT = self[i-k][j-k].cost + self.costs["T"](A[i-k:i+1], B[j-k:j+1], A_extra[i-k:i+1] if A_extra else None, B_extra[j-k:j+1] if B_extra else None)
-                            min_val = min(min_val, costT)
-                            break
-                        k += 1
+                    # Multiword transpositions
+                    k, costT, checked = self._transposition(i, j)
+                    windows += checked
+                    min_val = min(min_val, costT)
 
                     trace = Trace(min_val, []) # Use a list to preserve the order
                     # Adds _all_ operations matching minimum value.
@@ -229,6 +258,27 @@ class WagnerFischer(object):
 
         # Stores optimum cost as a property.
         self.cost = self[-1][-1].cost
+        self.windows = windows
+
+    def _transposition(self, i, j):
+        """
+        Finds the transposition ending at A[i] and B[j], if any. Only the
+        cells filled before (i, j) are read. Returns (k, cost, windows):
+        the transposition covers A[i-k:i+1] and B[j-k:j+1], its cost is
+        inf if there is none, and windows is the number of windows checked.
+        """
+        # Find a sequence of equal elements in different order
+        # We only need to check diagonally because we require the same number of elements
+        A, B, A_extra, B_extra = self.A, self.B, self.A_extra, self.B_extra
+        k = 1
+        windows = 0
+        while i > 0 and j > 0 and (i - k) >= 0 and (j - k) >= 0 and self[i-k+1][j-k+1].cost - self[i-k][j-k].cost > 0: # An operation that has a cost (i.e. I, D or S > 0)
+            windows += 1
+            if collections.Counter(self.Al[i-k:i+1]) == collections.Counter(self.Bl[j-k:j+1]):
+                costT = self[i-k][j-k].cost + self.costs["T"](A[i-k:i+1], B[j-k:j+1], A_extra[i-k:i+1] if A_extra else None, B_extra[j-k:j+1] if B_extra else None)
+                return k, costT, windows
+            k += 1
+        return k, float("inf"), windows
 
     def __repr__(self):
         return self.pprinter.pformat(self._table)
@@ -314,15 +364,103 @@ class WagnerFischer(object):
                 continue
             queue.extend(self._stepback(i, j, trace, path_back))
 
-    def IDS(self):
+    def _steps(self, i, j, optimal=False):
+        """
+        Given a cell location (i, j), generate the operations that can end
+        there as (op, previous i, previous j, cost of the operation): only
+        those in the table if optimal is True, otherwise every one, whether
+        it is optimal or not. Matches are the only option for equal
+        elements, as in the table.
+        """
+        A, B, A_extra, B_extra = self.A, self.B, self.A_extra, self.B_extra
+        if i and j and A[i - 1] == B[j - 1]:
+            yield "M", i - 1, j - 1, 0
+            return
+        ops = self[i][j].ops if optimal else None
+        if i and (ops is None or "D" in ops):
+            yield "D", i - 1, j, self.costs["D"](A[i - 1], A_extra[i - 1] if A_extra else None)
+        if j and (ops is None or "I" in ops):
+            yield "I", i, j - 1, self.costs["I"](B[j - 1], B_extra[j - 1] if B_extra else None)
+        if i and j and (ops is None or "S" in ops):
+            yield "S", i - 1, j - 1, self.costs["S"](A[i - 1], B[j - 1], A_extra[i - 1] if A_extra else None, B_extra[j - 1] if B_extra else None)
+        if i and j and (ops is None or any(op.startswith("T") for op in ops)):
+            k, costT, _ = self._transposition(i - 1, j - 1)
+            if costT != float("inf"):
+                yield "T" + str(k + 1), i - k - 1, j - k - 1, costT - self[i - k - 1][j - k - 1].cost
+
+    def kbest(self, k, slack=0, max_states=MAX_STATES):
+        """
+        Generate up to k alignments as (cost, alignment), cheapest first:
+        the optimal alignments (the same ones as alignments()), then, if
+        slack > 0, those that cost at most slack more. Partial paths are
+        expanded back from the bottom right cell in a priority queue
+        ordered by their cost so far plus the table cost of the cell they
+        reached, which is exactly the cheapest way to finish them, so
+        complete paths come out in cost order. Paths share their tails, and
+        at most max_states of them are queued; if there would be more, the
+        most expensive are dropped, self.truncated is set, and enumeration
+        stops before any alignment that might have been missed.
+        """
+        self.truncated = False
+        # The origin cell is not an alignment; see alignments().
+        if not self.asz and not self.bsz: return
+        limit = self.cost + slack + 1e-9
+        bound = float("inf")
+        # Each entry is (estimated total cost, tie breaker, cost so far, i, j, path); paths are (op, rest) links.
+        queue = [(self.cost, 0, 0, self.asz, self.bsz, None)]
+        pushed = 1
+        found = 0
+        while queue and found < k:
+            total, _, cost, i, j, path = heapq.heappop(queue)
+            if total >= bound: break
+            if i == 0 and j == 0:
+                alignment = []
+                while path:
+                    alignment.append(path[0])
+                    path = path[1]
+                found += 1
+                yield cost, alignment
+                continue
+            for op, prev_i, prev_j, step in self._steps(i, j, optimal=not slack):
+                total = cost + step + self[prev_i][prev_j].cost
+                if total > limit: continue
+                heapq.heappush(queue, (total, pushed, cost + step, prev_i, prev_j, (op, path)))
+                pushed += 1
+            # Keep the cheapest half of the queue if it is full.
+            if len(queue) > max_states:
+                queue.sort()
+                bound = min(bound, queue[max_states // 2][0])
+                del queue[max_states // 2:]
+                self.truncated = True
+
+    def count_paths(self):
+        """
+        Returns the number of optimal alignments, without generating them,
+        by counting the paths into every cell of the table.
+        """
+        if not self.asz and not self.bsz: return 0
+        paths = [[0] * (self.bsz + 1) for _ in range(self.asz + 1)]
+        for i in range(self.asz + 1):
+            for j in range(self.bsz + 1):
+                trace = self[i][j]
+                if trace.ops == {"O"}:
+                    paths[i][j] = 1
+                    continue
+                for prev_i, prev_j, _, _ in self._stepback(i, j, trace, []):
+                    paths[i][j] += paths[prev_i][prev_j]
+        return paths[-1][-1]
+
+    def IDS(self, k=None):
         """
         Estimates insertions, deletions, and substitution _count_ (not
         costs). Non-integer values arise when there are multiple possible
-        alignments with the same cost.
+        alignments with the same cost. If k is given, only the first k
+        optimal alignments from kbest() are averaged.
         """
         npaths = 0
         opcounts = collections.Counter()
-        for alignment in self.alignments():
+        alignments = self.alignments() if k is None else (alignment for _, alignment in self.kbest(k))
+        for alignment in alignments:
             # Counts edit types for this path, ignoring "M" (which is free).
             opcounts += collections.Counter(op for op in alignment if op != "M")
             npaths += 1
@@ -0,0 +1,172 @@
+import collections
+from time import perf_counter
+import numpy as np
+import scripts.rdlextra as DL
+
+# A vectorized version of rdlextra.WagnerFischer for long sentence pairs.
+# The tokens of both sentences are interned to integer ids, and the exact
+# and lowercase match matrices are computed in one NumPy broadcast each. The
+# table is then filled one anti-diagonal at a time: every cell of a diagonal
+# only depends on the two diagonals before it, so the match, deletion,
+# insertion and substitution costs of a whole diagonal are array operations.
+# Transpositions are searched for every cell of a diagonal at once, using
+# sums of random 64-bit token hashes to find windows with the same tokens
+# (confirmed exactly with Counters). Traces are only built for the cells
+# that the traceback visits. The cost functions are called with the same
+# arguments as in rdlextra, and the table, costs, operations and alignments
+# are exactly the same.
+
+# Operation bits of a cell.
+OP_D, OP_I, OP_S, OP_T = 1, 2, 4, 8
+
+# Input: A list of strings.
+# Input 2: A dictionary of strings to ids, updated in place.
+# Output: A NumPy array of the string ids.
+def intern(strings, ids):
+    return np.array([ids.setdefault(string, len(ids)) for string in strings], dtype=np.int64)
+
+class WagnerFischer(DL.WagnerFischer):
+
+    """
+    The same as rdlextra.WagnerFischer, with the table filled by
+    anti-diagonals in NumPy arrays. Cells are only turned into Trace
+    objects when the alignments are traversed.
+    """
+
+    def __init__(self, A, B, A_extra=None, B_extra=None, insertion=DL.INSERTION, deletion=DL.DELETION,
+                 substitution=DL.SUBSTITUTION, transposition=DL.TRANSPOSITION, deadline=None):
+        self.costs = {"I": insertion, "D": deletion, "S": substitution, "T": transposition}
+        self.A, self.B, self.A_extra, self.B_extra = A, B, A_extra, B_extra
+        self.truncated = False
+        n = self.asz = len(A)
+        m = self.bsz = len(B)
+        # Intern the tokens and their lowercased versions, and compare every pair at once.
+        ids, lower_ids = {}, {}
+        Al = self.Al = [x.lower() for x in A]
+        Bl = self.Bl = [x.lower() for x in B]
+        A_ids, B_ids = intern(A, ids), intern(B, ids)
+        match = A_ids[:, None] == B_ids[None, :]
+        Al_ids, Bl_ids = intern(Al, lower_ids), intern(Bl, lower_ids)
+        # Prefix sums of random hashes of the lowercased tokens; two windows
+        # with the same tokens in any order have the same sum.
+        hashes = np.random.RandomState(0).randint(1, 2**63-1, size=len(lower_ids)+1, dtype=np.int64).astype(np.uint64)
+        A_sums = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(hashes[Al_ids], dtype=np.uint64)])
+        B_sums = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(hashes[Bl_ids], dtype=np.uint64)])
+        # Deletion, insertion and substitution costs. Substitutions are only needed where the tokens differ.
+        del_costs = np.array([deletion(A[i], A_extra[i] if A_extra else None) for i in range(n)], dtype=float)
+        ins_costs = np.array([insertion(B[j], B_extra[j] if B_extra else None) for j in range(m)], dtype=float)
+        sub_costs = np.zeros((n, m))
+        for i, j in zip(*np.nonzero(~match)):
+            sub_costs[i, j] = substitution(A[i], B[j], A_extra[i] if A_extra else None, B_extra[j] if B_extra else None)
+        # The cost of every cell, its operation bits, transposition length and
+        # the number of positive cost steps that lead to it along its diagonal.
+        cost = np.zeros((n+1, m+1))
+        ops = np.zeros((n+1, m+1), dtype=np.uint8)
+        trans = np.zeros((n+1, m+1), dtype=np.int64)
+        steps = np.zeros((n+1, m+1), dtype=np.int64)
+        cost[1:, 0] = np.cumsum(del_costs)
+        cost[0, 1:] = np.cumsum(ins_costs)
+        windows = 0
+        for diagonal in range(2, n+m+1):
+            if deadline is not None and perf_counter() > deadline:
+                raise DL.AlignmentTimeout("Alignment of {}x{} tokens did not finish in time".format(n, m))
+            # The table cells (p, q) of this diagonal; the tokens are A[p-1] and B[q-1].
+            p = np.arange(max(1, diagonal-m), min(n, diagonal-1)+1)
+            if not len(p): continue
+            q = diagonal-p
+            i, j = p-1, q-1
+            diag = cost[i, j]
+            is_match = match[i, j]
+            costD = cost[i, q]+del_costs[i]
+            costI = cost[p, j]+ins_costs[j]
+            costS = diag+sub_costs[i, j]
+            min_val = np.minimum(np.minimum(costI, costD), costS)
+            # Transpositions: look back along the diagonal while the steps have a cost.
+            costT = np.full(len(p), np.inf)
+            lengths = np.zeros(len(p), dtype=np.int64)
+            max_k = np.where(is_match, 0, steps[i, j])
+            active = max_k > 0
+            k = 1
+            while active.any():
+                cells = np.nonzero(active)[0]
+                ci, cj = i[cells], j[cells]
+                windows += len(cells)
+                same = (A_sums[ci+1]-A_sums[ci-k]) == (B_sums[cj+1]-B_sums[cj-k])
+                for cell in cells[same]:
+                    a, b = i[cell], j[cell]
+                    if collections.Counter(Al[a-k:a+1]) != collections.Counter(Bl[b-k:b+1]): continue
+                    costT[cell] = cost[a-k, b-k]+transposition(A[a-k:a+1], B[b-k:b+1], A_extra[a-k:a+1] if A_extra else None,
+                                                               B_extra[b-k:b+1] if B_extra else None)
+                    lengths[cell] = k+1
+                    active[cell] = False
+                active &= max_k > k
+                k += 1
+            min_val = np.minimum(min_val, costT)
+            cell_ops = ((costD == min_val)*OP_D | (costI == min_val)*OP_I | (costS == min_val)*OP_S |
+                        (costT == min_val)*OP_T).astype(np.uint8)
+            # Matches are always the cheapest option.
+            cost[p, q] = np.where(is_match, diag, min_val)
+            ops[p, q] = np.where(is_match, 0, cell_ops)
+            trans[p, q] = lengths
+            steps[p, q] = np.where(cost[p, q]-diag > 0, steps[i, j]+1, 0)
+        self._table = LazyTable(cost, ops, trans)
+        self.cost = self[-1][-1].cost
+        self.windows = windows
+
+class LazyTable(object):
+
+    """
+    The rows of a filled table. Each cell is turned into the same Trace as
+    in rdlextra only when it is read, so a traceback only builds the cells
+    on its paths.
+    """
+
+    def __init__(self, cost, ops, trans):
+        self.cost = cost
+        self.ops = ops
+        self.trans = trans
+
+    def __len__(self):
+        return self.cost.shape[0]
+
+    def __iter__(self):
+        for p in range(len(self)):
+            yield self[p]
+
+    def __getitem__(self, p):
+        if p < 0: p += len(self)
+        return LazyRow(self, p)
+
+    # Output: The Trace of table cell (p, q).
+    def cell(self, p, q):
+        cost = self.cost[p, q].item()
+        if p == 0 and q == 0: return DL.Trace(cost, {"O"})
+        if q == 0: return DL.Trace(cost, {"D"})
+        if p == 0: return DL.Trace(cost, {"I"})
+        bits = self.ops[p, q]
+        if not bits: return DL.Trace(cost, {"M"})
+        ops = []
+        if bits & OP_D: ops.append("D")
+        if bits & OP_I: ops.append("I")
+        if bits & OP_S: ops.append("S")
+        if bits & OP_T: ops.append("T"+str(self.trans[p, q]))
+        return DL.Trace(cost, ops)
+
+class LazyRow(object):
+    def __init__(self, table, p):
+        self.table = table
+        self.p = p
+
+    def __len__(self):
+        return self.table.cost.shape[1]
+
+    def __iter__(self):
+        for q in range(len(self)):
+            yield self[q]
+
+    def __getitem__(self, q):
+        if q < 0: q += len(self)
+        return self.table.cell(self.p, q)
+
+    def __repr__(self):
+        return repr(list(self))
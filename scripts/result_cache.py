@@ -0,0 +1,148 @@
+import hashlib
+import os
+import sqlite3
+import zlib
+
+# A persistent cache of finished m2 blocks, so re-runs on an updated corpus
+# only process new or changed sentence pairs. Blocks are stored zlib
+# compressed in a SQLite file, keyed by a digest of the pair and of every
+# setting that can change the output. When the compressed blocks grow beyond
+# the size limit, the least recently used blocks are evicted. Deleted blocks
+# leave free pages that SQLite reuses, so the file itself only shrinks when
+# it is vacuumed; see vacuum() and verify_cache.py.
+
+# Bump this whenever a code change alters the m2 blocks that are produced.
+CACHE_VERSION = 2
+# Evict down to this fraction of the size limit, so eviction is not run for every new block.
+EVICT_TO = 0.9
+# Commit after this many changes.
+COMMIT_EVERY = 1000
+
+# Input: A file path.
+# Output: A digest of the file contents.
+def fileDigest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Input 1: Command line args.
+# Input 2: A loaded spacy pipeline.
+# Input 3: A list of resource file paths.
+# Output: A digest of everything besides the pair itself that affects the output.
+def settingsKey(args, nlp, resources):
+    import spacy
+    settings = [CACHE_VERSION, spacy.__version__, nlp.meta.get("name"), nlp.meta.get("version"), args.lev, args.merge,
+                args.feature_delimiter, args.is_tokenized_orig, args.is_tokenized_cor,
+                getattr(args, "max_cells", 0), getattr(args, "max_seconds", 0), getattr(args, "fallback", "all-merge"),
+                getattr(args, "paragraph", False)]
+    settings.extend(fileDigest(path) for path in resources)
+    return hashlib.blake2b(repr(settings).encode("utf-8"), digest_size=16).digest()
+
+# Input 1: The settings digest.
+# Input 2: The pair digest; see dedup.pairKey.
+# Output: The cache key.
+def cacheKey(settings_key, pair_key):
+    return hashlib.blake2b(settings_key+pair_key, digest_size=16).digest()
+
+class ResultCache(object):
+
+    """
+    A size-limited LRU cache of m2 blocks in a SQLite file. Each row keeps a
+    checksum of its block, so verify() can find corrupt entries.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS blocks (key BLOB PRIMARY KEY, data BLOB, size INTEGER, "
+                        "checksum BLOB, used INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS blocks_used ON blocks (used)")
+        self.size, clock = self.db.execute("SELECT COALESCE(SUM(size), 0), COALESCE(MAX(used), 0) FROM blocks").fetchone()
+        # A logical clock for LRU order; it survives across runs.
+        self.clock = clock
+        self.changes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def tick(self):
+        self.clock += 1
+        self.changes += 1
+        if self.changes >= COMMIT_EVERY:
+            self.db.commit()
+            self.changes = 0
+        return self.clock
+
+    # Input: A cache key.
+    # Output: The cached m2 block, or None.
+    def get(self, key):
+        row = self.db.execute("SELECT data FROM blocks WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE blocks SET used = ? WHERE key = ?", (self.tick(), key))
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    # Input 1: A cache key.
+    # Input 2: An m2 block.
+    def put(self, key, block):
+        raw = block.encode("utf-8")
+        data = zlib.compress(raw)
+        checksum = hashlib.blake2b(raw, digest_size=16).digest()
+        old = self.db.execute("SELECT size FROM blocks WHERE key = ?", (key,)).fetchone()
+        if old: self.size -= old[0]
+        self.db.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?)", (key, data, len(data), checksum, self.tick()))
+        self.size += len(data)
+        if self.size > self.max_bytes: self.evict()
+
+    # Deletes the least recently used blocks until the total size of the
+    # compressed blocks is under the size limit.
+    def evict(self):
+        target = self.max_bytes*EVICT_TO
+        doomed = []
+        for key, size in self.db.execute("SELECT key, size FROM blocks ORDER BY used"):
+            if self.size <= target: break
+            doomed.append((key,))
+            self.size -= size
+        self.db.executemany("DELETE FROM blocks WHERE key = ?", doomed)
+        self.db.commit()
+
+    # Input: Boolean; delete corrupt entries.
+    # Output 1: The number of entries checked.
+    # Output 2: A list of keys (hex) of entries that cannot be decompressed or fail their checksum.
+    # Output 3: The SQLite integrity check result.
+    def verify(self, repair=False):
+        integrity = self.db.execute("PRAGMA integrity_check").fetchone()[0]
+        checked = 0
+        bad = []
+        for key, data, checksum in self.db.execute("SELECT key, data, checksum FROM blocks"):
+            checked += 1
+            try:
+                raw = zlib.decompress(data)
+                ok = hashlib.blake2b(raw, digest_size=16).digest() == checksum and raw.decode("utf-8").endswith("\n\n")
+            except (zlib.error, UnicodeDecodeError):
+                ok = False
+            if not ok: bad.append(key)
+        if repair and bad:
+            self.db.executemany("DELETE FROM blocks WHERE key = ?", [(key,) for key in bad])
+            self.db.commit()
+            self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blocks").fetchone()[0]
+        return checked, [key.hex() for key in bad], integrity
+
+    # Rebuilds the file without the free pages left by deleted blocks.
+    # Output: The file size in bytes.
+    def vacuum(self):
+        self.db.commit()
+        self.db.execute("VACUUM")
+        return os.path.getsize(self.path)
+
+    # Output: The number of entries.
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
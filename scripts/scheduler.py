@@ -0,0 +1,43 @@
+from itertools import islice
+
+# Cost-aware batching of sentence pairs for parallel workers.
+# Pairs are read a window at a time, sorted by their estimated alignment cost
+# and packed into batches of similar pairs, most expensive first, so a long
+# pair starts early instead of holding up the pool at the end of the window.
+# Every item keeps its position, so the output can be put back in order.
+
+# Input 1-2: The original and corrected sentence lines.
+# Output: The estimated alignment cost of the pair: its DP table size in (whitespace) tokens.
+def pairCost(orig, cor):
+    return (len(orig.split())+1)*(len(cor.split())+1)
+
+# Input 1: An iterable of items.
+# Input 2: The number of items per window.
+# Output: A generator of lists of at most window_size items, in order.
+def readWindows(items, window_size):
+    items = iter(items)
+    while True:
+        window = list(islice(items, window_size))
+        if not window: return
+        yield window
+
+# Input 1: A list of items whose last two fields are the original and corrected sentence lines.
+# Input 2: The maximum total cost of a batch.
+# Input 3: The maximum number of items in a batch.
+# Output: A list of batches (lists of items). Each batch holds pairs of
+# similar cost, and the batches are ordered from most to least expensive.
+# A pair over max_cost gets a batch of its own.
+def makeBatches(window, max_cost, max_items):
+    costed = sorted(((pairCost(item[-2], item[-1]), item) for item in window), key=lambda x: x[0], reverse=True)
+    batches = []
+    batch = []
+    batch_cost = 0
+    for cost, item in costed:
+        if batch and (batch_cost+cost > max_cost or len(batch) >= max_items):
+            batches.append(batch)
+            batch = []
+            batch_cost = 0
+        batch.append(item)
+        batch_cost += cost
+    if batch: batches.append(batch)
+    return batches
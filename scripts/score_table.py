@@ -0,0 +1,251 @@
+import numpy as np
+import scripts.m2bin as m2bin
+
+# Columnar scoring for compare_m2.
+# Instead of building one edit dict per sentence per coder, the hyp and ref
+# edits are loaded into flat integer arrays and the TP, FP and FN of every
+# (sentence, coder) pair are computed at once with sorted joins. The result
+# is identical to compare_m2.compareEdits, including its edge cases:
+# - Edit keys are grouped with all their categories, in file order.
+# - A key is a noop if the first category in its group is "noop".
+# - Noop hyp keys are never TP or FP, and noop ref keys are never FN.
+# - A TP counts every ref category for the matched key.
+
+NOOP_EDIT = (-1, -1, "noop", "-NONE-", "REQUIRED|||-NONE-", 0)
+
+# Input 1: A list of sentence+edits from compare_m2.loadM2.
+# Input 2: A dictionary that interns strings into global ids.
+# Output: A dictionary of edit columns; sent, start, end, coder, cat, cor.
+# Categories and corrections are global string ids.
+def loadColumns(m2, str_ids):
+    intern = lambda string: str_ids.setdefault(string, len(str_ids))
+    # M2 binary files: slice the memory-mapped columns directly.
+    if isinstance(m2, m2bin.EditLists) and m2.ids.step == 1:
+        return _loadBinColumns(m2, intern)
+    # Text m2 files: split all the edit lines at once.
+    if all(isinstance(sent, str) for sent in m2):
+        cols = _loadTextColumns(m2, str_ids, intern)
+        if cols: return cols
+    # Anything else, e.g. edit lists: only do the bare minimum per edit.
+    names = ["sent", "start", "end", "cat", "cor", "coder"]
+    cols = {name: [] for name in names}
+    sents, starts, ends, cats, cors, coders = [cols[name].append for name in names]
+    for sent_id, sent in enumerate(m2):
+        if isinstance(sent, str):
+            edits = [edit[2:].split("|||") for edit in sent.split("\n")[1:]]
+        else:
+            edits = [[str(start)+" "+str(end), cat, cor, coder] for start, end, cat, cor, extra, coder in sent]
+        # If there are no edits, pretend there was an explicit noop
+        if not edits: edits = [["-1 -1", NOOP_EDIT[2], NOOP_EDIT[3], 0]]
+        for edit in edits:
+            span = edit[0].split()
+            sents(sent_id)
+            starts(int(span[0]))
+            ends(int(span[1]))
+            cat_id = str_ids.get(edit[1])
+            cats(intern(edit[1]) if cat_id is None else cat_id)
+            cor_id = str_ids.get(edit[2])
+            cors(intern(edit[2]) if cor_id is None else cor_id)
+            coders(int(edit[-1]))
+    return {name: np.array(col, dtype=np.int64) for name, col in cols.items()}
+
+# Output: The same as loadColumns for a list of text m2 blocks, or None if
+# some edit line does not have exactly 6 fields.
+def _loadTextColumns(m2, str_ids, intern):
+    noop = m2bin.formatEditLine(*NOOP_EDIT)
+    # The edit lines of each sentence; if there are none, an explicit noop.
+    blocks = [(sent.split("\n", 1)+[noop])[1] for sent in m2]
+    sizes = np.array([block.count("\n")+1 for block in blocks], dtype=np.int64)
+    fields = "|||".join(blocks).replace("\n", "|||").split("|||")
+    if len(fields) != 6*sizes.sum(): return None
+    spans = " ".join(fields[0::6]).split()
+    if len(spans) != 3*len(fields)//6: return None
+    num_edits = len(spans)//3
+    to_ints = lambda strings: np.fromiter(map(int, strings), dtype=np.int64, count=num_edits)
+    cols = {"sent": np.repeat(np.arange(len(blocks)), sizes), "start": to_ints(spans[1::3]), "end": to_ints(spans[2::3])}
+    # Intern each distinct string once, then look every edit up at C speed.
+    for name, strings in [("cat", fields[1::6]), ("cor", fields[2::6])]:
+        for string in dict.fromkeys(strings): intern(string)
+        cols[name] = np.fromiter(map(str_ids.__getitem__, strings), dtype=np.int64, count=num_edits)
+    cols["coder"] = to_ints(fields[5::6])
+    return cols
+
+def _loadBinColumns(m2, intern):
+    bin_cols = m2.m2bin.cols
+    offsets = np.frombuffer(bin_cols["edit_offsets"], dtype=np.int64)[m2.ids.start:m2.ids.stop+1]
+    lo, hi = (offsets[0], offsets[-1]) if len(offsets) else (0, 0)
+    counts = np.diff(offsets)
+    cols = {"sent": np.repeat(np.arange(len(counts)), counts)}
+    for name in ["start", "end", "coder", "cat", "cor"]:
+        cols[name] = np.frombuffer(bin_cols["edit_"+name], dtype=np.int32)[lo:hi].astype(np.int64)
+    # Map the file's string ids onto the global ones.
+    for name in ["cat", "cor"]:
+        local_ids, inverse = np.unique(cols[name], return_inverse=True)
+        global_ids = np.array([intern(m2.m2bin.string(i)) for i in local_ids.tolist()], dtype=np.int64)
+        cols[name] = global_ids[inverse.reshape(-1)]
+    # If there are no edits, pretend there was an explicit noop
+    empty = np.flatnonzero(counts == 0)
+    if len(empty):
+        noop = {"sent": empty, "start": -1, "end": -1, "coder": 0,
+                "cat": intern(NOOP_EDIT[2]), "cor": intern(NOOP_EDIT[3])}
+        order = np.argsort(np.concatenate([cols["sent"], empty]), kind="stable")
+        for name in cols:
+            extra = np.broadcast_to(np.asarray(noop[name], dtype=np.int64), empty.shape)
+            cols[name] = np.concatenate([cols[name], extra])[order]
+    return cols
+
+# Input: A 2D integer array.
+# Output: An array of ids, one per row; equal rows get equal ids.
+def internRows(rows):
+    # Pack the columns into one integer key when they fit, which is much
+    # faster than sorting the rows.
+    key = np.zeros(len(rows), dtype=np.int64)
+    radix = 1
+    for col in rows.T:
+        lo = col.min() if len(col) else 0
+        span = (col.max()-lo+1) if len(col) else 1
+        radix *= int(span)
+        if radix >= 2**62:
+            return np.unique(rows, axis=0, return_inverse=True)[1].reshape(-1)
+        key = key*span + (col-lo)
+    return np.unique(key, return_inverse=True)[1].reshape(-1)
+
+class ScoreTable(object):
+
+    """
+    TP, FP and FN for every (sentence, ref coder) pair of a hyp and ref m2
+    file. Pairs are ordered by sentence and then by the order in which the
+    coders first appear in the sentence, i.e. the order in which compare_m2
+    considers them for best annotator selection.
+    """
+
+    # ref_cols: Optional (columns, str_ids) from loadColumns, to reuse one reference for many hyps.
+    def __init__(self, hyp_m2, ref_m2, args, ref_cols=None):
+        if ref_cols:
+            ref, str_ids = dict(ref_cols[0]), dict(ref_cols[1])
+            hyp = loadColumns(hyp_m2, str_ids)
+        else:
+            str_ids = {}
+            hyp = loadColumns(hyp_m2, str_ids)
+            ref = loadColumns(ref_m2, str_ids)
+        noop_id = str_ids.setdefault("noop", len(str_ids))
+        self.strings = sorted(str_ids, key=str_ids.get)
+        self.num_sents = len(ref_m2)
+        self.args = args
+
+        # Every coder in a sentence is a candidate, even if all their edits are filtered.
+        coders, ref["coder_id"] = np.unique(ref["coder"], return_inverse=True)
+        ref["coder_id"] = ref["coder_id"].reshape(-1)
+        num_coders = max(len(coders), 1)
+        pair_keys = ref["sent"]*num_coders + ref["coder_id"]
+        uniq_pairs, first = np.unique(pair_keys, return_index=True)
+        order = np.argsort(first, kind="stable")
+        self.pair_sent = uniq_pairs[order] // num_coders
+        self.pair_coder = coders[uniq_pairs[order] % num_coders]
+        pair_rank = np.empty(len(order), dtype=np.int64)
+        pair_rank[order] = np.arange(len(order))
+
+        # Only coder 0 in the hyp file is evaluated.
+        hyp = self._filter(hyp, hyp["coder"] == 0, str_ids)
+        ref = self._filter(ref, np.ones(len(ref["sent"]), dtype=bool), str_ids)
+        # Intern the edit keys for this evaluation mode.
+        key_ids = internRows(self._keyColumns(hyp, ref))
+        num_keys = max(len(key_ids), 1)
+        hyp["key"], ref["key"] = key_ids[:len(hyp["sent"])], key_ids[len(hyp["sent"]):]
+
+        # Group hyp edits by (sent, key) and ref edits by (sent, coder, key).
+        hyp_groups, h_first, hyp["group"], h_count = np.unique(hyp["sent"]*num_keys + hyp["key"],
+            return_index=True, return_inverse=True, return_counts=True)
+        ref_groups, r_first, ref["group"], r_count = np.unique(
+            (ref["sent"]*num_coders + ref["coder_id"])*num_keys + ref["key"],
+            return_index=True, return_inverse=True, return_counts=True)
+        hyp["group"], ref["group"] = hyp["group"].reshape(-1), ref["group"].reshape(-1)
+        h_noop = hyp["cat"][h_first] == noop_id
+        r_noop = ref["cat"][r_first] == noop_id
+        h_sent = hyp_groups // num_keys
+        # A sentinel hyp group that never matches lets the join below always index safely.
+        hyp_groups = np.append(hyp_groups, np.iinfo(np.int64).max)
+        h_count = np.append(h_count, 0)
+        h_noop = np.append(h_noop, True)
+        # Join each ref group with the hyp group of the same key.
+        r_pair = ref_groups // num_keys
+        r_sent = r_pair // num_coders
+        lookup = r_sent*num_keys + ref_groups % num_keys
+        h_pos = np.searchsorted(hyp_groups, lookup)
+        matched = hyp_groups[h_pos] == lookup
+        hit = matched & ~h_noop[h_pos]
+        r_pair = pair_rank[np.searchsorted(uniq_pairs, r_pair)]
+
+        num_pairs = len(self.pair_sent)
+        count = lambda index, weights: np.bincount(index, weights, minlength=num_pairs).astype(np.int64)
+        # TP: hyp keys in the ref; counts the ref categories.
+        self.tp = count(r_pair, r_count*hit)
+        # FN: non-noop ref keys not in the hyp.
+        self.fn = count(r_pair, r_count*(~matched & ~r_noop))
+        # FP: non-noop hyp keys not in the ref.
+        h_total = np.bincount(h_sent, (h_count*~h_noop)[:-1], minlength=self.num_sents).astype(np.int64)
+        self.fp = h_total[self.pair_sent] - count(r_pair, h_count[h_pos]*hit)
+        # Save what catDict needs.
+        self._hyp, self._ref = hyp, ref
+        self._h_noop, self._r_noop = h_noop, r_noop
+        self._r_pair, self._h_pos, self._matched, self._hit = r_pair, h_pos, matched, hit
+
+    # Drops the edits compare_m2.extractEdits ignores for these args.
+    def _filter(self, cols, keep, str_ids):
+        args = self.args
+        # Exclude uncorrected errors (UNK) in correction evaluation. Gold edits.
+        if not args.det_tok and not args.det_span and "UNK" in str_ids:
+            keep = keep & (cols["cat"] != str_ids["UNK"])
+        # Only evaluate edits with more than one token on at least one side.
+        if args.multi:
+            cor_len = np.array([len(string.split()) for string in self.strings], dtype=np.int64)
+            keep = keep & ~((cols["end"]-cols["start"] < 2) & (cor_len[cols["cor"]] < 2))
+        return {name: col[keep] for name, col in cols.items()}
+
+    # Output: A 2D array of edit keys for the hyp edits followed by the ref edits.
+    # Token based detection also splits every hyp and ref edit into tokens.
+    def _keyColumns(self, hyp, ref):
+        args = self.args
+        if args.det_tok:
+            for cols in [hyp, ref]:
+                start, end = cols["start"], cols["end"]
+                # Noops and insertions are 1 token, others are split into each token in the range.
+                single = (start == -1) | ((start == end) & (start >= 0))
+                reps = np.where(single, 1, np.maximum(end-start, 0))
+                rows = np.repeat(np.arange(len(start)), reps)
+                offset = np.arange(len(rows)) - np.repeat(np.cumsum(reps)-reps, reps)
+                for name in list(cols):
+                    cols[name] = cols[name][rows]
+                cols["key_start"] = cols["start"] + offset
+                # Noops keep the (-1, -1) key; insertions affect the token on the right.
+                cols["key_end"] = np.where(cols["start"] == -1, -1, cols["key_start"]+1)
+            names = ["key_start", "key_end"]
+        elif args.det_span:
+            names = ["start", "end"]
+        elif args.cor_span_err:
+            names = ["start", "end", "cat", "cor"]
+        else:
+            names = ["start", "end", "cor"]
+        return np.concatenate([np.stack([cols[name] for name in names], axis=1).reshape(-1, len(names))
+                               for cols in [hyp, ref]])
+
+    # Input: A list of chosen pair indexes, one per sentence.
+    # Output: The cumulative error category dict of those pairs; {cat: [tp, fp, fn]}
+    def catDict(self, chosen):
+        chosen_pair = np.zeros(len(self.pair_sent), dtype=bool)
+        chosen_pair[np.asarray(chosen, dtype=np.int64)] = True
+        in_chosen = chosen_pair[self._r_pair]
+        hyp, ref = self._hyp, self._ref
+        num_strings = len(self.strings)
+        # TP and FN use the ref categories.
+        group = ref["group"]
+        tp_rows = (in_chosen & self._hit)[group]
+        fn_rows = (in_chosen & ~self._matched & ~self._r_noop)[group]
+        # FP uses the hyp categories of non-noop hyp keys that the chosen coders do not have.
+        h_hit = np.zeros(len(self._h_noop), dtype=bool)
+        h_hit[self._h_pos[in_chosen & self._hit]] = True
+        fp_rows = (~self._h_noop & ~h_hit)[hyp["group"]]
+        counts = np.stack([np.bincount(ref["cat"][tp_rows], minlength=num_strings),
+                           np.bincount(hyp["cat"][fp_rows], minlength=num_strings),
+                           np.bincount(ref["cat"][fn_rows], minlength=num_strings)], axis=1)
+        return {self.strings[i]: counts[i].tolist() for i in np.flatnonzero(counts.sum(axis=1)).tolist()}
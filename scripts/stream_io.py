@@ -0,0 +1,116 @@
+import gzip
+import io
+import lzma
+import os
+
+# Transparent compressed, buffered file I/O for every input and output.
+# The compression is chosen by file extension: .gz (gzip), .xz (lzma) or
+# .zst (Zstandard; needs the zstandard package). Any other file is read and
+# written as is. Files are streamed, never decompressed to disk, and text
+# output is collected and written in large chunks instead of line by line.
+
+# Bytes buffered by the underlying file objects.
+BUFFER_SIZE = 1 << 20
+# Characters of text output collected before they are encoded and written.
+CHUNK_SIZE = 1 << 20
+# Compression level of .gz output; level 9 (the gzip default) is several times slower for little gain.
+GZIP_LEVEL = 6
+EXTENSIONS = [".gz", ".xz", ".zst"]
+
+# Input: A file path.
+# Output: The compression extension of the path, or None for an uncompressed file.
+def compression(path):
+    ext = os.path.splitext(path)[1].lower()
+    return ext if ext in EXTENSIONS else None
+
+# Input 1: A file path.
+# Input 2: "rb" or "wb".
+# Output: A binary file object that (de)compresses according to the extension.
+def openRaw(path, mode="rb"):
+    ext = compression(path)
+    if ext == ".gz":
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+    if ext == ".xz":
+        return lzma.open(path, mode)
+    if ext == ".zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading or writing "+path+" requires the zstandard package: pip3 install zstandard")
+        raw = open(path, mode, buffering=BUFFER_SIZE)
+        if mode == "rb":
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, read_size=BUFFER_SIZE, closefd=True), BUFFER_SIZE)
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+    return open(path, mode, buffering=BUFFER_SIZE)
+
+# Input 1: A file path.
+# Input 2: "r" or "w".
+# Output: A text file object; a ChunkedWriter for "w".
+def openFile(path, mode="r"):
+    if mode == "r":
+        return io.TextIOWrapper(openRaw(path, "rb"), encoding="utf-8")
+    return ChunkedWriter(openRaw(path, "wb"), path)
+
+# Input: A file path.
+# Output: The whole (decompressed) text of the file.
+def readText(path):
+    with openFile(path) as in_file:
+        return in_file.read()
+
+class ChunkedWriter(object):
+
+    """
+    A text output file that collects the strings written to it and writes
+    them to the underlying (possibly compressed) binary file CHUNK_SIZE
+    characters at a time, so many small writes cost one encode and one
+    write call per chunk.
+    """
+
+    def __init__(self, raw, name, encoding="utf-8", chunk_size=CHUNK_SIZE):
+        self.raw = raw
+        self.name = name
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.pending_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    def write(self, text):
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.chunk_size: self.writeChunk()
+        return len(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    # Encodes and writes everything collected so far in one call.
+    def writeChunk(self):
+        if not self.pending: return
+        self.raw.write("".join(self.pending).encode(self.encoding))
+        self.pending = []
+        self.pending_size = 0
+
+    def flush(self):
+        self.writeChunk()
+        self.raw.flush()
+
+    # Output: The number of (uncompressed) bytes written so far.
+    def tell(self):
+        self.writeChunk()
+        return self.raw.tell()
+
+    def close(self):
+        if self.raw.closed: return
+        self.writeChunk()
+        self.raw.close()
@@ -0,0 +1,121 @@
+import string
+
+# Synthetic parallel sentences and m2 files for benchmarks and fuzzing.
+# Every generator takes a random.Random, so the same seed always gives the
+# same corpus on every machine and Python version.
+
+# Default vocabulary, used when no corpus is given to take words from.
+WORDS = ("the a an this that cat dog man woman child house car book idea time day "
+         "is are was were has have had do does did will can should must "
+         "go goes went see saw make made take took give gave eat ate run ran "
+         "big small good bad new old happy quick slow red "
+         "in on at of to for with from by about and but or because so "
+         "he she it they we you I him her them us my your their").split()
+PUNCT = [",", ".", "!", "?", ";"]
+CATS = ["R:NOUN", "R:VERB", "R:VERB:SVA", "R:VERB:TENSE", "R:NOUN:NUM", "R:SPELL", "R:ORTH",
+        "R:PREP", "R:DET", "R:WO", "R:OTHER", "M:DET", "M:PREP", "M:PUNCT", "U:DET", "U:PUNCT", "UNK"]
+
+# Input 1: A random.Random.
+# Input 2: A word.
+# Output: The word with one character inserted, deleted, replaced or swapped.
+def misspell(rng, word):
+    i = rng.randrange(len(word))
+    op = rng.randrange(4)
+    char = rng.choice(string.ascii_lowercase)
+    if op == 0: return word[:i]+char+word[i:]
+    if op == 1 and len(word) > 1: return word[:i]+word[i+1:]
+    if op == 2 or i == len(word)-1: return word[:i]+char+word[i+1:]
+    return word[:i]+word[i+1]+word[i]+word[i+2:]
+
+# Input 1: A random.Random.
+# Input 2: The number of tokens in the original sentence.
+# Input 3: The probability that a token is edited (substituted, misspelled, deleted or preceded by an insertion).
+# Input 4: The probability that a transposition of 2-3 tokens starts at a token.
+# Input 5: The probability that a token gets case or punctuation noise.
+# Input 6: A list of words to sample from.
+# Output 1-2: The original and corrected token lists.
+def makePair(rng, length, density, transposition, noise, words=WORDS):
+    orig = [rng.choice(words) for _ in range(length)]
+    cor = []
+    i = 0
+    while i < len(orig):
+        # Reorder a short window of tokens.
+        if rng.random() < transposition and i+1 < len(orig):
+            k = min(rng.choice([2, 3]), len(orig)-i)
+            window = orig[i:i+k]
+            rng.shuffle(window)
+            cor.extend(window)
+            i += k
+            continue
+        tok = orig[i]
+        if rng.random() < density:
+            op = rng.randrange(4)
+            if op == 0: cor.append(rng.choice(words))
+            elif op == 1: cor.append(misspell(rng, tok))
+            elif op == 2: pass
+            else: cor.extend([rng.choice(words), tok])
+        else:
+            cor.append(tok)
+        i += 1
+    # Case and punctuation noise, on both sides.
+    for sent in [orig, cor]:
+        for j in range(len(sent)):
+            if rng.random() < noise:
+                sent[j] = sent[j].capitalize() if sent[j].islower() else sent[j].lower()
+        if rng.random() < noise*len(sent):
+            sent.insert(rng.randint(0, len(sent)), rng.choice(PUNCT))
+    return orig, cor
+
+# Input 1: A random.Random.
+# Input 2: The number of pairs.
+# Input 3-6: See makePair.
+# Input 7: A list of words to sample from.
+# Output: A list of (orig, cor) sentence strings, with space separated tokens.
+def makePairs(rng, num_pairs, length, density, transposition, noise, words=WORDS):
+    pairs = []
+    for _ in range(num_pairs):
+        orig, cor = makePair(rng, length, density, transposition, noise, words)
+        pairs.append((" ".join(orig), " ".join(cor)))
+    return pairs
+
+# Input 1: A random.Random.
+# Input 2: The number of tokens in the sentence.
+# Input 3: The coder id.
+# Input 4: The average number of edits per token.
+# Output: A list of edit lines for one coder in m2 format.
+def makeEditLines(rng, length, coder, density):
+    if rng.random() < 0.1:
+        return ["A -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||"+str(coder)]
+    lines = []
+    pos = 0
+    while pos < length:
+        if rng.random() < density:
+            end = min(length, pos+rng.randint(0, 2))
+            cor = " ".join(rng.choice(WORDS) for _ in range(rng.randint(0 if end > pos else 1, 2)))
+            lines.append("|||".join(["A "+str(pos)+" "+str(end), rng.choice(CATS), cor, "REQUIRED", "-NONE-", str(coder)]))
+            pos = end+1
+        else:
+            pos += 1
+    return lines
+
+# Input 1: A random.Random.
+# Input 2: The number of sentences.
+# Input 3: The number of tokens in each sentence.
+# Input 4: The average number of edits per token.
+# Input 5: The number of coders.
+# Output 1: A list of reference sentence+edit blocks in m2 format.
+# Output 2: A list of hypothesis blocks for the same sentences, which keep
+# about half of coder 0's reference edits and add some of their own.
+def makeM2(rng, num_sents, length, density, coders=2):
+    ref_m2 = []
+    hyp_m2 = []
+    for _ in range(num_sents):
+        sent = "S "+" ".join(rng.choice(WORDS) for _ in range(length))
+        ref_lines = []
+        for coder in range(coders):
+            ref_lines.extend(makeEditLines(rng, length, coder, density))
+        hyp_lines = [line for line in ref_lines if line.endswith("|||0") and "noop" not in line and rng.random() < 0.5]
+        hyp_lines.extend(makeEditLines(rng, length, 0, density/2))
+        ref_m2.append("\n".join([sent]+ref_lines))
+        hyp_m2.append("\n".join([sent]+sorted(set(hyp_lines), key=hyp_lines.index)))
+    return hyp_m2, ref_m2
@@ -36,6 +36,13 @@ def processM2(info):
     all_edits = info[1:]
     # Simplify the edits and group by coder id.
     edit_dict = processEdits(all_edits)
+    return orig_sent, applyEdits(orig_sent, edit_dict)
+
+# Input 1: The original sentence (a list of tokens)
+# Input 2: An edit dictionary; key is coder id, value is a list of edits.
+# Output: A dictionary; key is coder id, value is a tuple.
+# tuple[0] is the corrected sentence (a list of tokens), tuple[1] is the edits.
+def applyEdits(orig_sent, edit_dict):
     out_dict = {}
     # Loop through each coder and their edits.
     for coder, edits in edit_dict.items():
@@ -62,7 +69,7 @@ def processM2(info):
             gold_edits.append(edit+[cor_start]+[cor_end])
         # Save the cor_sent and gold_edits for each annotator in the out_dict.
         out_dict[coder] = (cor_sent, gold_edits)
-    return orig_sent, out_dict
+    return out_dict
 
 # Input: A list of edit lines for a sentence in an m2 file.
 # Output: An edit dictionary; key is coder id, value is a list of edits.
@@ -0,0 +1,42 @@
+import argparse
+import os
+import sys
+import scripts.result_cache as result_cache
+
+def main(args):
+    if not os.path.exists(args.cache):
+        sys.exit("No such cache: "+args.cache)
+    cache = result_cache.ResultCache(args.cache, int(args.cache_mb*1024*1024) if args.cache_mb else float("inf"))
+    checked, bad, integrity = cache.verify(args.repair)
+    print("Checked {} m2 blocks ({:.1f} MB); SQLite integrity check: {}.".format(checked, cache.size/1024/1024, integrity))
+    for key in bad:
+        print("Corrupt block: "+key)
+    if bad:
+        print("{} corrupt blocks{}.".format(len(bad), " were deleted" if args.repair else "; use -repair to delete them"))
+    # Shrink the cache to a new size limit, if required.
+    deleted = args.repair and bad
+    if args.cache_mb and cache.size > cache.max_bytes:
+        cache.evict()
+        deleted = True
+        print("Evicted down to {:.1f} MB of blocks; {} blocks remain.".format(cache.size/1024/1024, len(cache)))
+    # Deleting blocks does not shrink the file until it is vacuumed.
+    if deleted or args.vacuum:
+        file_size = os.path.getsize(args.cache)
+        print("Vacuumed the file from {:.1f} MB to {:.1f} MB.".format(file_size/1024/1024, cache.vacuum()/1024/1024))
+    cache.close()
+    if integrity != "ok" or (bad and not args.repair): sys.exit(1)
+
+if __name__ == "__main__":
+    # Define and parse program input
+    parser = argparse.ArgumentParser(description="Verify a parallel_to_m2.py -cache file: run the SQLite integrity check and\n"
+                                                 "check every m2 block against its checksum.",
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     usage="%(prog)s [-h] [options] -cache CACHE")
+    parser.add_argument("-cache", help="The cache filepath.", required=True)
+    parser.add_argument("-repair", help="Delete corrupt blocks; they are processed again on the next run.", action="store_true")
+    parser.add_argument("-cache_mb", help="Also evict the least recently used blocks until their total compressed size is\n"
+                                          "under this many MB, then vacuum the file so it shrinks.", type=float, default=0)
+    parser.add_argument("-vacuum", help="Vacuum the file even if no blocks were deleted.", action="store_true")
+    args = parser.parse_args()
+    # Run the program.
+    main(args)